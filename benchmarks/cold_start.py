@@ -0,0 +1,149 @@
+"""Cold start: how long from a fresh process to the first served page.
+
+Three measurements:
+
+* importtime - `python -X importtime -c "import app"`: total import time, number of modules
+               and the slowest imports (self time), to see what startup pays for
+* import     - median wall time of `import app` (which runs create_app) over --runs fresh
+               interpreters
+* gunicorn   - spawn to first 200 on /login for `gunicorn -c gunicorn.conf.py app:app`, with
+               and without GUNICORN_PRELOAD, and the memory of master plus workers afterwards
+               (RSS counts shared pages once per process, PSS splits them between them)
+
+    python benchmarks/cold_start.py --runs 5 --workers 4
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+import requests
+
+from common import ROOT, RESULTS_DIR, app_env, create_tables, free_port, temp_sqlite_url
+from load_test import process_tree, rss_mb
+
+
+def pss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def import_profile(env, top):
+    # Each line is "import time: <self us> | <cumulative us> | <indented module name>"
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stderr
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us), len(name) - len(name.lstrip())))
+    roots = [cumulative for _, _, cumulative, depth in modules if depth == 1]
+    slowest = sorted(modules, key=lambda m: m[1], reverse=True)[:top]
+    # The heaviest packages imported directly or by one of our modules, by cumulative time
+    packages = {}
+    for name, _, cumulative, _ in modules:
+        package = name.split(".")[0]
+        packages[package] = max(packages.get(package, 0), cumulative)
+    return {
+        "total_ms": round(sum(roots) / 1000, 1),
+        "modules": len(modules),
+        "slowest_self_ms": {name: round(self_us / 1000, 1) for name, self_us, _, _ in slowest},
+        "packages_ms": {name: round(us / 1000, 1) for name, us in
+                        sorted(packages.items(), key=lambda p: p[1], reverse=True)[:top]},
+    }
+
+
+def import_wall(env, runs):
+    script = "import time\nstart = time.perf_counter()\nimport app\nprint(time.perf_counter() - start)"
+    times = [float(subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env, capture_output=True,
+                                  text=True, check=True).stdout.split()[-1]) for _ in range(runs)]
+    return {"median_ms": round(statistics.median(times) * 1000, 1), "min_ms": round(min(times) * 1000, 1)}
+
+
+def gunicorn_cold_start(env, preload, requests_after):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/login"
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"], cwd=ROOT,
+                               env=dict(env, PORT=str(port), GUNICORN_PRELOAD=str(preload)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if time.perf_counter() - start > 60:
+                raise RuntimeError("Gunicorn did not serve /login within 60s")
+            try:
+                if requests.get(url, timeout=10).status_code == 200:
+                    break
+            except requests.RequestException:
+                pass
+            time.sleep(0.01)
+        first_200 = time.perf_counter() - start
+        # Each worker's first request is where a non-preloaded app still pays for lazy imports
+        # and template compilation; with several workers these land on different ones
+        latencies = []
+        for _ in range(requests_after):
+            request_start = time.perf_counter()
+            requests.get(url, timeout=10).raise_for_status()
+            latencies.append(time.perf_counter() - request_start)
+        pids = process_tree(process.pid)
+        return {
+            "first_200_ms": round(first_200 * 1000, 1),
+            "max_following_ms": round(max(latencies) * 1000, 1) if latencies else None,
+            "processes": len(pids),
+            "rss_mb": round(sum(rss_mb(pid) for pid in pids), 1),
+            "pss_mb": round(sum(pss_mb(pid) for pid in pids), 1),
+        }
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=2, help="WEB_CONCURRENCY")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    env = app_env(temp_sqlite_url(), "http://127.0.0.1:9/v1", WEB_CONCURRENCY=args.workers)
+    create_tables(env)
+    results = {
+        "importtime": import_profile(env, args.top),
+        "import": import_wall(env, args.runs),
+        "gunicorn": {},
+    }
+    for preload in (False, True):
+        runs = [gunicorn_cold_start(env, preload, args.workers * 4) for _ in range(args.runs)]
+        best = min(runs, key=lambda run: run["first_200_ms"])
+        results["gunicorn"]["preload" if preload else "default"] = dict(
+            best, first_200_median_ms=round(statistics.median(run["first_200_ms"] for run in runs), 1))
+
+    profile = results["importtime"]
+    print(f"import app: {profile['total_ms']} ms over {profile['modules']} modules "
+          f"(wall median {results['import']['median_ms']} ms)")
+    print("Heaviest packages (cumulative ms): " +
+          ", ".join(f"{name} {ms}" for name, ms in profile["packages_ms"].items()))
+    print(f"{'gunicorn':<10} {'first 200 ms':>13} {'median':>8} {'next max ms':>12} {'RSS MB':>8} {'PSS MB':>8}")
+    for name, row in results["gunicorn"].items():
+        print(f"{name:<10} {row['first_200_ms']:>13} {row['first_200_median_ms']:>8} "
+              f"{row['max_following_ms']!s:>12} {row['rss_mb']:>8} {row['pss_mb']:>8}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, "cold_start.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+import socket
+import tempfile
+import subprocess
+import statistics
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+sys.path.insert(0, ROOT)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1) if latencies else None,
+    }
+
+
+def app_env(database_url, openai_base_url, **overrides):
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": database_url,
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_BASE_URL": openai_base_url,
+        "SECRET_KEY": "benchmark",
+    })
+    env.update({key: str(value) for key, value in overrides.items()})
+    return env
+
+
+def temp_sqlite_url():
+    fd, path = tempfile.mkstemp(suffix=".db", prefix="nutritrack-bench-")
+    os.close(fd)
+    return f"sqlite:///{path}"
+
+
+def create_tables(env):
+    subprocess.run(
+        [sys.executable, "-c",
+         "from nutritrack import create_app, db\n"
+         "app = create_app()\n"
+         "with app.app_context():\n"
+         "    db.create_all()\n"],
+        cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL,
+    )
+
+
+class GunicornServer:
+    def __init__(self, env, *extra_args):
+        self.port = free_port()
+        self.env = dict(env, PORT=str(self.port))
+        self.args = extra_args
+        self.process = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", *self.args, "app:app"],
+            cwd=ROOT, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                requests.get(self.url + "/", timeout=5)
+                return self
+            except requests.RequestException:
+                time.sleep(0.2)
+        self.__exit__()
+        raise RuntimeError("Gunicorn did not start within 30s")
+
+    def __exit__(self, *exc):
+        if self.process:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+
+
+def login_session(base_url, email, password="benchmark"):
+    session = requests.Session()
+    session.post(base_url + "/register", data={
+        "username": email.split("@")[0], "email": email, "password": password, "password2": password,
+    }, allow_redirects=False)
+    response = session.post(base_url + "/login", data={"email": email, "password": password},
+                            allow_redirects=False)
+    if response.status_code != 302:
+        raise RuntimeError(f"Login failed for {email}: {response.status_code}")
+    return session
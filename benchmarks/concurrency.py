@@ -0,0 +1,108 @@
+"""How many concurrent /nutrition requests the app sustains, before and after.
+
+"before" runs plain sync Gunicorn workers; "after" runs gunicorn.conf.py (threaded
+workers, model calls bounded by AI_MAX_CONCURRENCY). Both talk to the fake OpenAI
+server with the same latency. While each burst of /nutrition requests is in flight a
+probe keeps requesting /login, which is what users without a pending analysis feel.
+
+    python benchmarks/concurrency.py --latency 2 --levels 2 4 8 16 32
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from common import RESULTS_DIR, GunicornServer, app_env, create_tables, login_session, summarize, temp_sqlite_url
+from fake_openai import FakeOpenAI
+
+MODES = {
+    "before": {"GUNICORN_WORKER_CLASS": "sync", "GUNICORN_THREADS": 1},
+    "after": {},
+}
+
+
+def run_level(base_url, cookies, level, run_id):
+    latencies, errors = [], 0
+    probe_latencies = []
+    stop = threading.Event()
+
+    def probe():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                requests.get(base_url + "/login", timeout=30)
+                probe_latencies.append(time.perf_counter() - start)
+            except requests.RequestException:
+                probe_latencies.append(30.0)
+            time.sleep(0.05)
+
+    def analyze(i):
+        start = time.perf_counter()
+        response = requests.post(base_url + "/nutrition", cookies=cookies, timeout=120, data={
+            "food_name": f"benchmark meal {run_id}-{level}-{i}",
+            "ingredients": f"ingredient {i}, sauce {i}",
+            "preparation": "stir fried",
+        })
+        ok = response.status_code == 200 and b"Nutrition analysis saved" in response.content
+        return ok, time.perf_counter() - start
+
+    probe_thread = threading.Thread(target=probe, daemon=True)
+    probe_thread.start()
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=level) as pool:
+        for ok, elapsed in pool.map(analyze, range(level)):
+            latencies.append(elapsed)
+            errors += 0 if ok else 1
+    wall = time.perf_counter() - wall_start
+    stop.set()
+    probe_thread.join()
+
+    return {
+        "concurrency": level,
+        "errors": errors,
+        "wall_s": round(wall, 2),
+        "throughput_rps": round(level / wall, 2),
+        "nutrition": summarize(latencies),
+        "login_probe": summarize(probe_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=2.0, help="Fake model latency in seconds.")
+    parser.add_argument("--levels", type=int, nargs="+", default=[2, 4, 8, 16, 32])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "concurrency.json"))
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(latency=args.latency).start()
+    results = {}
+    try:
+        for mode, overrides in MODES.items():
+            env = app_env(temp_sqlite_url(), fake.base_url, WEB_CONCURRENCY=args.workers,
+                          ANALYSIS_CACHE_BACKEND="none", **overrides)
+            create_tables(env)
+            with GunicornServer(env) as server:
+                cookies = login_session(server.url, f"{mode}@bench.local").cookies
+                results[mode] = [run_level(server.url, cookies, level, mode) for level in args.levels]
+
+            print(f"\n== {mode} ==")
+            print(f"{'conc':>5} {'errors':>6} {'req/s':>7} {'p95 ms':>9} {'/login p95 ms':>14}")
+            for row in results[mode]:
+                print(f"{row['concurrency']:>5} {row['errors']:>6} {row['throughput_rps']:>7} "
+                      f"{row['nutrition']['p95_ms']:>9} {row['login_probe']['p95_ms']:>14}")
+    finally:
+        fake.stop()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({"latency_s": args.latency, "workers": args.workers, "results": results}, f, indent=2)
+    print(f"\nSaved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""Minimal stand-in for the OpenAI chat completions API.
+
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1. Latency and
+failure injection are configurable so benchmarks don't depend on (or pay for) the
+real API. Set `down = True` on a running instance to simulate an outage (every call
+answers 503), and `stream: true` requests are answered as Server-Sent Events.
+`token_latency` adds time per completion token, and answers longer than the request's
+max_tokens are cut off with finish_reason "length", like the real API does. Image parts
+(vision calls) are counted in `images` / `image_bytes` and billed as image tokens.
+
+    python benchmarks/fake_openai.py --port 8765 --latency 1.5 --failure-rate 0.05
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+NUTRITION = {
+    "calories": {"value": 420, "unit": "kcal"}, "protein": {"value": 25, "unit": "g"},
+    "carbohydrates": {"value": 45, "unit": "g"}, "fats": {"value": 14, "unit": "g"},
+    "sugars": {"value": 6, "unit": "g"}, "fibre": {"value": 5, "unit": "g"},
+    "vitamins": {"Vitamin A": {"value": 120, "unit": "mcg"}, "Vitamin C": {"value": 15, "unit": "mg"}},
+    "minerals": {"Calcium": {"value": 80, "unit": "mg"}, "Iron": {"value": 2.5, "unit": "mg"}},
+    "insight": "A balanced meal.", "notes": "Synthetic benchmark response.",
+}
+# What a model writes when the prompt asks for the compact shape (nutritrack.prompts)
+COMPACT_NUTRITION = {
+    "calories": 420, "protein": 25, "carbohydrates": 45, "fats": 14, "sugars": 6, "fibre": 5,
+    "vitamins": {"Vitamin A": "120 mcg", "Vitamin C": "15 mg"}, "minerals": {"Calcium": "80 mg", "Iron": "2.5 mg"},
+    "insight": "A balanced meal.", "notes": "Synthetic benchmark response.",
+}
+MEAL_PLAN = {
+    "meal_name": "Benchmark Bowl", "ingredients": ["rice", "chicken", "broccoli"],
+    "preparation": "Cook and combine.",
+    "nutrition": {"calories": 550, "protein": 40, "carbs": 60, "fats": 12, "sugars": 4, "fibre": 6},
+    "vitamins": {"Vitamin A": 90, "Vitamin C": 60}, "minerals": {"Calcium": 70, "Iron": 3},
+    "insights": "High protein and filling.",
+}
+INSIGHT = {"food_insight": "You logged a varied day.", "calorie_insight": "You are on track.",
+           "tip": "Drink some water."}
+EXPLANATION = {"explanation": "Your target starts from your resting burn, scaled for activity and adjusted for your goal."}
+
+
+def pick_response(prompt):
+    lowered = prompt.lower()
+    if '"explanation"' in lowered:
+        return EXPLANATION
+    if "meal plan" in lowered or "meal_name" in lowered:
+        return MEAL_PLAN
+    if "food_insight" in lowered:
+        return INSIGHT
+    nutrition = COMPACT_NUTRITION if '"calories":n' in lowered else NUTRITION
+    if "json array" in lowered:
+        return [nutrition] * max(1, len(re.findall(r"^\d+\. ", prompt, re.MULTILINE)))
+    return nutrition
+
+
+def prompt_text(messages):
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(p.get("text", "") for p in content if isinstance(p, dict))
+    return "\n".join(parts)
+
+
+def image_parts(messages):
+    return [part for message in messages if isinstance(message.get("content"), list)
+            for part in message["content"] if isinstance(part, dict) and part.get("type") == "image_url"]
+
+
+def image_tokens(part):
+    # What the API bills: a flat 85 at "low" detail, about a 1024px tiled image otherwise
+    return 85 if part["image_url"].get("detail") == "low" else 765
+
+
+class FakeOpenAI:
+    def __init__(self, latency=0.5, jitter=0.0, failure_rate=0.0, port=0, failure_status=429, retry_after="1",
+                 token_latency=0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.retry_after = retry_after
+        self.down = False
+        self.requests = 0
+        self.request_bytes = 0
+        self.images = 0
+        self.image_bytes = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload, headers=None):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                images = image_parts(request.get("messages", []))
+                with fake._lock:
+                    fake.requests += 1
+                    fake.request_bytes += length
+                    fake.images += len(images)
+                    fake.image_bytes += sum(len(part["image_url"]["url"]) for part in images)
+                time.sleep(max(0.0, fake.latency + random.uniform(-fake.jitter, fake.jitter)))
+
+                if fake.down:
+                    self._send(503, {"error": {"message": "Service unavailable (fake)", "type": "server_error"}})
+                    return
+                if random.random() < fake.failure_rate:
+                    headers = {"retry-after": fake.retry_after} if fake.retry_after is not None else {}
+                    self._send(fake.failure_status, {"error": {"message": "Injected failure (fake)", "type": "rate_limit"}},
+                               headers)
+                    return
+
+                prompt = prompt_text(request.get("messages", []))
+                content = json.dumps(pick_response(prompt))
+                finish_reason = "stop"
+                max_tokens = request.get("max_tokens")
+                if max_tokens and len(content) // 4 > max_tokens:
+                    content, finish_reason = content[:max_tokens * 4], "length"
+                prompt_tokens = max(1, len(prompt) // 4) + sum(image_tokens(part) for part in images)
+                completion_tokens = max(1, len(content) // 4)
+                time.sleep(completion_tokens * fake.token_latency)
+                if request.get("stream"):
+                    self._stream(request, content, finish_reason)
+                    return
+                self._send(200, {
+                    "id": f"chatcmpl-fake-{fake.requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "fake"),
+                    "choices": [{"index": 0, "finish_reason": finish_reason,
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens},
+                })
+
+            def _stream(self, request, content, finish_reason):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for i in range(0, len(content), 16):
+                    chunk = {
+                        "id": f"chatcmpl-fake-{fake.requests}", "object": "chat.completion.chunk",
+                        "created": int(time.time()), "model": request.get("model", "fake"),
+                        "choices": [{"index": 0, "delta": {"content": content[i:i + 16]}, "finish_reason": None}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                chunk["choices"] = [{"index": 0, "delta": {}, "finish_reason": finish_reason}]
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeOpenAI(args.latency, args.jitter, args.failure_rate, args.port, token_latency=args.token_latency)
+    print(f"Fake OpenAI listening on {fake.base_url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
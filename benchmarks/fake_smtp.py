@@ -0,0 +1,87 @@
+"""Local SMTP stand-in for the outbox sender, built on aiosmtpd.
+
+Point the app at it with MAIL_SERVER=127.0.0.1, MAIL_PORT=<port> and MAIL_USE_TLS=False.
+`handshake_latency` is added to every EHLO/HELO (the cost of a new connection with TLS and
+login on a real server) and `send_latency` to every message. A `failure_rate` share of
+recipients is answered with a temporary 451, and any address containing "bounce" with a
+permanent 550. Received messages are kept in `messages`, and `connections` counts sessions.
+
+    python benchmarks/fake_smtp.py --port 8025 --handshake-latency 0.3
+"""
+import time
+import random
+import asyncio
+import argparse
+import threading
+
+from aiosmtpd.controller import Controller
+
+from common import free_port
+
+
+class FakeSMTP:
+    def __init__(self, handshake_latency=0.0, send_latency=0.0, failure_rate=0.0, port=0):
+        self.handshake_latency = handshake_latency
+        self.send_latency = send_latency
+        self.failure_rate = failure_rate
+        self.port = port or free_port()
+        self.messages = []
+        self.connections = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self.controller = Controller(self, hostname="127.0.0.1", port=self.port)
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        with self._lock:
+            self.connections += 1
+        await asyncio.sleep(self.handshake_latency)
+        session.host_name = hostname
+        return responses
+
+    async def handle_HELO(self, server, session, envelope, hostname):
+        with self._lock:
+            self.connections += 1
+        await asyncio.sleep(self.handshake_latency)
+        session.host_name = hostname
+        return "250 {}".format(server.hostname)
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if "bounce" in address:
+            with self._lock:
+                self.rejected += 1
+            return "550 5.1.1 Mailbox does not exist"
+        if random.random() < self.failure_rate:
+            with self._lock:
+                self.rejected += 1
+            return "451 4.3.0 Try again later"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.send_latency)
+        with self._lock:
+            self.messages.append({"from": envelope.mail_from, "to": list(envelope.rcpt_tos),
+                                  "data": envelope.content, "received_at": time.time()})
+        return "250 Message accepted for delivery"
+
+    def start(self):
+        self.controller.start()
+        return self
+
+    def stop(self):
+        self.controller.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--handshake-latency", type=float, default=0.3)
+    parser.add_argument("--send-latency", type=float, default=0.05)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeSMTP(args.handshake_latency, args.send_latency, args.failure_rate, args.port).start()
+    print(f"Fake SMTP listening on 127.0.0.1:{fake.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,244 @@
+"""Load test: seeded users hammering the main pages, against the fake OpenAI server.
+
+Seeds a database (benchmarks/seed.py) with synthetic users holding thousands of
+History / MealPlan rows, starts the app under Gunicorn with OPENAI_BASE_URL pointed at
+benchmarks/fake_openai.py, and drives /dashboard, /history, /your-meals, /profile,
+/nutrition and /plan-meal concurrently for a fixed time. Reports throughput, p50/p95/p99
+per route and peak RSS of the Gunicorn processes, and saves everything as JSON; pass an
+earlier result as --baseline to see what changed.
+
+    python benchmarks/load_test.py --users 20 --rows 2000 --concurrency 16 --duration 30
+    python benchmarks/load_test.py --baseline benchmarks/results/load_test-before.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import threading
+import subprocess
+from datetime import datetime
+
+import requests
+
+from common import ROOT, RESULTS_DIR, GunicornServer, app_env, summarize, temp_sqlite_url
+from fake_openai import FakeOpenAI
+from seed import PASSWORD, user_email
+
+# route -> (method, path, weight)
+ROUTES = {
+    "dashboard": ("GET", "/dashboard", 30),
+    "history": ("GET", "/history", 20),
+    "your-meals": ("GET", "/your-meals", 15),
+    "profile": ("GET", "/profile", 15),
+    "nutrition": ("POST", "/nutrition", 10),
+    "plan-meal": ("POST", "/plan-meal", 10),
+}
+# A flashed error; model failures still answer 200
+FAILURE_MARKER = b"alert alert-danger"
+
+
+def seed_database(env, args):
+    subprocess.run(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "seed.py"), "--users", str(args.users),
+         "--rows", str(args.rows), "--meal-plans", str(args.meal_plans), "--days", str(args.days),
+         "--seed", str(args.seed)],
+        cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL,
+    )
+
+
+def process_tree(pid):
+    pids = [pid]
+    for parent in pids:
+        try:
+            with open(f"/proc/{parent}/task/{parent}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class RssSampler(threading.Thread):
+    # Peak resident memory of the Gunicorn master plus its workers (Linux /proc)
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_total_mb = 0.0
+        self.peak_process_mb = 0.0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            sizes = [rss_mb(pid) for pid in process_tree(self.pid)]
+            self.peak_total_mb = max(self.peak_total_mb, sum(sizes))
+            self.peak_process_mb = max(self.peak_process_mb, max(sizes, default=0.0))
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def login(base_url, n):
+    session = requests.Session()
+    response = session.post(base_url + "/login", data={"email": user_email(n), "password": PASSWORD},
+                            allow_redirects=False)
+    if response.status_code != 302:
+        raise RuntimeError(f"Login failed for {user_email(n)}: {response.status_code}")
+    return session
+
+
+def send(session, base_url, route, n):
+    method, path, _ = ROUTES[route]
+    if route == "nutrition":
+        data = {"food_name": f"load test meal {n}", "ingredients": f"rice, chicken {n}", "preparation": "stir fried"}
+    elif route == "plan-meal":
+        data = {"requirements": f"high protein dinner {n}"}
+    else:
+        data = None
+    response = session.request(method, base_url + path, data=data, timeout=120)
+    return response.status_code == 200 and FAILURE_MARKER not in response.content
+
+
+def drive(base_url, args):
+    # Each client thread logs in as its own seeded user and picks routes by weight
+    names = list(ROUTES)
+    weights = [ROUTES[name][2] for name in names]
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    measure_from = time.perf_counter() + args.warmup
+    stop_at = measure_from + args.duration
+
+    def client(index):
+        rng = random.Random(args.seed * 1000 + index)
+        session = login(base_url, index % args.users)
+        n = 0
+        while time.perf_counter() < stop_at:
+            route = rng.choices(names, weights)[0]
+            n += 1
+            start = time.perf_counter()
+            try:
+                ok = send(session, base_url, route, f"{index}-{n}")
+            except requests.RequestException:
+                ok = False
+            if start < measure_from:
+                continue
+            with lock:
+                latencies[route].append(time.perf_counter() - start)
+                errors[route] += 0 if ok else 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def change(new, old):
+        return f"{(new - old) / old:+.1%}" if new is not None and old else "n/a"
+
+    print(f"\nvs {baseline_path} ({baseline['meta'].get('git_revision')}):")
+    print(f"{'route':<12} {'req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    rows = [("total", results["total"], baseline["total"])] + [
+        (name, row, baseline["routes"].get(name, {})) for name, row in results["routes"].items()]
+    for name, new, old in rows:
+        print(f"{name:<12} {change(new.get('throughput_rps'), old.get('throughput_rps')):>9} "
+              + " ".join(f"{change(new.get(k), old.get(k)):>9}" for k in ("p50_ms", "p95_ms", "p99_ms")))
+    print(f"{'peak RSS':<12} {change(results['peak_rss_mb']['total'], baseline['peak_rss_mb']['total']):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="Use this database instead of a new temporary SQLite file.")
+    parser.add_argument("--skip-seed", action="store_true", help="The database is already seeded.")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=2000, help="History rows per user.")
+    parser.add_argument("--meal-plans", type=int, default=200, help="Meal plans per user.")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake model latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of model calls answered with 429.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Simultaneous clients.")
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds.")
+    parser.add_argument("--warmup", type=float, default=3, help="Seconds of load before measuring.")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "load_test.json"))
+    parser.add_argument("--baseline", help="An earlier result file to compare against.")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    fake = FakeOpenAI(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate).start()
+    try:
+        env = app_env(args.database_url or temp_sqlite_url(), fake.base_url, WEB_CONCURRENCY=args.workers)
+        if not args.skip_seed:
+            seed_started = time.perf_counter()
+            seed_database(env, args)
+            print(f"Seeded {args.users} users x {args.rows} rows in {time.perf_counter() - seed_started:.1f}s")
+        with GunicornServer(env) as server:
+            sampler = RssSampler(server.process.pid)
+            sampler.start()
+            latencies, errors = drive(server.url, args)
+            sampler.stop()
+    finally:
+        fake.stop()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"), "git_revision": git_revision(),
+            "python": platform.python_version(), "database": "postgresql" if args.database_url and
+            args.database_url.startswith("postgres") else "sqlite", "args": vars(args),
+        },
+        "total": {"errors": sum(errors.values()), "throughput_rps": round(len(all_latencies) / args.duration, 2),
+                  **summarize(all_latencies)},
+        "routes": {name: {"errors": errors[name], "throughput_rps": round(len(values) / args.duration, 2),
+                          **summarize(values)} for name, values in latencies.items()},
+        "peak_rss_mb": {"total": round(sampler.peak_total_mb, 1), "largest_process": round(sampler.peak_process_mb, 1)},
+    }
+
+    print(f"{'route':<12} {'count':>6} {'errors':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, row in [("total", results["total"])] + list(results["routes"].items()):
+        print(f"{name:<12} {row['count']:>6} {row['errors']:>6} {row['throughput_rps']:>7} "
+              f"{row['p50_ms']!s:>8} {row['p95_ms']!s:>8} {row['p99_ms']!s:>8}")
+    print(f"peak RSS: {results['peak_rss_mb']['total']} MB total, "
+          f"{results['peak_rss_mb']['largest_process']} MB largest process")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Password-reset email: inline SMTP versus the outbox, against the fake SMTP server.
+
+Runs /forgot-password in-process for --requests distinct users three ways and reports the
+route's latency, how long delivery took, how many SMTP connections were opened and whether
+every message arrived:
+
+* inline   - MAIL_OUTBOX=False, each request opens its own SMTP session (the old behaviour)
+* outbox   - the request only queues the email; `flask send-mail --once` style drain afterwards
+* flaky    - the outbox again, with --failure-rate of recipients answered 451 and one bouncing
+             address answered 550, drained until nothing is due
+
+    python benchmarks/mail_outbox.py --requests 50 --handshake-latency 0.3
+"""
+import os
+import json
+import time
+import argparse
+
+from common import RESULTS_DIR, summarize, temp_sqlite_url
+from fake_smtp import FakeSMTP
+
+
+def make_app(fake, **config):
+    os.environ.update({"DATABASE_URL": temp_sqlite_url(), "OPENAI_API_KEY": "sk-benchmark",
+                       "MAIL_SERVER": "127.0.0.1", "MAIL_PORT": str(fake.port), "MAIL_USE_TLS": "False",
+                       "MAIL_USERNAME": "noreply@bench.local", "MAIL_PASSWORD": "",
+                       "MAIL_SENDER_THREAD": "False", "MAIL_RETRY_BACKOFF": "0"})
+    os.environ.update({key: str(value) for key, value in config.items()})
+    from nutritrack import create_app, db
+    from nutritrack.migrations import upgrade
+    from nutritrack.models import User
+
+    app = create_app()
+    with app.app_context():
+        upgrade()
+        db.session.add_all(User(username=f"reset{n}", email=f"reset{n}@bench.local") for n in range(500))
+        db.session.add(User(username="bounce", email="bounce@bench.local"))
+        db.session.commit()
+    return app
+
+
+def request_resets(app, emails):
+    client = app.test_client()
+    latencies = []
+    for email in emails:
+        start = time.perf_counter()
+        response = client.post("/forgot-password", data={"email": email})
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 302, response.status_code
+    return latencies
+
+
+def scenario(fake, emails, **config):
+    from nutritrack import mail_outbox
+    from nutritrack.models import OutboxEmail
+
+    app = make_app(fake, **config)
+    fake.messages.clear()
+    fake.connections = 0
+    latencies = request_resets(app, emails)
+
+    start = time.perf_counter()
+    with app.app_context():
+        if app.config['MAIL_OUTBOX']:
+            while mail_outbox.drain():
+                pass
+        statuses = {status: OutboxEmail.query.filter_by(status=status).count()
+                    for status in ("queued", "sending", "sent", "failed")}
+        attempts = sum(email.attempts for email in OutboxEmail.query.all())
+    return {
+        "route": summarize(latencies),
+        "delivery_s": round(time.perf_counter() - start, 3),
+        "smtp_connections": fake.connections,
+        "delivered": len(fake.messages),
+        "outbox": statuses if app.config['MAIL_OUTBOX'] else None,
+        "attempts": attempts if app.config['MAIL_OUTBOX'] else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--handshake-latency", type=float, default=0.3, help="Seconds per new SMTP connection.")
+    parser.add_argument("--send-latency", type=float, default=0.02, help="Seconds per message.")
+    parser.add_argument("--failure-rate", type=float, default=0.2, help="Share of recipients answered 451 (flaky).")
+    parser.add_argument("--batch-size", type=int, default=50)
+    args = parser.parse_args()
+
+    emails = [f"reset{n}@bench.local" for n in range(args.requests)]
+    fake = FakeSMTP(args.handshake_latency, args.send_latency).start()
+    try:
+        results = {"requests": args.requests, "handshake_latency_s": args.handshake_latency,
+                   "send_latency_s": args.send_latency, "scenarios": {}}
+        results["scenarios"]["inline"] = scenario(fake, emails, MAIL_OUTBOX="False")
+        results["scenarios"]["outbox"] = scenario(fake, emails, MAIL_OUTBOX="True", MAIL_BATCH_SIZE=args.batch_size)
+        fake.failure_rate = args.failure_rate
+        results["scenarios"]["flaky"] = scenario(fake, emails + ["bounce@bench.local"], MAIL_OUTBOX="True",
+                                                 MAIL_BATCH_SIZE=args.batch_size, MAIL_MAX_ATTEMPTS=10)
+    finally:
+        fake.stop()
+
+    print(f"{'scenario':<8} {'p50 ms':>8} {'p95 ms':>8} {'delivery s':>11} {'conns':>6} {'delivered':>10} {'attempts':>9}")
+    for name, row in results["scenarios"].items():
+        print(f"{name:<8} {row['route']['p50_ms']:>8} {row['route']['p95_ms']:>8} {row['delivery_s']:>11} "
+              f"{row['smtp_connections']:>6} {row['delivered']:>10} {row['attempts']!s:>9}")
+        if row["outbox"]:
+            print(f"         outbox: {row['outbox']}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, "mail_outbox.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    main()
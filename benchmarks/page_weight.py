@@ -0,0 +1,99 @@
+"""Page weight: bytes a browser downloads for the main pages, first visit and repeat visit.
+
+Builds the static assets (`flask build-assets`), seeds one user with history and meal plans,
+and fetches each page in-process the way a browser would: the HTML, then every same-origin
+asset it references. Each page is fetched with Accept-Encoding identity, gzip and br, and
+reports the HTML and asset bytes on the wire. "Repeat" counts the requests a returning
+browser still sends: the HTML, and any asset without a long-lived Cache-Control (assets on
+other origins, such as the Bootstrap CDN, are listed but not counted).
+
+    python benchmarks/page_weight.py --rows 200
+"""
+import os
+import re
+import json
+import argparse
+
+from common import RESULTS_DIR, temp_sqlite_url
+from seed import PASSWORD, seed, user_email
+
+PAGES = ("/login", "/dashboard", "/history", "/your-meals", "/profile", "/nutrition")
+ENCODINGS = {"identity": "identity", "gzip": "gzip, deflate", "br": "gzip, deflate, br"}
+ASSET = re.compile(rb'(?:src|href)="([^"]+\.(?:js|css|png|jpg|webp|svg|ico)[^"]*)"')
+
+
+def cacheable(response):
+    control = response.headers.get("Cache-Control", "")
+    match = re.search(r"max-age=(\d+)", control)
+    return bool(match) and int(match.group(1)) >= 24 * 3600 and "no-cache" not in control
+
+
+def fetch_page(client, path, accept_encoding):
+    headers = {"Accept-Encoding": accept_encoding}
+    response = client.get(path, headers=headers)
+    assert response.status_code == 200, (path, response.status_code)
+    html_bytes = len(response.data)
+    # The test client doesn't decode, so the body is what went over the wire
+    body = response.data
+    if response.headers.get("Content-Encoding") == "br":
+        import brotli
+        body = brotli.decompress(body)
+    elif response.headers.get("Content-Encoding") == "gzip":
+        import gzip
+        body = gzip.decompress(body)
+
+    assets, external, revalidated = 0, [], 0
+    for url in sorted(set(ASSET.findall(body))):
+        url = url.decode()
+        if url.startswith(("http://", "https://", "//")):
+            external.append(url)
+            continue
+        asset = client.get(url, headers=headers)
+        assets += len(asset.get_data())
+        revalidated += not cacheable(asset)
+        asset.close()
+    return {"html_bytes": html_bytes, "asset_bytes": assets, "total_bytes": html_bytes + assets,
+            "repeat_requests": 1 + revalidated, "external": external}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200, help="History rows for the seeded user.")
+    parser.add_argument("--meal-plans", type=int, default=10)
+    parser.add_argument("--no-build", action="store_true", help="Measure without running build-assets first.")
+    args = parser.parse_args()
+
+    os.environ.update({"DATABASE_URL": temp_sqlite_url(), "OPENAI_API_KEY": "sk-benchmark"})
+    from nutritrack import create_app, assets
+    from nutritrack.assets import build_assets
+
+    app = create_app()
+    if not args.no_build:
+        build_assets(app.static_folder)
+        assets.load_manifest()
+    with app.app_context():
+        seed(1, args.rows, args.meal_plans, 30, 1)
+    client = app.test_client()
+    response = client.post("/login", data={"email": user_email(0), "password": PASSWORD})
+    assert response.status_code == 302, response.status_code
+
+    results = {"build": not args.no_build, "rows": args.rows, "pages": {}}
+    for path in PAGES:
+        results["pages"][path] = {name: fetch_page(client, path, value) for name, value in ENCODINGS.items()}
+
+    print(f"{'page':<12} " + " ".join(f"{name + ' KB':>12}" for name in ENCODINGS) + f" {'repeat reqs':>12}")
+    for path, row in results["pages"].items():
+        print(f"{path:<12} " + " ".join(f"{row[name]['total_bytes'] / 1024:>12.1f}" for name in ENCODINGS)
+              + f" {row['br']['repeat_requests']:>12}")
+    external = sorted({url for row in results["pages"].values() for url in row["br"]["external"]})
+    print("Not counted (other origins): " + (", ".join(external) or "none"))
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, "page_weight.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Meal photo analysis end to end, against the fake OpenAI server.
+
+Posts /nutrition in-process with a synthetic phone photo (12 MP JPEG by default) and reports
+what reaches the model: request and image bytes, image and prompt tokens, and the route's
+latency. Then checks the perceptual-hash cache: the same photo re-encoded and resized must be
+answered without a model call, while a different photo, or the same photo with a different
+description, must not be.
+
+    python benchmarks/photo_analysis.py --width 4032 --height 3024 --latency 0.3
+"""
+import io
+import os
+import json
+import time
+import random
+import argparse
+
+from common import RESULTS_DIR, temp_sqlite_url
+from fake_openai import FakeOpenAI
+
+
+def synthetic_photo(width, height, seed, quality=92):
+    # A plate of food, roughly: coloured blobs on a textured background, with camera EXIF
+    from PIL import Image, ImageDraw, ImageFilter
+
+    rng = random.Random(seed)
+    image = Image.effect_noise((width, height), 24).convert("RGB")
+    image = Image.blend(image, Image.new("RGB", (width, height), (rng.randint(120, 200),) * 3), 0.6)
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((width * 0.1, height * 0.1, width * 0.9, height * 0.9), fill=(235, 235, 230))
+    for _ in range(12):
+        x, y = rng.uniform(0.25, 0.75) * width, rng.uniform(0.25, 0.75) * height
+        r = rng.uniform(0.04, 0.12) * width
+        draw.ellipse((x - r, y - r, x + r, y + r),
+                     fill=(rng.randint(60, 250), rng.randint(40, 200), rng.randint(20, 120)))
+    image = image.filter(ImageFilter.GaussianBlur(2))
+    exif = Image.Exif()
+    exif[0x010F], exif[0x0110] = "Benchmark", "Phone"
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=quality, exif=exif)
+    return out.getvalue()
+
+
+def near_duplicate(data):
+    # What a re-upload of the same picture looks like: resized and re-compressed
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+    image = image.resize((image.width * 3 // 4, image.height * 3 // 4))
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=70)
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--max-side", type=int, default=512, help="MEAL_PHOTO_MAX_SIDE")
+    parser.add_argument("--detail", default="low", help="MEAL_PHOTO_DETAIL")
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(latency=args.latency).start()
+    os.environ.update({"DATABASE_URL": temp_sqlite_url(), "OPENAI_API_KEY": "sk-benchmark",
+                       "OPENAI_BASE_URL": fake.base_url, "AI_RATE_LIMIT": "0", "LOCAL_FOOD_DB": "False",
+                       "MEAL_PHOTO_MAX_SIDE": str(args.max_side), "MEAL_PHOTO_DETAIL": args.detail})
+    from nutritrack import create_app, db
+    from nutritrack.migrations import upgrade
+    from nutritrack.models import User, History
+    from nutritrack.prompts import token_usage
+
+    app = create_app()
+    with app.app_context():
+        upgrade()
+        user = User(username="photo", email="photo@bench.local")
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user_id)
+        session["_fresh"] = True
+
+    photo = synthetic_photo(args.width, args.height, seed=1)
+    other = synthetic_photo(args.width, args.height, seed=2)
+    cases = [
+        ("first photo", photo, "Chicken rice bowl"),
+        ("same photo, re-encoded", near_duplicate(photo), "Chicken rice bowl"),
+        ("different photo", other, "Chicken rice bowl"),
+        ("same photo, other description", photo, "Beef rice bowl"),
+    ]
+    results = {"photo_bytes": len(photo), "photo_base64_bytes": len(photo) * 4 // 3,
+               "max_side": args.max_side, "detail": args.detail, "cases": {}}
+    try:
+        for name, data, food_name in cases:
+            before = (fake.requests, fake.request_bytes, fake.images, fake.image_bytes)
+            start = time.perf_counter()
+            response = client.post("/nutrition", content_type="multipart/form-data", data={
+                "food_name": food_name, "ingredients": "rice, chicken, broccoli", "preparation": "steamed",
+                "photo": (io.BytesIO(data), "meal.jpg")})
+            elapsed = time.perf_counter() - start
+            assert response.status_code == 200, response.status_code
+            results["cases"][name] = {
+                "upload_bytes": len(data), "latency_ms": round(elapsed * 1000, 1),
+                "model_calls": fake.requests - before[0], "request_bytes": fake.request_bytes - before[1],
+                "images": fake.images - before[2], "image_bytes": fake.image_bytes - before[3],
+            }
+    finally:
+        fake.stop()
+
+    with app.app_context():
+        results["history_rows"] = History.query.count()
+    usage = token_usage.snapshot().get("nutrition_photo", {})
+    results["mean_prompt_tokens"] = usage.get("mean_prompt_tokens")
+
+    print(f"Original photo: {len(photo) / 1024:.0f} KB ({args.width}x{args.height}), "
+          f"{results['photo_base64_bytes'] / 1024:.0f} KB as base64")
+    print(f"{'case':<32} {'calls':>5} {'image KB':>9} {'request KB':>11} {'ms':>8}")
+    for name, row in results["cases"].items():
+        print(f"{name:<32} {row['model_calls']:>5} {row['image_bytes'] / 1024:>9.1f} "
+              f"{row['request_bytes'] / 1024:>11.1f} {row['latency_ms']:>8}")
+    print(f"Prompt tokens per photo call (text + image): {results['mean_prompt_tokens']}")
+
+    expected = [1, 0, 1, 1]
+    actual = [row["model_calls"] for row in results["cases"].values()]
+    results["cache_behaves"] = actual == expected
+    print("Photo cache: " + ("as expected" if actual == expected else f"UNEXPECTED model calls {actual}"))
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, "photo_analysis.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Tokens, latency and cost per model endpoint, against the fake OpenAI server.
+
+Calls each prompt template through nutritrack.utils the way the routes do, then reads
+nutritrack.prompts.token_usage. Token counts are the fake server's reported usage (or
+the local estimate); cost uses the per-million-token prices given on the command line.
+
+    python benchmarks/prompt_budget.py --calls 20 --latency 0.2 --token-latency 0.005
+"""
+import os
+import json
+import time
+import argparse
+from types import SimpleNamespace
+from datetime import date
+
+from common import RESULTS_DIR, summarize, temp_sqlite_url
+from fake_openai import FakeOpenAI
+
+
+def endpoints(utils, calorie_breakdown):
+    user = SimpleNamespace(gender="Female", height_cm=165, weight_kg=62, dob=date(1990, 5, 1),
+                           activity_level="Moderately Active", goal="Weight Loss")
+    breakdown = calorie_breakdown(user)
+    # Distinct inputs on every call so nothing is answered from a cache
+    return {
+        "nutrition": lambda i: utils.analyze_nutrition(
+            None, f"Chicken curry {i}", "chicken, rice, curry paste, coconut milk", "simmered", "Weight Loss"),
+        "nutrition_batch": lambda i: utils.analyze_nutrition_batch(
+            [{"food_name": f"Porridge {i}.{n}", "ingredients": "oats, milk", "preparation": "boiled"}
+             for n in range(3)], "Weight Loss"),
+        "meal_plan": lambda i: utils.generate_meal_plan(f"High protein vegetarian dinner #{i}", "Weight Loss"),
+        "insight": lambda i: utils.get_daily_insight(
+            {"calories": 1500 + i, "protein": 80, "fats": 50}, 4, 2000, "Weight Loss"),
+        "calorie_explanation": lambda i: utils.explain_calorie_target(user, breakdown),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--token-latency", type=float, default=0.005, help="seconds per completion token")
+    parser.add_argument("--prompt-price", type=float, default=0.50, help="USD per million prompt tokens")
+    parser.add_argument("--completion-price", type=float, default=1.50, help="USD per million completion tokens")
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(latency=args.latency, token_latency=args.token_latency).start()
+    os.environ.update({"DATABASE_URL": temp_sqlite_url(), "OPENAI_API_KEY": "sk-benchmark",
+                       "OPENAI_BASE_URL": fake.base_url, "AI_RATE_LIMIT": "0", "LOCAL_FOOD_DB": "False"})
+    from nutritrack import create_app, db, utils
+    from nutritrack.calories import calorie_breakdown
+    from nutritrack.prompts import token_usage
+
+    app = create_app()
+    wall = {}
+    try:
+        with app.app_context():
+            db.create_all()
+            for name, call in endpoints(utils, calorie_breakdown).items():
+                wall[name] = []
+                for i in range(args.calls):
+                    start = time.perf_counter()
+                    call(i)
+                    wall[name].append(time.perf_counter() - start)
+    finally:
+        fake.stop()
+
+    usage = token_usage.snapshot()
+    results = {"calls": args.calls, "latency_s": args.latency, "token_latency_s": args.token_latency,
+               "prices_per_million": {"prompt": args.prompt_price, "completion": args.completion_price},
+               "endpoints": {}}
+    for name, latencies in wall.items():
+        row = usage.get(name, {})
+        calls = row.get("calls") or 1
+        cost = (row.get("prompt_tokens", 0) * args.prompt_price
+                + row.get("completion_tokens", 0) * args.completion_price) / 1e6
+        results["endpoints"][name] = {
+            "model_calls": row.get("calls", 0),
+            "mean_prompt_tokens": row.get("mean_prompt_tokens"),
+            "mean_completion_tokens": row.get("mean_completion_tokens"),
+            "mean_estimated_prompt_tokens": round(row.get("estimated_prompt_tokens", 0) / calls, 1),
+            "truncated": row.get("truncated", 0),
+            "usd_per_1000_calls": round(cost / calls * 1000, 4),
+            **summarize(latencies),
+        }
+
+    print(f"{'endpoint':<20} {'prompt':>7} {'compl.':>7} {'est.':>6} {'p50 ms':>8} {'p95 ms':>8} {'$/1k':>8}")
+    for name, row in results["endpoints"].items():
+        print(f"{name:<20} {row['mean_prompt_tokens']:>7} {row['mean_completion_tokens']:>7} "
+              f"{row['mean_estimated_prompt_tokens']:>6} {row['p50_ms']:>8} {row['p95_ms']:>8} "
+              f"{row['usd_per_1000_calls']:>8}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, "prompt_budget.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    main()
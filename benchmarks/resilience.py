@@ -0,0 +1,128 @@
+"""How the model client behaves when the API misbehaves, against the fake OpenAI server.
+
+Four scenarios, each run in-process against nutritrack.ai_client:
+
+* retries      - a share of calls fail with 429 + Retry-After; success rate with and without retries
+* outage       - the API answers 503 to everything; per-call latency with and without the breaker
+* coalescing   - identical prompts sent concurrently; upstream requests actually made
+* rate-limit   - a burst of calls through the token bucket; how long the burst is spread over
+
+    python benchmarks/resilience.py --latency 0.2
+"""
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from common import RESULTS_DIR, summarize, temp_sqlite_url
+from fake_openai import FakeOpenAI
+
+
+def make_client(fake, **config):
+    from nutritrack.ai_client import AIClient
+
+    settings = {
+        "OPENAI_API_KEY": "sk-benchmark", "OPENAI_BASE_URL": fake.base_url,
+        "AI_TIMEOUT": 10, "AI_QUEUE_TIMEOUT": 5, "AI_MAX_CONCURRENCY": 16,
+        "AI_MAX_RETRIES": 2, "AI_RETRY_BACKOFF": 0.1, "AI_RATE_LIMIT": 0,
+        "AI_BREAKER_THRESHOLD": 5, "AI_BREAKER_COOLDOWN": 30,
+    }
+    settings.update(config)
+    client = AIClient()
+    client.init_app(type("App", (), {"config": settings})())
+    return client
+
+
+def call(client, prompt):
+    start = time.perf_counter()
+    try:
+        client.chat_completion(prompt, max_tokens=50)
+        return True, time.perf_counter() - start
+    except Exception:
+        return False, time.perf_counter() - start
+
+
+def run_many(client, prompts, workers):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda p: call(client, p), prompts))
+
+
+def retries(fake, calls):
+    fake.failure_rate, fake.retry_after = 0.3, "0.1"
+    result = {}
+    for label, max_retries in (("no_retries", 0), ("with_retries", 2)):
+        outcomes = run_many(make_client(fake, AI_MAX_RETRIES=max_retries, AI_BREAKER_THRESHOLD=0),
+                            [f"retry {label} {i}" for i in range(calls)], 8)
+        result[label] = {"success_rate": round(sum(ok for ok, _ in outcomes) / calls, 3),
+                         **summarize([elapsed for _, elapsed in outcomes])}
+    fake.failure_rate = 0.0
+    return result
+
+
+def outage(fake, calls):
+    fake.down = True
+    result = {}
+    for label, threshold in (("no_breaker", 0), ("with_breaker", 5)):
+        client = make_client(fake, AI_BREAKER_THRESHOLD=threshold)
+        outcomes = [call(client, f"outage {label} {i}") for i in range(calls)]
+        result[label] = summarize([elapsed for _, elapsed in outcomes])
+        result[label]["breaker"] = client.breaker.state
+    fake.down = False
+    return result
+
+
+def coalescing(fake, calls):
+    result = {}
+    for label, prompt in (("distinct", None), ("identical", "same prompt for everyone")):
+        client = make_client(fake)
+        before = fake.requests
+        outcomes = run_many(client, [prompt or f"distinct {i}" for i in range(calls)], calls)
+        result[label] = {"upstream_requests": fake.requests - before,
+                         "success_rate": round(sum(ok for ok, _ in outcomes) / calls, 3),
+                         **summarize([elapsed for _, elapsed in outcomes])}
+    return result
+
+
+def rate_limit(fake, calls, rate):
+    client = make_client(fake, AI_RATE_LIMIT=rate, AI_RATE_BURST=int(rate), AI_QUEUE_TIMEOUT=60)
+    start = time.perf_counter()
+    outcomes = run_many(client, [f"paced {i}" for i in range(calls)], calls)
+    return {"rate_per_s": rate, "calls": calls, "wall_s": round(time.perf_counter() - start, 2),
+            "success_rate": round(sum(ok for ok, _ in outcomes) / calls, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--calls", type=int, default=40)
+    parser.add_argument("--rate", type=float, default=5)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DATABASE_URL", temp_sqlite_url())
+    fake = FakeOpenAI(latency=args.latency).start()
+    try:
+        results = {
+            "latency_s": args.latency,
+            "retries": retries(fake, args.calls),
+            "outage": outage(fake, 20),
+            "coalescing": coalescing(fake, 20),
+            "rate_limit": rate_limit(fake, 3 * int(args.rate), args.rate),
+        }
+    finally:
+        fake.stop()
+
+    for name in ("retries", "outage", "coalescing"):
+        for label, row in results[name].items():
+            print(f"{name:<11} {label:<13} " + "  ".join(f"{k}={v}" for k, v in row.items()))
+    print(f"rate_limit  {results['rate_limit']}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, "resilience.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Seed a database with synthetic users, food history and meal plans for benchmarks.
+
+The data is deterministic for a given --seed, so two runs (or two versions of the app)
+are measured against identical databases. Users are bench0@bench.local, bench1@... with
+the password "benchmark". Works with any DATABASE_URL the app supports (SQLite, PostgreSQL).
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/seed.py --users 20 --rows 2000
+"""
+import csv
+import json
+import random
+import argparse
+from datetime import date, datetime, timedelta
+
+from common import ROOT
+
+PASSWORD = "benchmark"
+GOALS = ("Weight Loss", "Maintain Weight", "Weight Gain")
+ACTIVITY = ("Sedentary", "Lightly Active", "Moderately Active", "Very Active")
+PREPARATIONS = ("grilled", "boiled", "baked", "raw", "stir fried", "steamed")
+
+
+def user_email(n):
+    return f"bench{n}@bench.local"
+
+
+def load_foods():
+    with open(f"{ROOT}/nutritrack/data/foods.csv", newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def nutrition_for(food, servings):
+    # Same normalized shape nutritrack.parsing produces for a model answer
+    def amount(key, unit):
+        return {"value": round(float(food[key]) * servings, 1), "unit": unit}
+    return {
+        "calories": amount("calories", "kcal"), "protein": amount("protein", "g"),
+        "carbohydrates": amount("carbohydrates", "g"), "fats": amount("fats", "g"),
+        "sugars": amount("sugars", "g"), "fibre": amount("fibre", "g"),
+        "vitamins": {"Vitamin A": amount("vitamin_a_mcg", "mcg"), "Vitamin C": amount("vitamin_c_mg", "mg")},
+        "minerals": {"Calcium": amount("calcium_mg", "mg"), "Iron": amount("iron_mg", "mg")},
+        "insight": food["insight"], "notes": "Synthetic benchmark entry.",
+    }
+
+
+def meal_plan_for(rng, foods, n):
+    picks = rng.sample(foods, 3)
+    return {
+        "meal_name": f"Benchmark plan {n}", "ingredients": [f["name"] for f in picks],
+        "preparation": "Cook everything and serve together.",
+        "nutrition": {key: round(sum(float(f[source]) for f in picks), 1) for key, source in
+                      (("calories", "calories"), ("protein", "protein"), ("carbs", "carbohydrates"),
+                       ("fats", "fats"), ("sugars", "sugars"), ("fibre", "fibre"))},
+        "vitamins": {"Vitamin C": round(sum(float(f["vitamin_c_mg"]) for f in picks), 1)},
+        "minerals": {"Iron": round(sum(float(f["iron_mg"]) for f in picks), 1)},
+        "insights": "A balanced synthetic plan.",
+    }
+
+
+def seed(users, rows, meal_plans, days, seed_value, chunk=5000):
+    from sqlalchemy import insert
+    from werkzeug.security import generate_password_hash
+    from nutritrack import db
+    from nutritrack.models import User, History, MealPlan
+    from nutritrack.migrations import upgrade
+    from nutritrack.rollups import rebuild_daily_totals
+
+    upgrade()
+    rng = random.Random(seed_value)
+    foods = load_foods()
+    password = generate_password_hash(PASSWORD, method="pbkdf2:sha256")
+    now = datetime.now().replace(microsecond=0)
+
+    user_ids = []
+    for n in range(users):
+        user = User(username=f"bench{n}", email=user_email(n), password=password,
+                    height_cm=rng.randint(150, 195), weight_kg=rng.randint(50, 110),
+                    dob=date(rng.randint(1960, 2004), rng.randint(1, 12), rng.randint(1, 28)),
+                    gender=rng.choice(("Male", "Female")), activity_level=rng.choice(ACTIVITY),
+                    goal=rng.choice(GOALS), recommended_calories=rng.randint(1600, 2800),
+                    date_joined=now - timedelta(days=days))
+        db.session.add(user)
+        db.session.flush()
+        user_ids.append(user.id)
+    db.session.commit()
+
+    def flush(model, batch):
+        if batch:
+            db.session.execute(insert(model), batch)
+            db.session.commit()
+            batch.clear()
+
+    batch = []
+    for user_id in user_ids:
+        for _ in range(rows):
+            food = rng.choice(foods)
+            data = nutrition_for(food, rng.choice((0.5, 1, 1, 1.5, 2)))
+            batch.append({
+                "user_id": user_id, "food_name": food["name"], "ingredients": food["name"],
+                "nutrition_result": json.dumps(data), "nutrition_data": data,
+                "timestamp": now - timedelta(seconds=rng.randint(0, days * 86400)),
+                **{key: data[key]["value"] for key in ("calories", "protein", "carbohydrates",
+                                                       "fats", "sugars", "fibre")},
+            })
+            if len(batch) >= chunk:
+                flush(History, batch)
+    flush(History, batch)
+
+    for user_id in user_ids:
+        for n in range(meal_plans):
+            data = meal_plan_for(rng, foods, n)
+            batch.append({
+                "user_id": user_id, "requirements": f"{rng.choice(PREPARATIONS)} dinner, plan {n}",
+                "meal_plan_result": json.dumps(data), "meal_plan_data": data,
+                "timestamp": now - timedelta(seconds=rng.randint(0, days * 86400)),
+            })
+            if len(batch) >= chunk:
+                flush(MealPlan, batch)
+    flush(MealPlan, batch)
+
+    return {"users": users, "history_rows": users * rows, "meal_plans": users * meal_plans,
+            "daily_totals": rebuild_daily_totals()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=2000, help="History rows per user.")
+    parser.add_argument("--meal-plans", type=int, default=200, help="Meal plans per user.")
+    parser.add_argument("--days", type=int, default=365, help="Spread the rows over this many past days.")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    from nutritrack import create_app
+    app = create_app()
+    with app.app_context():
+        counts = seed(args.users, args.rows, args.meal_plans, args.days, args.seed)
+    print(json.dumps(counts))
+
+
+if __name__ == "__main__":
+    main()
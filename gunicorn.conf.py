@@ -0,0 +1,50 @@
+import os
+
+# Threaded workers: a request waiting on OpenAI only occupies one thread, so /login and
+# the other DB-only pages keep being served while completions are in flight. The number
+# of simultaneous model calls per worker is capped separately by AI_MAX_CONCURRENCY.
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", 16))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+
+
+def on_starting(server):
+    # Worker metric dumps from a previous run would otherwise be summed into /metrics forever
+    metrics_dir = os.getenv("METRICS_DIR")
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for name in os.listdir(metrics_dir):
+            if name.startswith("metrics-") and name.endswith(".json"):
+                os.remove(os.path.join(metrics_dir, name))
+
+
+# GUNICORN_PRELOAD=True loads the app once in the master and forks the workers from it: a
+# new worker starts serving straight away instead of importing and building the app itself,
+# and the workers share the imported modules' memory. Code reloads then need a full restart.
+preload_app = os.getenv("GUNICORN_PRELOAD", "False").lower() in ["true", "on", "1"]
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    import gc
+    from nutritrack import preload
+
+    preload(server.app.wsgi())
+    # Objects that exist now are never collected; keeping the collector off their pages stops
+    # each worker from copying the master's whole heap on its first collection
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+    from nutritrack import db
+
+    # A connection opened in the master must not be shared; close=False leaves the master's
+    # socket alone and just gives this worker a fresh pool
+    app = server.app.wsgi()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
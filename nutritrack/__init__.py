@@ -1,19 +1,68 @@
-from flask import Flask, session
+from flask import Flask, session, current_app, request
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 import os
+import threading
 from dotenv import load_dotenv
 from datetime import timedelta
-import openai
-from authlib.integrations.flask_client import OAuth
-from flask_mail import Mail, Message
+from .cache import Cache, PhotoCache
+from .ai_client import AIClient
+from .jobs import JobRunner
+from .outbox import MailOutbox
+from .assets import Assets
+from .metrics import metrics
+from .images import DiskUploadRequest
 
 load_dotenv()
 
 db = SQLAlchemy()
 login_manager = LoginManager()
-mail=Mail()
+insight_cache = Cache('insight')
+analysis_cache = Cache('analysis')
+trends_cache = Cache('trends')
+photo_cache = PhotoCache()
+ai_client = AIClient()
+job_runner = JobRunner()
+mail_outbox = MailOutbox()
+assets = Assets()
 login_manager.login_view = 'auth.login'
+_lazy_lock = threading.Lock()
+
+
+def google_oauth():
+    # Authlib (and the requests stack under it) is only imported when someone uses Google sign-in;
+    # the OpenAI SDK and Flask-Mail are likewise imported by ai_client and outbox on first use
+    app = current_app._get_current_object()
+    client = app.extensions.get('google_oauth')
+    if client is None:
+        with _lazy_lock:
+            client = app.extensions.get('google_oauth')
+            if client is None:
+                from authlib.integrations.flask_client import OAuth
+                client = OAuth(app).register(
+                    name='google',
+                    client_id=app.config['GOOGLE_CLIENT_ID'],
+                    client_secret=app.config['GOOGLE_CLIENT_SECRET'],
+                    server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
+                    client_kwargs={'scope': 'openid email profile'}
+                )
+                app.extensions['google_oauth'] = client
+    return client
+
+
+def preload(app):
+    # For Gunicorn's preload mode (GUNICORN_PRELOAD): does in the master what create_app leaves for
+    # first use - the heavy imports and compiling every template - so forked workers share it
+    # copy-on-write and a fresh worker's first request doesn't pay for it
+    import openai  # noqa: F401
+    import numpy  # noqa: F401
+    import flask_mail  # noqa: F401
+    import authlib.integrations.flask_client  # noqa: F401
+    from PIL import Image  # noqa: F401
+    from . import calories, trends  # noqa: F401
+
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
 
 
 def create_app():
@@ -22,14 +71,29 @@ def create_app():
     app.config['OPENAI_API_KEY'] = os.getenv("OPENAI_API_KEY")
     if not app.config['OPENAI_API_KEY']:
         raise ValueError("FATAL ERROR: OPENAI_API_KEY not found in .env file.")
-    openai.api_key = app.config['OPENAI_API_KEY']
     print("✅ OpenAI API key loaded successfully.")
+    app.config['OPENAI_MODEL'] = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+    app.config['OPENAI_VISION_MODEL'] = os.getenv("OPENAI_VISION_MODEL", "gpt-4o-mini")
+    app.config['AI_MAX_CONCURRENCY'] = int(os.getenv("AI_MAX_CONCURRENCY", 8))
+    app.config['AI_TIMEOUT'] = float(os.getenv("AI_TIMEOUT", 30))
+    app.config['AI_QUEUE_TIMEOUT'] = float(os.getenv("AI_QUEUE_TIMEOUT", 2))
+    app.config['AI_REASK'] = os.getenv('AI_REASK', 'True').lower() in ['true', 'on', '1']
+    app.config['OPENAI_BASE_URL'] = os.getenv("OPENAI_BASE_URL")
+    app.config['AI_MAX_RETRIES'] = int(os.getenv("AI_MAX_RETRIES", 2))
+    app.config['AI_RETRY_BACKOFF'] = float(os.getenv("AI_RETRY_BACKOFF", 0.5))
+    app.config['AI_RATE_LIMIT'] = float(os.getenv("AI_RATE_LIMIT", 8))
+    app.config['AI_RATE_BURST'] = int(os.getenv("AI_RATE_BURST", 16))
+    app.config['AI_BREAKER_THRESHOLD'] = int(os.getenv("AI_BREAKER_THRESHOLD", 5))
+    app.config['AI_BREAKER_COOLDOWN'] = float(os.getenv("AI_BREAKER_COOLDOWN", 30))
+    app.config['AI_MAX_TOKENS_NUTRITION'] = int(os.getenv("AI_MAX_TOKENS_NUTRITION", 400))
+    app.config['AI_MAX_TOKENS_NUTRITION_PHOTO'] = int(os.getenv("AI_MAX_TOKENS_NUTRITION_PHOTO", 400))
+    app.config['AI_MAX_TOKENS_NUTRITION_BATCH'] = int(os.getenv("AI_MAX_TOKENS_NUTRITION_BATCH", 300))
+    app.config['AI_MAX_TOKENS_MEAL_PLAN'] = int(os.getenv("AI_MAX_TOKENS_MEAL_PLAN", 500))
+    app.config['AI_MAX_TOKENS_INSIGHT'] = int(os.getenv("AI_MAX_TOKENS_INSIGHT", 150))
+    app.config['AI_MAX_TOKENS_CALORIE_EXPLANATION'] = int(os.getenv("AI_MAX_TOKENS_CALORIE_EXPLANATION", 200))
+    ai_client.init_app(app)
 
     app.config['SECRET_KEY'] = os.getenv("SECRET_KEY", "fallback-secret")
-    print("--- Checking Environment Variables ---")
-    database_url_from_env = os.getenv("DATABASE_URL")
-    print(f"DATABASE_URL found: {database_url_from_env}")
-    print("------------------------------------")
     database_url = os.getenv("DATABASE_URL")
     if database_url:
         app.config['SQLALCHEMY_DATABASE_URI'] = database_url
@@ -41,21 +105,116 @@ def create_app():
     app.config['SESSION_PERMANENT'] = True
     app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
 
-    oauth = OAuth(app)
-    google = oauth.register(
-        name='google',
-        client_id=os.getenv("GOOGLE_CLIENT_ID"),
-        client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
-        server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
-        client_kwargs={'scope': 'openid email profile'}
-    )
+    # Registered with Authlib on first use, see google_oauth()
+    app.config['GOOGLE_CLIENT_ID'] = os.getenv("GOOGLE_CLIENT_ID")
+    app.config['GOOGLE_CLIENT_SECRET'] = os.getenv("GOOGLE_CLIENT_SECRET")
 
     app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER')
     app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', 587))
     app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS', 'True').lower() in ['true', 'on', '1']
     app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
     app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
-    mail.init_app(app)
+
+    # Outgoing mail is queued in the database and sent by a background thread that the first email
+    # a process queues starts (MAIL_SENDER_THREAD=False leaves it to `flask send-mail`);
+    # MAIL_OUTBOX=False sends inline
+    app.config['MAIL_OUTBOX'] = os.getenv('MAIL_OUTBOX', 'True').lower() in ['true', 'on', '1']
+    app.config['MAIL_SENDER_THREAD'] = os.getenv('MAIL_SENDER_THREAD', 'True').lower() in ['true', 'on', '1']
+    app.config['MAIL_BATCH_SIZE'] = int(os.getenv('MAIL_BATCH_SIZE', 50))
+    app.config['MAIL_MAX_ATTEMPTS'] = int(os.getenv('MAIL_MAX_ATTEMPTS', 5))
+    app.config['MAIL_RETRY_BACKOFF'] = float(os.getenv('MAIL_RETRY_BACKOFF', 30))
+    app.config['MAIL_POLL_INTERVAL'] = float(os.getenv('MAIL_POLL_INTERVAL', 30))
+    app.config['MAIL_CONNECTION_IDLE'] = float(os.getenv('MAIL_CONNECTION_IDLE', 30))
+    app.config['MAIL_TIMEOUT'] = float(os.getenv('MAIL_TIMEOUT', 20))
+    app.config['MAIL_STALE_AFTER'] = int(os.getenv('MAIL_STALE_AFTER', 300))
+    mail_outbox.init_app(app)
+
+    app.config['INSIGHT_CACHE_BACKEND'] = os.getenv('INSIGHT_CACHE_BACKEND', 'memory')
+    app.config['INSIGHT_CACHE_TTL'] = int(os.getenv('INSIGHT_CACHE_TTL', 6 * 3600))
+    app.config['INSIGHT_CACHE_SIZE'] = int(os.getenv('INSIGHT_CACHE_SIZE', 2048))
+    insight_cache.init_app(app)
+
+    app.config['ANALYSIS_CACHE_BACKEND'] = os.getenv('ANALYSIS_CACHE_BACKEND', 'memory')
+    app.config['ANALYSIS_CACHE_TTL'] = int(os.getenv('ANALYSIS_CACHE_TTL', 30 * 24 * 3600))
+    app.config['ANALYSIS_CACHE_SIZE'] = int(os.getenv('ANALYSIS_CACHE_SIZE', 10000))
+    app.config['ANALYSIS_CACHE_SERVE'] = os.getenv('ANALYSIS_CACHE_SERVE', 'True').lower() in ['true', 'on', '1']
+    analysis_cache.init_app(app)
+
+    app.config['TRENDS_CACHE_BACKEND'] = os.getenv('TRENDS_CACHE_BACKEND', 'memory')
+    app.config['TRENDS_CACHE_TTL'] = int(os.getenv('TRENDS_CACHE_TTL', 24 * 3600))
+    app.config['TRENDS_CACHE_SIZE'] = int(os.getenv('TRENDS_CACHE_SIZE', 20000))
+    app.config['TRENDS_MAX_DAYS'] = int(os.getenv('TRENDS_MAX_DAYS', 731))
+    app.config['TRENDS_ADHERENCE_TOLERANCE'] = float(os.getenv('TRENDS_ADHERENCE_TOLERANCE', 0.1))
+    trends_cache.init_app(app)
+
+    # 'mifflin' (Mifflin-St Jeor) or 'harris_benedict'
+    app.config['CALORIE_FORMULA'] = os.getenv('CALORIE_FORMULA', 'mifflin')
+
+    app.config['BACKGROUND_JOBS'] = os.getenv('BACKGROUND_JOBS', 'False').lower() in ['true', 'on', '1']
+    app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 2))
+    app.config['JOB_USER_CONCURRENCY'] = int(os.getenv('JOB_USER_CONCURRENCY', 1))
+    app.config['JOB_MAX_ATTEMPTS'] = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+    app.config['JOB_RETRY_BACKOFF'] = float(os.getenv('JOB_RETRY_BACKOFF', 5))
+    app.config['JOB_POLL_INTERVAL'] = float(os.getenv('JOB_POLL_INTERVAL', 2))
+    app.config['JOB_STALE_AFTER'] = int(os.getenv('JOB_STALE_AFTER', 300))
+    job_runner.init_app(app)
+
+    app.config['MEAL_PLAN_STREAMING'] = os.getenv('MEAL_PLAN_STREAMING', 'False').lower() in ['true', 'on', '1']
+
+    app.config['HISTORY_PAGE_SIZE'] = int(os.getenv('HISTORY_PAGE_SIZE', 20))
+
+    app.config['NUTRITION_BATCH_MAX'] = int(os.getenv('NUTRITION_BATCH_MAX', 10))
+
+    # Uploaded profile pictures: square WebP + PNG variants at these sizes, under content-hashed
+    # names served from /avatars with a long-lived Cache-Control
+    app.config['PROFILE_PIC_DIR'] = os.getenv('PROFILE_PIC_DIR', os.path.join(app.root_path, 'static', 'uploads', 'avatars'))
+    app.config['PROFILE_PIC_SIZES'] = [int(s) for s in os.getenv('PROFILE_PIC_SIZES', '64,128,256').split(',')]
+    app.config['PROFILE_PIC_MAX_BYTES'] = int(os.getenv('PROFILE_PIC_MAX_BYTES', 10 * 1024 * 1024))
+    app.config['PROFILE_PIC_MAX_PIXELS'] = int(os.getenv('PROFILE_PIC_MAX_PIXELS', 40_000_000))
+    app.config['PROFILE_PIC_WEBP_QUALITY'] = int(os.getenv('PROFILE_PIC_WEBP_QUALITY', 80))
+    app.config['PROFILE_PIC_CACHE_MAX_AGE'] = int(os.getenv('PROFILE_PIC_CACHE_MAX_AGE', 365 * 24 * 3600))
+
+    # Meal photos on /nutrition: downscaled and re-encoded before they go to the vision model
+    # ('low' detail is a flat, small number of image tokens), and near-duplicates (within
+    # PHOTO_HASH_DISTANCE bits of perceptual hash, same description) reuse an earlier answer
+    app.config['MEAL_PHOTO_MAX_SIDE'] = int(os.getenv('MEAL_PHOTO_MAX_SIDE', 512))
+    app.config['MEAL_PHOTO_QUALITY'] = int(os.getenv('MEAL_PHOTO_QUALITY', 80))
+    app.config['MEAL_PHOTO_DETAIL'] = os.getenv('MEAL_PHOTO_DETAIL', 'low')
+    app.config['MEAL_PHOTO_MAX_BYTES'] = int(os.getenv('MEAL_PHOTO_MAX_BYTES', 20 * 1024 * 1024))
+    app.config['MEAL_PHOTO_MAX_PIXELS'] = int(os.getenv('MEAL_PHOTO_MAX_PIXELS', 50_000_000))
+    app.config['PHOTO_CACHE'] = os.getenv('PHOTO_CACHE', 'True').lower() in ['true', 'on', '1']
+    app.config['PHOTO_CACHE_TTL'] = int(os.getenv('PHOTO_CACHE_TTL', 30 * 24 * 3600))
+    app.config['PHOTO_HASH_DISTANCE'] = int(os.getenv('PHOTO_HASH_DISTANCE', 6))
+    app.config['PHOTO_CACHE_SCAN'] = int(os.getenv('PHOTO_CACHE_SCAN', 200))
+    photo_cache.init_app(app)
+
+    # Uploads are streamed to temporary files here rather than held in memory; larger requests get a 413
+    app.config['UPLOAD_TMP_DIR'] = os.getenv('UPLOAD_TMP_DIR') or None
+    app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 25 * 1024 * 1024))
+    app.request_class = DiskUploadRequest
+
+    app.config['LOCAL_FOOD_DB'] = os.getenv('LOCAL_FOOD_DB', 'True').lower() in ['true', 'on', '1']
+
+    # Prometheus-format /metrics; METRICS_DIR (shared by the workers) makes it cover all of them
+    app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', 'True').lower() in ['true', 'on', '1']
+    app.config['METRICS_SAMPLE_RATE'] = float(os.getenv('METRICS_SAMPLE_RATE', 1.0))
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+    app.config['METRICS_DIR'] = os.getenv('METRICS_DIR')
+    app.config['METRICS_FLUSH_INTERVAL'] = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+    app.config['METRICS_LOG'] = os.getenv('METRICS_LOG', 'False').lower() in ['true', 'on', '1']
+    app.config['METRICS_PROFILING'] = os.getenv('METRICS_PROFILING', 'False').lower() in ['true', 'on', '1']
+    app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR')
+    metrics.init_app(app)
+
+    # Static files are served from the fingerprinted, precompressed build (`flask build-assets`)
+    # with a far-future Cache-Control; HTML and JSON over COMPRESS_MIN_SIZE bytes are compressed
+    # per response. Set up after metrics, so request timings include the compression.
+    app.config['STATIC_CACHE_MAX_AGE'] = int(os.getenv('STATIC_CACHE_MAX_AGE', 365 * 24 * 3600))
+    app.config['COMPRESS_RESPONSES'] = os.getenv('COMPRESS_RESPONSES', 'True').lower() in ['true', 'on', '1']
+    app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+    app.config['COMPRESS_GZIP_LEVEL'] = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+    app.config['COMPRESS_BROTLI_QUALITY'] = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))
+    assets.init_app(app)
 
     db.init_app(app)
     login_manager.init_app(app)
@@ -65,14 +224,20 @@ def create_app():
 
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        # Called at most once per request (Flask-Login keeps the result on g); session.get
+        # also answers any later lookup of the same user in the request from the identity map
+        return db.session.get(User, int(user_id))
 
     @app.before_request
     def refresh_session():
-        session.permanent = True
+        # Not on static files: a Set-Cookie would keep shared caches from storing them
+        if request.endpoint != 'static':
+            session.permanent = True
 
     from .auth import auth
-    auth.google = google
     app.register_blueprint(auth)
 
+    from .commands import register_commands
+    register_commands(app)
+
     return app
@@ -0,0 +1,393 @@
+import os
+import time
+import random
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from .prompts import token_usage
+from .metrics import metrics
+
+
+class AIBusyError(Exception):
+    pass
+
+
+class AIUnavailableError(Exception):
+    # Raised without calling the API while the circuit breaker is open
+    pass
+
+
+def retryable_errors():
+    # Worth another attempt; anything else (bad request, auth, ...) fails straight away.
+    # The SDK is imported here and in _pool, on the first call, as it is slow to import
+    import openai
+
+    return (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def api_errors():
+    # Any error the API answered with; the non-retryable ones (400, 401, ...) show it is reachable
+    import openai
+
+    return openai.APIError
+
+
+class TokenBucket:
+    # `rate` calls per second on average, bursts of up to `burst`; rate 0 disables it
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout):
+        if self.rate <= 0:
+            return True
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    # Opens after `threshold` consecutive failures; after `cooldown` seconds one trial call
+    # is let through (half-open) and its outcome closes or re-opens the breaker
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        # A ticket for one call, or None while open. In half-open the only ticket handed out is the
+        # trial; the caller must release() it however the call ends, or the breaker never recovers
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self._trial is not None:
+                return None
+            self._trial = object()
+            return self._trial
+
+    def release(self, ticket):
+        # Ends a call; a trial that neither succeeded nor failed (rejected, cancelled, abandoned)
+        # lets the next caller try instead
+        with self._lock:
+            if ticket is not True and ticket is self._trial:
+                self._trial = None
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial is not None or (self.threshold and self.failures >= self.threshold):
+                if self.opened_at is None or self._trial is not None:
+                    print(f"⚠️ Opening the OpenAI circuit breaker for {self.cooldown}s after {self.failures} failures")
+                self.opened_at = time.monotonic()
+                self._trial = None
+
+
+def _retry_after(error):
+    # Seconds the API asked us to wait, from Retry-After / retry-after-ms, if any
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class AIClient:
+    # Every model call goes through one bounded pool per worker process, so a burst of
+    # slow completions can only ever occupy `max_concurrency` threads and each waiting
+    # request gives up after `timeout` seconds instead of hanging until OpenAI answers.
+    # On top of that: a token bucket paces calls, retryable errors are retried with
+    # jittered backoff inside the same deadline, a circuit breaker fails fast during an
+    # outage, and identical prompts already in flight share a single call.
+    def __init__(self):
+        self.model = "gpt-3.5-turbo"
+        self.vision_model = "gpt-4o-mini"
+        self.timeout = 30.0
+        self.queue_timeout = 2.0
+        self.max_concurrency = 8
+        self.max_retries = 2
+        self.retry_backoff = 0.5
+        self.api_key = None
+        self.base_url = None
+        self.limiter = TokenBucket(0, 1)
+        self.breaker = CircuitBreaker(5, 30.0)
+        self._client = None
+        self._executor = None
+        self._slots = None
+        self._pid = None
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.model = app.config.get('OPENAI_MODEL', self.model)
+        self.vision_model = app.config.get('OPENAI_VISION_MODEL', self.vision_model)
+        self.timeout = float(app.config.get('AI_TIMEOUT', self.timeout))
+        self.queue_timeout = float(app.config.get('AI_QUEUE_TIMEOUT', self.queue_timeout))
+        self.max_concurrency = int(app.config.get('AI_MAX_CONCURRENCY', self.max_concurrency))
+        self.max_retries = int(app.config.get('AI_MAX_RETRIES', self.max_retries))
+        self.retry_backoff = float(app.config.get('AI_RETRY_BACKOFF', self.retry_backoff))
+        self.api_key = app.config.get('OPENAI_API_KEY')
+        self.base_url = app.config.get('OPENAI_BASE_URL') or None
+        self.limiter = TokenBucket(float(app.config.get('AI_RATE_LIMIT', 0)), int(app.config.get('AI_RATE_BURST', 1)))
+        self.breaker = CircuitBreaker(int(app.config.get('AI_BREAKER_THRESHOLD', 5)),
+                                      float(app.config.get('AI_BREAKER_COOLDOWN', 30)))
+        self.shutdown()
+
+    def _pool(self):
+        # Created lazily so Gunicorn forks before any threads or sockets exist
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._slots = threading.BoundedSemaphore(self.max_concurrency)
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                    thread_name_prefix="openai")
+                # One client per process keeps its HTTP connections alive between calls;
+                # retries are done here, so the SDK's own are turned off
+                import openai
+
+                self._client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url,
+                                             max_retries=0, timeout=self.timeout)
+                self._inflight = {}
+            return self._executor, self._slots
+
+    @property
+    def client(self):
+        self._pool()
+        return self._client
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            if self._client is not None:
+                self._client.close()
+            self._executor = None
+            self._slots = None
+            self._client = None
+
+    def status(self):
+        return {"breaker": self.breaker.state, "consecutive_failures": self.breaker.failures,
+                "in_flight": len(self._inflight)}
+
+    def submit(self, fn, *args, **kwargs):
+        executor, slots = self._pool()
+        if not slots.acquire(timeout=self.queue_timeout):
+            raise AIBusyError(f"All {self.max_concurrency} model slots are busy.")
+        try:
+            future = executor.submit(fn, *args, **kwargs)
+        except Exception:
+            slots.release()
+            raise
+        # The slot is held until the call really finishes, even if the caller stops waiting
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    def wait(self, future, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise TimeoutError(f"Model call did not finish within {timeout}s.")
+
+    def _admit(self):
+        # Returns the breaker ticket, which the caller releases when the call ends
+        ticket = self.breaker.allow()
+        if not ticket:
+            raise AIUnavailableError("The model API is failing; not calling it for now.")
+        if not self.limiter.acquire(self.queue_timeout):
+            self.breaker.release(ticket)
+            raise AIBusyError("Model call rate limit reached.")
+        return ticket
+
+    def _create(self, deadline, model=None, **kwargs):
+        # Runs in a pool thread: retries inside the caller's deadline, honoring Retry-After
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                response = self.client.chat.completions.create(model=model or self.model, timeout=max(remaining, 0.1),
+                                                               **kwargs)
+                self.breaker.success()
+                return response
+            except retryable_errors() as e:
+                self.breaker.failure()
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, self.retry_backoff * 2 ** attempt)
+                attempt += 1
+                # Stop once this failure has opened the breaker (or re-opened it, if this was the trial)
+                if attempt > self.max_retries or time.monotonic() + delay >= deadline or self.breaker.state != "closed":
+                    raise
+                print(f"⚠️ OpenAI call failed ({type(e).__name__}), retry {attempt} in {delay:.2f}s")
+                time.sleep(delay)
+                if not self.limiter.acquire(self.queue_timeout):
+                    raise AIBusyError("Model call rate limit reached.")
+            except api_errors():
+                self.breaker.success()
+                raise
+
+    def _complete(self, prompt, max_tokens, deadline, label, images=None):
+        start = time.perf_counter()
+        if images:
+            # Vision call: the text plus each image as a data: URL, on the vision model
+            content = [{"type": "text", "text": prompt}] + [
+                {"type": "image_url", "image_url": {"url": url, "detail": detail}} for url, detail in images]
+            response = self._create(deadline, model=self.vision_model, messages=[{"role": "user", "content": content}],
+                                    max_tokens=max_tokens)
+        else:
+            response = self._create(deadline, messages=[{"role": "user", "content": prompt}], max_tokens=max_tokens)
+        choice = response.choices[0]
+        token_usage.record(label, prompt, choice.message.content, time.perf_counter() - start,
+                           usage=response.usage, truncated=choice.finish_reason == "length")
+        return choice.message.content.strip()
+
+    def chat_completion(self, prompt, max_tokens, timeout=None, label=None, images=None):
+        # `label` (usually the prompt template's name) groups the call in token_usage and metrics;
+        # `images` is a list of (data URL, detail) pairs sent along with the prompt
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = self._chat_completion(prompt, max_tokens, timeout, label, images)
+            outcome = "ok"
+            return result
+        finally:
+            metrics.observe("openai", time.perf_counter() - start, template=label or "other", outcome=outcome)
+
+    def _chat_completion(self, prompt, max_tokens, timeout, label, images=None):
+        timeout = self.timeout if timeout is None else timeout
+        key_text = f"{self.model}\0{max_tokens}\0{prompt}"
+        if images:
+            key_text += "".join(f"\0{detail}\0{url}" for url, detail in images)
+        key = hashlib.sha256(key_text.encode("utf-8")).hexdigest()
+
+        # Single flight: a second identical request waits for the first one's answer
+        self._pool()
+        with self._lock:
+            shared = self._inflight.get(key)
+            if shared is None:
+                result = self._inflight[key] = Future()
+        if shared is not None:
+            try:
+                return shared.result(timeout=timeout)
+            except FutureTimeout:
+                raise TimeoutError(f"Model call did not finish within {timeout}s.")
+
+        try:
+            ticket = self._admit()
+            try:
+                call = self.submit(self._complete, prompt, max_tokens, time.monotonic() + timeout, label, images)
+            except BaseException:
+                self.breaker.release(ticket)
+                raise
+        except BaseException as e:
+            self._settle(key, result, error=e)
+            raise
+        # Also runs when the call is cancelled before it started
+        call.add_done_callback(lambda f: self.breaker.release(ticket))
+        call.add_done_callback(lambda f: self._settle(key, result, call=f))
+        try:
+            return result.result(timeout=timeout)
+        except FutureTimeout:
+            call.cancel()
+            raise TimeoutError(f"Model call did not finish within {timeout}s.")
+
+    def _settle(self, key, result, call=None, error=None):
+        with self._lock:
+            if self._inflight.get(key) is result:
+                del self._inflight[key]
+        if result.done():
+            return
+        if call is not None:
+            if call.cancelled():
+                error = TimeoutError("Model call was cancelled before it started.")
+            else:
+                error = call.exception()
+        if error is not None:
+            result.set_exception(error)
+        else:
+            result.set_result(call.result())
+
+    def stream_chat_completion(self, prompt, max_tokens, timeout=None, label=None):
+        # Streams run in the request thread (the response is a generator), but still
+        # hold one of the model slots for their whole duration
+        timeout = self.timeout if timeout is None else timeout
+        _, slots = self._pool()
+        ticket = self._admit()
+        if not slots.acquire(timeout=self.queue_timeout):
+            self.breaker.release(ticket)
+            raise AIBusyError(f"All {self.max_concurrency} model slots are busy.")
+        start = time.perf_counter()
+        pieces, usage, finish_reason = [], None, None
+        outcome = "error"
+        try:
+            try:
+                stream = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=max_tokens,
+                    timeout=timeout,
+                    stream=True,
+                    # The last chunk then carries the usage for the whole completion
+                    stream_options={"include_usage": True},
+                )
+            except retryable_errors():
+                self.breaker.failure()
+                raise
+            except api_errors():
+                self.breaker.success()
+                raise
+            try:
+                for chunk in stream:
+                    usage = getattr(chunk, "usage", None) or usage
+                    if chunk.choices:
+                        finish_reason = chunk.choices[0].finish_reason or finish_reason
+                        if chunk.choices[0].delta.content:
+                            pieces.append(chunk.choices[0].delta.content)
+                            yield chunk.choices[0].delta.content
+            except Exception:
+                # The connection broke or the API errored partway through the answer
+                self.breaker.failure()
+                raise
+            self.breaker.success()
+            token_usage.record(label, prompt, "".join(pieces), time.perf_counter() - start,
+                               usage=usage, truncated=finish_reason == "length")
+            outcome = "ok"
+        finally:
+            # Also reached when the client disconnects (GeneratorExit), which settles nothing
+            self.breaker.release(ticket)
+            slots.release()
+            metrics.observe("openai", time.perf_counter() - start, template=label or "other", outcome=outcome)
@@ -0,0 +1,155 @@
+import os
+import gzip
+import json
+import hashlib
+import mimetypes
+from flask import current_app, request, send_from_directory, url_for
+
+# Built into static/dist/, which is served like any other static file
+BUILD_DIR = "dist"
+MANIFEST = "manifest.json"
+# Never fingerprinted: the build output itself and user uploads (served from /avatars)
+SKIP_DIRS = {BUILD_DIR, "uploads"}
+# Precompressed at build time; images and fonts are compressed already
+PRECOMPRESS = {".css", ".js", ".json", ".map", ".svg", ".txt", ".ico", ".html", ".xml"}
+# Compressed on the fly when larger than COMPRESS_MIN_SIZE
+COMPRESS_MIMETYPES = {"text/html", "text/plain", "text/csv", "application/json"}
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _brotli():
+    # Brotli is preferred when installed; everything falls back to gzip without it
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def build_assets(static_folder):
+    # Copies every static file to dist/<name>.<content hash>.<ext>, with .gz and .br siblings for
+    # text assets where they are smaller, and writes the manifest mapping the plain names to them.
+    # Files from earlier builds that are no longer referenced are removed. Returns the manifest.
+    brotli = _brotli()
+    build = os.path.join(static_folder, BUILD_DIR)
+    manifest, written = {}, set()
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder:
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            logical = os.path.relpath(path, static_folder).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                data = f.read()
+            stem, ext = os.path.splitext(logical)
+            hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+            variants = {hashed: data}
+            if ext.lower() in PRECOMPRESS:
+                # mtime=0 keeps the .gz identical across builds of the same file
+                variants[hashed + ".gz"] = gzip.compress(data, compresslevel=9, mtime=0)
+                if brotli is not None:
+                    variants[hashed + ".br"] = brotli.compress(data, quality=11)
+            for filename, content in variants.items():
+                if filename != hashed and len(content) >= len(data):
+                    continue
+                target = os.path.join(build, filename)
+                if not os.path.exists(target):
+                    _write(target, content)
+                written.add(os.path.normpath(target))
+            manifest[logical] = f"{BUILD_DIR}/{hashed}"
+
+    for root, _, files in os.walk(build):
+        for name in files:
+            path = os.path.normpath(os.path.join(root, name))
+            if path not in written and name != MANIFEST:
+                os.remove(path)
+    _write(os.path.join(build, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+class Assets:
+    # Static files come from the fingerprinted build when there is one: asset_url() in templates
+    # resolves "logo.png" to "dist/logo.<hash>.png", which is served with a year-long immutable
+    # Cache-Control and as .br or .gz when the browser accepts it. Without a build (local
+    # development) asset_url() returns the plain file. Dynamic responses such as HTML are
+    # compressed on the fly once they pass COMPRESS_MIN_SIZE.
+    def __init__(self):
+        self.app = None
+        self.manifest = {}
+        self._fingerprinted = set()
+
+    def init_app(self, app):
+        self.app = app
+        self.load_manifest()
+        app.jinja_env.globals['asset_url'] = self.url
+        app.view_functions['static'] = self.send_static
+        app.after_request(self.compress_response)
+
+    @property
+    def config(self):
+        return self.app.config
+
+    def load_manifest(self):
+        try:
+            with open(os.path.join(self.app.static_folder, BUILD_DIR, MANIFEST)) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+        self._fingerprinted = set(self.manifest.values())
+        return self.manifest
+
+    def url(self, filename):
+        return url_for('static', filename=self.manifest.get(filename, filename))
+
+    def send_static(self, filename):
+        if filename not in self._fingerprinted:
+            return current_app.send_static_file(filename)
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        sent, encoding = filename, None
+        for name, suffix in ENCODINGS:
+            if request.accept_encodings[name] and os.path.exists(
+                    os.path.join(self.app.static_folder, filename + suffix)):
+                sent, encoding = filename + suffix, name
+                break
+        max_age = self.config['STATIC_CACHE_MAX_AGE']
+        response = send_from_directory(self.app.static_folder, sent, mimetype=mimetype, max_age=max_age)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if os.path.splitext(filename)[1].lower() in PRECOMPRESS:
+            response.vary.add('Accept-Encoding')
+        # The name changes whenever the content does, so browsers never need to revalidate
+        response.headers['Cache-Control'] = f"public, max-age={max_age}, immutable"
+        return response
+
+    def compress_response(self, response):
+        if (not self.config['COMPRESS_RESPONSES'] or response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code in (204, 206, 304)
+                or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES):
+            return response
+        if response.content_length is not None and response.content_length < self.config['COMPRESS_MIN_SIZE']:
+            return response
+        data = response.get_data()
+        if len(data) < self.config['COMPRESS_MIN_SIZE']:
+            return response
+        response.vary.add('Accept-Encoding')
+        brotli = _brotli()
+        if brotli is not None and request.accept_encodings['br']:
+            compressed, encoding = brotli.compress(data, quality=self.config['COMPRESS_BROTLI_QUALITY']), "br"
+        elif request.accept_encodings['gzip']:
+            compressed, encoding = gzip.compress(data, compresslevel=self.config['COMPRESS_GZIP_LEVEL']), "gzip"
+        else:
+            return response
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            # The same entity in a different encoding must not share a strong ETag
+            response.set_etag(etag, weak=True)
+        return response
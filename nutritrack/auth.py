@@ -1,18 +1,20 @@
-from flask_mail import Message
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadTimeSignature
-from . import mail, db
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
+from . import mail_outbox, db, insight_cache, job_runner, google_oauth, assets
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify, abort, Response, stream_with_context, send_from_directory
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from .models import User, History, MealPlan
+from .models import User, History, MealPlan, DailyNutritionTotals, Job
 from . import db
-from .utils import analyze_nutrition, get_daily_insight, get_calorie_recommendation_from_openai, calculate_bmi
+from .utils import analyze_nutrition, analyze_nutrition_batch, stream_meal_plan, finish_streamed_meal_plan, get_daily_insight, fallback_daily_insight, explain_calorie_target, calculate_bmi
+from .rollups import remove_from_daily_totals, get_daily_totals, lifetime_stats, period_totals, today_overview
+from .records import save_history, save_history_batch, save_meal_plan
+from .pagination import keyset_page
+from .cache import invalidate_user_caches
+from .images import ImageError, VARIANT_NAME, process_profile_picture, prepare_meal_photo, delete_profile_picture, avatar_urls, avatar_dir
 import json
-from datetime import datetime, time, date, timedelta
-import os
+from datetime import datetime, date, timedelta
 
 auth = Blueprint('auth', __name__)
-auth.google=None
 
 
 @auth.route("/register", methods=["GET", "POST"])
@@ -67,63 +69,25 @@ def login():
 @login_required
 def dashboard():
     today = datetime.now().date()
-    start_of_day = datetime.combine(today, time.min)
-    end_of_day = datetime.combine(today, time.max)
 
-    history = History.query.filter(
-        History.user_id == current_user.id,
-        History.timestamp.between(start_of_day, end_of_day)
-    ).all()
-
-    total_calories = total_protein = total_carbs = total_fats = total_sugars = total_fibre = 0
-    parsed_history = []
-    for record in history:
-        try:
-            data = json.loads(record.nutrition_result)
-
-            total_calories += data.get("calories", {}).get("value", 0)
-            total_protein += data.get("protein", {}).get("value", 0)
-            total_carbs += data.get("carbohydrates", {}).get("value", 0)
-            total_fats += data.get("fats", {}).get("value", 0)
-            total_sugars += data.get("sugars", {}).get("value", 0)
-            total_fibre += data.get("fibre", {}).get("value", 0)
-
-            if "calories" in data:
-                parsed_history.append({
-                    "food_name": record.food_name,
-                    "timestamp": record.timestamp.strftime("%Y-%m-%d %H:%M"),
-                    "calories": data.get("calories", {}).get("value", 0)
-                })
-        except Exception as e:
-            print(f"⚠️ Dashboard data processing failed for record ID {record.id}: {e}")
-
-    totals = {
-        "calories": round(total_calories), "protein": round(total_protein),
-        "carbohydrates": round(total_carbs), "fats": round(total_fats),
-        "sugars": round(total_sugars), "fibre": round(total_fibre)
-    }
+    # A fixed number of round trips whatever the history size: the user (loaded once by
+    # Flask-Login), today's rollup row, and today's entries together with the latest meal plan
+    totals, total_count = get_daily_totals(current_user.id, today)
+    recent_entries, recent_meal = today_overview(current_user.id, today)
 
     insight = {}
-    if len(parsed_history) > 0:
-        insight_raw = get_daily_insight(totals, len(parsed_history), current_user.recommended_calories, user_goal=current_user.goal)
-        try:
-            insight = json.loads(insight_raw) if insight_raw else {}
-        except Exception as e:
-            print(f"⚠️ Insight JSON parsing failed: {e}")
-            insight = {}
+    if total_count > 0:
+        insight = cached_daily_insight(current_user, today, totals, total_count)
 
     insight.setdefault("food_insight", "Log your first food to get a daily insight!")
     insight.setdefault("calorie_insight", "Your calorie summary will appear here.")
     insight.setdefault("tip", "Ready for a new day! Analyze a meal to get started.")
 
-    recent_meal = MealPlan.query.filter_by(user_id=current_user.id).order_by(MealPlan.timestamp.desc()).first()
-
-
     return render_template(
         "dashboard.html",
         totals=totals,
-        total_count=len(parsed_history),
-        recent_entries=parsed_history[:3],
+        total_count=total_count,
+        recent_entries=recent_entries,
         recent_meal=recent_meal,
         insight=insight,
         username=current_user.username,
@@ -133,6 +97,22 @@ def dashboard():
                     current_user.last_health_update and (datetime.now() - current_user.last_health_update).days >= 7)
     )
 
+def cached_daily_insight(user, day, totals, food_count):
+    # The key covers everything the prompt is built from, so repeat views reuse the answer
+    key = f"{user.id}:{day.isoformat()}:" + insight_cache.digest(
+        totals, food_count, user.recommended_calories, user.goal
+    )
+    insight = insight_cache.get(key)
+    if insight is not None:
+        return dict(insight)
+
+    insight = get_daily_insight(totals, food_count, user.recommended_calories, user_goal=user.goal)
+    if insight is None:
+        return fallback_daily_insight(totals, food_count, user.recommended_calories)
+    if insight:
+        insight_cache.set(key, insight)
+    return dict(insight)
+
 @auth.route("/logout", methods=["GET", "POST"])
 @login_required
 def logout():
@@ -144,28 +124,42 @@ def logout():
 @login_required
 def nutrition():
     result = None
+    if request.method == 'GET' and request.args.get('job', type=int):
+        job = finished_job(request.args.get('job', type=int), 'nutrition')
+        record = db.session.get(History, job.result_id) if job else None
+        if record:
+            flash("Nutrition analysis saved to your history.", "success")
+            result = record.nutrition_data
+
     if request.method == 'POST':
-        photo = request.files.get('photo')
         food_name = request.form.get('food_name')
         ingredients = request.form.get('ingredients')
         preparation = request.form.get('preparation')
 
+        # The upload is already on disk (DiskUploadRequest); only the downscaled copy is kept
+        upload = request.files.get('photo')
+        photo = None
+        if upload and upload.filename:
+            try:
+                photo = prepare_meal_photo(upload.stream)
+            except ImageError as e:
+                flash(str(e), 'danger')
+                return redirect(url_for("auth.nutrition"))
+
+        if current_app.config['BACKGROUND_JOBS']:
+            job = job_runner.enqueue(current_user.id, 'nutrition', {
+                'food_name': food_name, 'ingredients': ingredients, 'preparation': preparation,
+                'photo': photo.to_dict() if photo else None,
+            })
+            return render_template('nutrition.html', result=None, job_id=job.id)
+
         try:
             raw_result = analyze_nutrition(photo, food_name, ingredients, preparation, user_goal=current_user.goal)
             if not raw_result:
                 flash("Failed to analyze nutrition. Please try again.", "danger")
                 return redirect(url_for("auth.nutrition"))
 
-            parsed_result = json.loads(raw_result)
-
-            new_record = History(
-                food_name=food_name,
-                ingredients=ingredients,
-                nutrition_result=raw_result,
-                user_id=current_user.id
-            )
-            db.session.add(new_record)
-            db.session.commit()
+            _, parsed_result = save_history(current_user.id, food_name, ingredients, raw_result)
 
             flash("Nutrition analysis saved to your history.", "success")
             result = parsed_result
@@ -175,79 +169,120 @@ def nutrition():
 
     return render_template('nutrition.html', result=result)
 
-@auth.route("/profile", methods=["GET", "POST"])
+@auth.route('/nutrition/batch', methods=['GET', 'POST'])
 @login_required
-def profile():
-    from werkzeug.utils import secure_filename
-    import os
+def nutrition_batch():
+    results = []
+    if request.method == 'POST':
+        items = [
+            {'food_name': name.strip(), 'ingredients': ingredients, 'preparation': preparation}
+            for name, ingredients, preparation in zip(request.form.getlist('food_name'),
+                                                      request.form.getlist('ingredients'),
+                                                      request.form.getlist('preparation'))
+            if name.strip()
+        ]
+        if not items:
+            flash("Add at least one food to analyze.", "danger")
+            return redirect(url_for("auth.nutrition_batch"))
+        if len(items) > current_app.config['NUTRITION_BATCH_MAX']:
+            flash(f"You can analyze up to {current_app.config['NUTRITION_BATCH_MAX']} foods at once.", "danger")
+            return redirect(url_for("auth.nutrition_batch"))
+
+        try:
+            raw_results = analyze_nutrition_batch(items, user_goal=current_user.goal)
+            analyzed = [(item, raw) for item, raw in zip(items, raw_results) if raw]
+            saved = save_history_batch(current_user.id, [
+                (item['food_name'], item['ingredients'], raw) for item, raw in analyzed
+            ])
+            results = [{'food_name': item['food_name'], 'result': entry[1]}
+                       for (item, _), entry in zip(analyzed, saved) if entry]
+
+            failed = len(items) - len(results)
+            if results:
+                flash(f"{len(results)} nutrition analyses saved to your history.", "success")
+            if failed:
+                flash(f"{failed} of {len(items)} foods could not be analyzed. Please try them again.", "warning")
+        except Exception as e:
+            flash(f'Error: {e}', 'danger')
 
-    uploads_dir = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
-    os.makedirs(uploads_dir, exist_ok=True)
+    return render_template('nutrition_batch.html', results=results,
+                           batch_max=current_app.config['NUTRITION_BATCH_MAX'])
 
+@auth.route("/profile", methods=["GET", "POST"])
+@login_required
+def profile():
     user = current_user
-    history_count = History.query.filter_by(user_id=user.id).count()
-    meals_count = MealPlan.query.filter_by(user_id=user.id).count()
 
-    total_calories = 0
-    history = History.query.filter_by(user_id=user.id).all()
-    for record in history:
+    if request.method == "POST":
+        file = request.files.get("profile_pic")
         try:
-            data = json.loads(record.nutrition_result)
-            total_calories += data.get("calories", {}).get("value", 0)
-        except:
-            continue
+            # One byte over the limit is enough to know it's too big
+            data = file.stream.read(current_app.config['PROFILE_PIC_MAX_BYTES'] + 1) if file else b""
+            new_url = process_profile_picture(user.id, data)
+        except ImageError as e:
+            flash(str(e), "danger")
+        else:
+            old_url = user.profile_pic_url
+            user.profile_pic_url = new_url
+            db.session.commit()
+            if old_url != new_url:
+                delete_profile_picture(old_url)
+            flash("Profile picture updated!", "success")
+        return redirect(url_for("auth.profile"))
 
-    if request.method == "POST":
-        if "profile_pic" in request.files:
-            file = request.files["profile_pic"]
-            if file.filename and file.filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-                filename = secure_filename(f"{user.id}_profile.png")
-                filepath = os.path.join(uploads_dir, filename)
-                file.save(filepath)
-                flash("Profile picture updated!", "success")
-            else:
-                flash("Invalid file type. Only PNG/JPG allowed.", "danger")
-            return redirect(url_for("auth.profile"))
-
-    profile_pic = current_user.profile_pic_url or url_for('static', filename='profile_pics/default.png')
-    # Check for a user-uploaded file, which takes precedence
-    user_uploaded_pic = os.path.join(os.path.dirname(__file__), 'static', 'uploads', f"{current_user.id}_profile.png")
-    if os.path.exists(user_uploaded_pic):
-        profile_pic = url_for('static', filename=f'uploads/{current_user.id}_profile.png')
+    profile_pic = avatar_urls(user.profile_pic_url, 100) or {"src": assets.url('profile_pics/default.png')}
 
     return render_template(
         "profile.html",
         user=user,
-        history_count=history_count,
-        meals_count=meals_count,
-        total_calories=total_calories,
-        profile_pic=profile_pic
+        weekly_totals=period_totals(user.id, "week", 4),
+        monthly_totals=period_totals(user.id, "month", 6),
+        profile_pic=profile_pic,
+        **lifetime_stats(user.id)
     )
 
 
-@auth.route("/history")
-@login_required
-def history():
-    records = History.query.filter_by(user_id=current_user.id).order_by(History.timestamp.desc()).all()
+@auth.route("/avatars/<filename>")
+def avatar(filename):
+    # Names carry a hash of the upload, so a changed picture is a new URL and these never go stale
+    if not VARIANT_NAME.match(filename):
+        abort(404)
+    max_age = current_app.config['PROFILE_PIC_CACHE_MAX_AGE']
+    response = send_from_directory(avatar_dir(), filename, max_age=max_age)
+    response.headers['Cache-Control'] = f"public, max-age={max_age}, immutable"
+    return response
 
-    for r in records:
-        try:
-            parsed = json.loads(r.nutrition_result)
 
-            if isinstance(parsed.get("vitamins"), list):
-                parsed["vitamins"] = {item["name"]: {"value": item["value"], "unit": item["unit"]} for item in parsed["vitamins"]}
-            if isinstance(parsed.get("minerals"), list):
-                parsed["minerals"] = {item["name"]: {"value": item["value"], "unit": item["unit"]} for item in parsed["minerals"]}
+def parse_history_record(r):
+    required_keys = ["calories", "protein", "carbohydrates", "fats", "sugars", "fibre"]
+    parsed = r.nutrition_data
+    if isinstance(parsed, dict) and all(k in parsed for k in required_keys):
+        r.parsed_data = parsed
+    else:
+        r.parsed_data = None
 
-            required_keys = ["calories", "protein", "carbohydrates", "fats", "sugars", "fibre"]
-            if all(k in parsed for k in required_keys):
-                r.parsed_data = parsed
-            else:
-                r.parsed_data = None
-        except:
-            r.parsed_data = None
+def history_page(cursor):
+    query = History.query.filter_by(user_id=current_user.id)
+    records, next_cursor = keyset_page(query, History, cursor, current_app.config['HISTORY_PAGE_SIZE'])
+    for r in records:
+        parse_history_record(r)
+    return records, next_cursor
 
-    return render_template("history.html", records=records)
+@auth.route("/history")
+@login_required
+def history():
+    records, next_cursor = history_page(request.args.get('cursor'))
+    return render_template("history.html", records=records, next_cursor=next_cursor)
+
+@auth.route("/history/page")
+@login_required
+def history_more():
+    records, next_cursor = history_page(request.args.get('cursor'))
+    return jsonify(
+        rows=render_template("_history_rows.html", records=records),
+        modals=render_template("_history_modals.html", records=records),
+        next_cursor=next_cursor,
+    )
 
 @auth.route('/')
 def home():
@@ -257,46 +292,146 @@ def home():
 @login_required
 def plan_meal():
     meal_plan = None
+    plan_id = request.args.get('plan', type=int)
+    if request.method == "GET" and request.args.get('job', type=int):
+        job = finished_job(request.args.get('job', type=int), 'meal_plan')
+        plan_id = job.result_id if job else None
+    if request.method == "GET" and plan_id:
+        plan = MealPlan.query.filter_by(id=plan_id, user_id=current_user.id).first()
+        if plan:
+            meal_plan = plan.meal_plan_data
+
     if request.method == "POST":
         requirements = request.form.get('requirements')
 
+        if current_app.config['BACKGROUND_JOBS']:
+            job = job_runner.enqueue(current_user.id, 'meal_plan', {'requirements': requirements})
+            return render_template("plan_meal.html", meal_plan=None, job_id=job.id)
+
         try:
             from .utils import generate_meal_plan
             raw_result = generate_meal_plan(requirements,user_goal=current_user.goal)
             if not raw_result:
                 flash("Failed to generate meal plan. Please try again.", "danger")
-                return redirect(url_for("auth.plan-meal"))
-
-            parsed_result = json.loads(raw_result)
+                return redirect(url_for("auth.plan_meal"))
 
-            new_plan = MealPlan(
-                requirements=requirements,
-                meal_plan_result=raw_result,
-                user_id=current_user.id
-            )
-            db.session.add(new_plan)
-            db.session.commit()
+            _, parsed_result = save_meal_plan(current_user.id, requirements, raw_result)
 
             meal_plan = parsed_result
 
         except Exception as e:
             flash(f"Error generating meal plan: {e}", "danger")
 
-    return render_template("plan_meal.html", meal_plan=meal_plan)
+    return render_template("plan_meal.html", meal_plan=meal_plan,
+                           streaming=current_app.config['MEAL_PLAN_STREAMING'])
 
-@auth.route("/your-meals")
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@auth.route("/plan-meal/stream")
 @login_required
-def your_meals():
+def plan_meal_stream():
+    if not current_app.config['MEAL_PLAN_STREAMING']:
+        abort(404)
+    requirements = request.args.get('requirements', '').strip()
+    if not requirements:
+        abort(400)
+    user_id, user_goal = current_user.id, current_user.goal
+
+    def generate():
+        chunks = []
+        try:
+            for token in stream_meal_plan(requirements, user_goal=user_goal):
+                chunks.append(token)
+                yield sse("token", {"text": token})
+
+            raw_result = finish_streamed_meal_plan("".join(chunks))
+            if not raw_result:
+                yield sse("error", {"message": "Failed to generate meal plan. Please try again."})
+                return
+            plan, parsed_result = save_meal_plan(user_id, requirements, raw_result)
+            yield sse("done", {"meal_plan": parsed_result,
+                               "result_url": url_for('auth.plan_meal', plan=plan.id)})
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ Meal plan stream failed: {e}")
+            yield sse("error", {"message": f"Error generating meal plan: {e}"})
 
-    meals = MealPlan.query.filter_by(user_id=current_user.id).order_by(MealPlan.timestamp.desc()).all()
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
+def finished_job(job_id, kind):
+    return Job.query.filter_by(id=job_id, user_id=current_user.id, kind=kind, status='succeeded').first()
+
+@auth.route("/jobs/<int:id>")
+@login_required
+def job_status(id):
+    job = Job.query.filter_by(id=id, user_id=current_user.id).first()
+    if not job:
+        abort(404)
+    job_runner.ensure_started()
+
+    result_endpoint = {'nutrition': 'auth.nutrition', 'meal_plan': 'auth.plan_meal'}[job.kind]
+    return jsonify({
+        "id": job.id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "error": job.error if job.status == 'failed' else None,
+        "result_url": url_for(result_endpoint, job=job.id) if job.status == 'succeeded' else None,
+    })
+
+@auth.route("/api/trends")
+@login_required
+def trends():
+    from .trends import compute_trends
+
+    # ?start=YYYY-MM-DD&end=YYYY-MM-DD&period=day|week|month&window=7, defaulting to the last 30 days
+    try:
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else date.today()
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else end - timedelta(days=29)
+        window = int(request.args.get('window', 7))
+    except ValueError:
+        return jsonify(error="Dates must be YYYY-MM-DD and window a whole number of days."), 400
+    if not 1 <= window <= 90:
+        return jsonify(error="window must be between 1 and 90 days."), 400
+    if (end - start).days + 1 > current_app.config['TRENDS_MAX_DAYS']:
+        return jsonify(error=f"Ranges are limited to {current_app.config['TRENDS_MAX_DAYS']} days."), 400
+
+    try:
+        data = compute_trends(
+            current_user.id, start, end,
+            period=request.args.get('period', 'day'),
+            window=window,
+            target=current_user.recommended_calories,
+            tolerance=current_app.config['TRENDS_ADHERENCE_TOLERANCE'],
+            version=current_user.rollup_version,
+        )
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(data)
+
+def meals_page(cursor):
+    query = MealPlan.query.filter_by(user_id=current_user.id)
+    meals, next_cursor = keyset_page(query, MealPlan, cursor, current_app.config['HISTORY_PAGE_SIZE'])
     for meal in meals:
-        try:
-            meal.parsed_data = json.loads(meal.meal_plan_result)
-        except:
-            meal.parsed_data = {}
+        meal.parsed_data = meal.meal_plan_data or {}
+    return meals, next_cursor
 
-    return render_template("your_meals.html", meals=meals)
+@auth.route("/your-meals")
+@login_required
+def your_meals():
+    meals, next_cursor = meals_page(request.args.get('cursor'))
+    return render_template("your_meals.html", meals=meals, next_cursor=next_cursor)
+
+@auth.route("/your-meals/page")
+@login_required
+def your_meals_more():
+    meals, next_cursor = meals_page(request.args.get('cursor'))
+    return jsonify(
+        rows=render_template("_meal_rows.html", meals=meals),
+        modals=render_template("_meal_modals.html", meals=meals),
+        next_cursor=next_cursor,
+    )
 
 @auth.route('/delete-history/<int:id>', methods=["POST"])
 @login_required
@@ -306,8 +441,11 @@ def delete_history(id):
     if record.user_id != current_user.id:
         return "Unauthorized", 403
 
+    remove_from_daily_totals(record)
+    day = record.timestamp.date()
     db.session.delete(record)
     db.session.commit()
+    invalidate_user_caches(current_user.id, day)
     return '', 200
 
 @auth.route('/delete-meal/<int:id>', methods=["POST"])
@@ -356,30 +494,26 @@ def change_password():
 @auth.route('/delete-account', methods=['POST'])
 @login_required
 def delete_account():
-    user_to_delete = User.query.get(current_user.id)
-
-    if not user_to_delete:
-        flash("User not found.", "danger")
-        return redirect(url_for('auth.profile'))
-
+    # Already loaded for this request by Flask-Login; no need to fetch it again
+    user_to_delete = current_user._get_current_object()
 
+    Job.query.filter_by(user_id=user_to_delete.id).delete()
     History.query.filter_by(user_id=user_to_delete.id).delete()
+    DailyNutritionTotals.query.filter_by(user_id=user_to_delete.id).delete()
     MealPlan.query.filter_by(user_id=user_to_delete.id).delete()
+    mail_outbox.cancel_queued(user_to_delete.email)
 
     try:
-        profile_pic_path = os.path.join(
-            os.path.dirname(__file__),
-            'static', 'uploads', f"{user_to_delete.id}_profile.png"
-        )
-        if os.path.exists(profile_pic_path):
-            os.remove(profile_pic_path)
-    except Exception as e:
+        delete_profile_picture(user_to_delete.profile_pic_url)
+    except OSError as e:
         print(f"Error deleting profile picture: {e}")
 
     logout_user()
 
+    user_id = user_to_delete.id
     db.session.delete(user_to_delete)
     db.session.commit()
+    invalidate_user_caches(user_id)
 
     flash("Your account has been permanently deleted.", "success")
     return redirect(url_for('auth.home'))
@@ -388,6 +522,8 @@ def delete_account():
 @auth.route("/health-details", methods=["GET", "POST"])
 @login_required
 def health_details():
+    from .calories import calorie_breakdown
+
     if request.method == "POST":
         current_user.dob = datetime.strptime(request.form.get('dob'), '%Y-%m-%d').date()
         current_user.gender = request.form.get('gender')
@@ -397,9 +533,9 @@ def health_details():
         current_user.goal = request.form.get('goal')
         current_user.last_health_update = datetime.now()
 
-        new_target = get_calorie_recommendation_from_openai(current_user)
-        if new_target:
-            current_user.recommended_calories = new_target
+        breakdown = calorie_breakdown(current_user, current_app.config['CALORIE_FORMULA'])
+        if breakdown:
+            current_user.recommended_calories = breakdown['recommended_calories']
 
         db.session.commit()
         flash("Your health details have been updated!", "success")
@@ -412,20 +548,32 @@ def health_details():
         "health_details.html",
         bmi=bmi,
         recommended_calories=recommended_calories,
+        breakdown=calorie_breakdown(current_user, current_app.config['CALORIE_FORMULA']),
         max_date=date.today().isoformat()
     )
 
+@auth.route('/health-details/explain', methods=['POST'])
+@login_required
+def explain_health_details():
+    from .calories import calorie_breakdown
+
+    breakdown = calorie_breakdown(current_user, current_app.config['CALORIE_FORMULA'])
+    if not breakdown:
+        return jsonify(error="Complete your health details first."), 400
+    # Falls back to a locally written explanation when the model is unavailable
+    return jsonify(explanation=explain_calorie_target(current_user, breakdown))
+
 @auth.route('/google-login')
 def google_login():
     # Redirect to Google's authentication page
     redirect_uri = url_for('auth.google_callback', _external=True)
-    return auth.google.authorize_redirect(redirect_uri)
+    return google_oauth().authorize_redirect(redirect_uri)
 
 
 @auth.route('/google-callback')
 def google_callback():
     # Get the authorization token from Google
-    token = auth.google.authorize_access_token()
+    token = google_oauth().authorize_access_token()
     # Get the user's profile info
     user_info = token.get('userinfo')
     if not user_info:
@@ -467,12 +615,14 @@ def forgot_password():
             # Create the reset URL
             reset_url = url_for('auth.reset_password', token=token, _external=True)
 
-            # Create and send the email
+            # Queue the email; the outbox sender delivers it after the response has gone out
+            from flask_mail import Message
+            mail_outbox.ensure_mail()
             msg = Message('Password Reset Request for NutriTrack AI',
                           sender=current_app.config['MAIL_USERNAME'],
                           recipients=[user.email])
             msg.body = f'Hello {user.username},\n\nPlease click the following link to reset your password: {reset_url}\n\nIf you did not request this, please ignore this email.'
-            mail.send(msg)
+            mail_outbox.enqueue(msg)
 
         # Show a confirmation message whether the user exists or not, for security
         flash('If an account with that email exists, a password reset link has been sent.', 'info')
@@ -0,0 +1,239 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, select
+
+
+class MemoryBackend:
+    # Per-process LRU dict; entries expire after their TTL
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+
+class DatabaseBackend:
+    # Shared between Gunicorn workers through the app database (CacheEntry table). Every call
+    # runs on its own connection and transaction, so a cache lookup never commits the request's
+    # half-finished work, and a failed one is rolled back without touching the request's session.
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+
+    @staticmethod
+    def _table():
+        from .models import CacheEntry
+        return CacheEntry.__table__
+
+    def get(self, key):
+        from . import db
+
+        table = self._table()
+        now = datetime.now()
+        with db.engine.begin() as connection:
+            row = connection.execute(
+                select(table.c.value, table.c.expires_at).where(table.c.key == key)).first()
+            if row is None:
+                return None
+            if row.expires_at < now:
+                connection.execute(table.delete().where(table.c.key == key))
+                return None
+            connection.execute(table.update().where(table.c.key == key).values(last_used=now))
+        return json.loads(row.value)
+
+    def set(self, key, value, ttl):
+        from . import db
+
+        table = self._table()
+        now = datetime.now()
+        fields = {"value": json.dumps(value), "expires_at": now + timedelta(seconds=ttl), "last_used": now}
+        with db.engine.begin() as connection:
+            if not connection.execute(table.update().where(table.c.key == key).values(**fields)).rowcount:
+                connection.execute(table.insert().values(key=key, **fields))
+
+            namespace = key.split(":", 1)[0] + ":"
+            in_scope = table.c.key.startswith(namespace)
+            overflow = connection.execute(select(func.count()).select_from(table).where(in_scope)).scalar()
+            overflow -= self.max_entries
+            if overflow > 0:
+                stale = select(table.c.key).where(in_scope).order_by(table.c.last_used).limit(overflow)
+                connection.execute(table.delete().where(table.c.key.in_(stale)))
+
+    def delete_prefix(self, prefix):
+        from . import db
+
+        table = self._table()
+        with db.engine.begin() as connection:
+            connection.execute(table.delete().where(table.c.key.startswith(prefix)))
+
+
+BACKENDS = {
+    "memory": MemoryBackend,
+    "database": DatabaseBackend,
+}
+
+
+class Cache:
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.backend = None
+        self.ttl = 0
+        self.enabled = False
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        # Reads e.g. INSIGHT_CACHE_BACKEND / INSIGHT_CACHE_TTL / INSIGHT_CACHE_SIZE
+        prefix = self.namespace.upper()
+        backend = app.config.get(f"{prefix}_CACHE_BACKEND", "memory")
+        if backend not in BACKENDS and backend != "none":
+            raise ValueError(f"Unknown {prefix}_CACHE_BACKEND '{backend}', expected one of {sorted(BACKENDS)} or 'none'.")
+        self.enabled = backend != "none"
+        self.ttl = int(app.config.get(f"{prefix}_CACHE_TTL", 3600))
+        if self.enabled:
+            self.backend = BACKENDS[backend](int(app.config.get(f"{prefix}_CACHE_SIZE", 1024)))
+
+    @staticmethod
+    def digest(*parts):
+        payload = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _key(self, key):
+        return f"{self.namespace}:{key}"
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        try:
+            value = self.backend.get(self._key(key))
+        except Exception as e:
+            print(f"⚠️ {self.namespace} cache read failed: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        try:
+            self.backend.set(self._key(key), value, self.ttl)
+        except Exception as e:
+            print(f"⚠️ {self.namespace} cache write failed: {e}")
+
+    def invalidate(self, prefix=""):
+        if not self.enabled:
+            return
+        try:
+            self.backend.delete_prefix(self._key(prefix))
+        except Exception as e:
+            print(f"⚠️ {self.namespace} cache invalidation failed: {e}")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+class PhotoCache:
+    # Meal photo analyses in the app database, keyed by the text fields (context_key) and
+    # matched by perceptual hash: a photo within PHOTO_HASH_DISTANCE bits of an earlier one
+    # with the same context reuses its answer. Only the hash is stored, never the photo.
+    def __init__(self):
+        self.enabled = False
+        self.ttl = 0
+        self.max_distance = 0
+        self.scan = 0
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PHOTO_CACHE', True)
+        self.ttl = int(app.config.get('PHOTO_CACHE_TTL', 30 * 24 * 3600))
+        self.max_distance = int(app.config.get('PHOTO_HASH_DISTANCE', 6))
+        self.scan = int(app.config.get('PHOTO_CACHE_SCAN', 200))
+
+    def get(self, context_key, phash):
+        from .images import hash_distance
+        from .models import PhotoAnalysis
+
+        if not self.enabled:
+            return None
+        try:
+            # The most recent entries for this context; the hash comparison is done here
+            rows = (PhotoAnalysis.query
+                    .filter(PhotoAnalysis.context_key == context_key,
+                            PhotoAnalysis.created_at >= datetime.now() - timedelta(seconds=self.ttl))
+                    .order_by(PhotoAnalysis.created_at.desc()).limit(self.scan)
+                    .with_entities(PhotoAnalysis.phash, PhotoAnalysis.result).all())
+        except Exception as e:
+            print(f"⚠️ photo cache read failed: {e}")
+            rows = []
+        best = min(rows, key=lambda row: hash_distance(row.phash, phash), default=None)
+        if best is None or hash_distance(best.phash, phash) > self.max_distance:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return best.result
+
+    def set(self, context_key, phash, value):
+        from . import db
+        from .models import PhotoAnalysis
+
+        if not self.enabled:
+            return
+        # Written on its own connection and transaction, like DatabaseBackend.set, so the
+        # request's pending work is neither committed early nor rolled back with a failed write
+        table = PhotoAnalysis.__table__
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(table.insert().values(context_key=context_key, phash=phash, result=value))
+                # Expired entries are dropped per context, which the (context_key, created_at) index covers
+                connection.execute(table.delete().where(
+                    table.c.context_key == context_key,
+                    table.c.created_at < datetime.now() - timedelta(seconds=self.ttl),
+                ))
+        except Exception as e:
+            print(f"⚠️ photo cache write failed: {e}")
+
+
+def invalidate_user_caches(user_id, day=None):
+    # Called whenever a user's History changes (`day` is the day that did). Other workers
+    # stop using cached trend months through User.rollup_version; this frees our own copies
+    # when a closed month changed
+    from . import insight_cache, trends_cache
+    insight_cache.invalidate(f"{user_id}:")
+    today = date.today()
+    if day is None or (day.year, day.month) < (today.year, today.month):
+        trends_cache.invalidate(f"{user_id}:")
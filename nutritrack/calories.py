@@ -0,0 +1,81 @@
+import numpy as np
+from .utils import calculate_age
+
+ACTIVITY_MULTIPLIERS = {
+    "Sedentary": 1.2,
+    "Lightly Active": 1.375,
+    "Moderately Active": 1.55,
+    "Very Active": 1.725,
+}
+
+GOAL_ADJUSTMENTS = {
+    "Weight Loss": -500,
+    "Maintain Weight": 0,
+    "Weight Gain": 400,
+}
+
+# Targets are never pushed below these, however large the deficit
+MIN_CALORIES = {"Male": 1500, "Female": 1200}
+
+
+def mifflin_st_jeor(weight_kg, height_cm, age, is_male):
+    return 10 * weight_kg + 6.25 * height_cm - 5 * age + np.where(is_male, 5, -161)
+
+
+def harris_benedict(weight_kg, height_cm, age, is_male):
+    # Roza & Shizgal (1984) revision
+    return np.where(
+        is_male,
+        88.362 + 13.397 * weight_kg + 4.799 * height_cm - 5.677 * age,
+        447.593 + 9.247 * weight_kg + 3.098 * height_cm - 4.330 * age,
+    )
+
+
+FORMULAS = {
+    "mifflin": ("Mifflin-St Jeor", mifflin_st_jeor),
+    "harris_benedict": ("Harris-Benedict", harris_benedict),
+}
+
+
+def _has_details(user):
+    return bool(user.weight_kg and user.height_cm and user.dob and user.gender in MIN_CALORIES
+                and user.activity_level in ACTIVITY_MULTIPLIERS and user.goal in GOAL_ADJUSTMENTS)
+
+
+def calorie_breakdown_batch(users, formula="mifflin"):
+    # One array pass for any number of users; entries are None for incomplete profiles
+    if formula not in FORMULAS:
+        raise ValueError(f"Unknown calorie formula '{formula}', expected one of {sorted(FORMULAS)}.")
+    complete = [user for user in users if _has_details(user)]
+    results = {}
+    if complete:
+        weight = np.array([u.weight_kg for u in complete], dtype=float)
+        height = np.array([u.height_cm for u in complete], dtype=float)
+        age = np.array([calculate_age(u.dob) for u in complete], dtype=float)
+        is_male = np.array([u.gender == "Male" for u in complete])
+        multiplier = np.array([ACTIVITY_MULTIPLIERS[u.activity_level] for u in complete])
+        adjustment = np.array([GOAL_ADJUSTMENTS[u.goal] for u in complete], dtype=float)
+        floor = np.array([MIN_CALORIES[u.gender] for u in complete], dtype=float)
+
+        bmr = FORMULAS[formula][1](weight, height, age, is_male)
+        tdee = bmr * multiplier
+        target = np.maximum(tdee + adjustment, floor)
+
+        columns = zip(age.astype(int).tolist(), np.rint(bmr).astype(int).tolist(), multiplier.tolist(),
+                      np.rint(tdee).astype(int).tolist(), adjustment.astype(int).tolist(),
+                      np.rint(target).astype(int).tolist())
+        for user, (age_, bmr_, multiplier_, tdee_, adjustment_, target_) in zip(complete, columns):
+            results[id(user)] = {
+                "formula": FORMULAS[formula][0],
+                "age": age_,
+                "bmr": bmr_,
+                "activity_multiplier": multiplier_,
+                "tdee": tdee_,
+                "goal_adjustment": adjustment_,
+                "recommended_calories": target_,
+            }
+    return [results.get(id(user)) for user in users]
+
+
+def calorie_breakdown(user, formula="mifflin"):
+    return calorie_breakdown_batch([user], formula)[0]
@@ -0,0 +1,105 @@
+import click
+
+
+def register_commands(app):
+
+    @app.cli.command("rebuild-rollups")
+    @click.option("--user-id", type=int, default=None, help="Only rebuild rollups for this user.")
+    def rebuild_rollups(user_id):
+        """Rebuild the daily nutrition totals from the stored History JSON."""
+        from .rollups import rebuild_daily_totals
+        count = rebuild_daily_totals(user_id)
+        print(f"✅ Rebuilt {count} daily nutrition rollups.")
+
+    @app.cli.command("recompute-calorie-targets")
+    @click.option("--formula", type=click.Choice(["mifflin", "harris_benedict"]), default=None,
+                  help="Defaults to CALORIE_FORMULA.")
+    def recompute_calorie_targets(formula):
+        """Recompute every user's recommended calories in one batch."""
+        from . import db
+        from .models import User
+        from .calories import calorie_breakdown_batch
+        users = User.query.filter(User.dob.isnot(None)).all()
+        breakdowns = calorie_breakdown_batch(users, formula or app.config['CALORIE_FORMULA'])
+        updated = 0
+        for user, breakdown in zip(users, breakdowns):
+            if breakdown and user.recommended_calories != breakdown["recommended_calories"]:
+                user.recommended_calories = breakdown["recommended_calories"]
+                updated += 1
+        db.session.commit()
+        print(f"✅ Recomputed calorie targets for {len(users)} users ({updated} changed).")
+
+    @app.cli.command("run-worker")
+    def run_worker():
+        """Process background nutrition and meal-plan jobs until interrupted."""
+        from . import job_runner
+        print("✅ Job worker started. Press Ctrl+C to stop.")
+        try:
+            job_runner.run_forever()
+        except KeyboardInterrupt:
+            pass
+
+    @app.cli.command("send-mail")
+    @click.option("--once", is_flag=True, help="Send whatever is due, then exit.")
+    def send_mail(once):
+        """Deliver queued outbox emails, reusing one SMTP connection per batch."""
+        from . import mail_outbox
+        if once:
+            handled = mail_outbox.drain()
+            status = mail_outbox.status()
+            print(f"✅ Handled {handled} emails: {status['sent']} sent, {status['retried']} to retry, "
+                  f"{status['failed']} failed, over {status['connections']} SMTP connections.")
+            return
+        print("✅ Mail sender started. Press Ctrl+C to stop.")
+        try:
+            mail_outbox.run_forever()
+        except KeyboardInterrupt:
+            pass
+
+    @app.cli.command("build-assets")
+    def build_assets():
+        """Fingerprint and precompress the static files into static/dist for asset_url()."""
+        from . import assets
+        from .assets import BUILD_DIR, build_assets as build
+        manifest = build(app.static_folder)
+        assets.load_manifest()
+        print(f"✅ Built {len(manifest)} static assets into static/{BUILD_DIR}.")
+
+    @app.cli.command("db-upgrade")
+    def db_upgrade():
+        """Apply pending schema migrations (creates the tables on a new database)."""
+        from .migrations import upgrade, current_version
+        applied = upgrade()
+        if applied:
+            print(f"✅ Applied migrations {applied}. Schema is at version {current_version()}.")
+        else:
+            print(f"✅ Schema is up to date (version {current_version()}).")
+
+    @app.cli.command("check-query-plans")
+    def check_query_plans_command():
+        """Fail if the hot per-user queries don't use their composite indexes."""
+        from .query_plans import check_query_plans
+        failed = False
+        for name, index, uses_index, plan in check_query_plans():
+            print(f"{'✅' if uses_index else '❌'} {name} ({index})")
+            if not uses_index:
+                failed = True
+                print("    " + plan.replace("\n", "\n    "))
+        if failed:
+            raise SystemExit(1)
+
+    @app.cli.command("check-query-counts")
+    @click.option("--user-id", type=int, required=True, help="Render the pages as this user.")
+    def check_query_counts_command(user_id):
+        """Fail if a page needs more database round trips than its budget."""
+        from .query_counts import check_page_query_counts
+        failed = False
+        for path, status, count, budget, statements in check_page_query_counts(app, user_id):
+            ok = status == 200 and count <= budget
+            print(f"{'✅' if ok else '❌'} {path}: {count} queries (budget {budget}, HTTP {status})")
+            if not ok:
+                failed = True
+                for sql in statements:
+                    print("    " + " ".join(sql.split()))
+        if failed:
+            raise SystemExit(1)
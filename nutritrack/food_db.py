@@ -0,0 +1,124 @@
+import os
+import re
+import csv
+import json
+import difflib
+import threading
+
+FOODS_CSV = os.path.join(os.path.dirname(__file__), 'data', 'foods.csv')
+
+MACRO_UNITS = {
+    "calories": "kcal", "protein": "g", "carbohydrates": "g",
+    "fats": "g", "sugars": "g", "fibre": "g",
+}
+
+# Preparations that don't change the per-100g values enough to need the model
+SIMPLE_PREPARATIONS = {
+    "", "none", "n a", "na", "raw", "fresh", "plain", "as is", "whole", "ready to eat",
+    "boiled", "hard boiled", "steamed", "cooked", "baked", "grilled", "sliced", "chopped", "peeled",
+}
+
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10, "half": 0.5, "a half": 0.5,
+}
+
+# Grams per unit; None means "one serving" from the CSV
+UNITS = {
+    "g": 1, "gram": 1, "grams": 1, "gr": 1, "kg": 1000, "ml": 1, "oz": 28.35, "ounce": 28.35, "ounces": 28.35,
+    "cup": None, "cups": None, "slice": None, "slices": None, "piece": None, "pieces": None,
+    "serving": None, "servings": None, "bowl": None, "bowls": None, "glass": None, "glasses": None,
+}
+
+QUANTITY_RE = re.compile(
+    r"^(?P<amount>\d+(?:\.\d+)?|" + "|".join(sorted(map(re.escape, NUMBER_WORDS), key=len, reverse=True)) + r")"
+    r"(?:\s+|(?<=\d)(?=[a-z]))x?\s*(?:(?P<unit>" + "|".join(sorted(map(re.escape, UNITS), key=len, reverse=True)) + r")\b)?"
+    r"\s*(?:of\s+)?(?P<name>.+)$"
+)
+
+_index = None
+_names = None
+_lock = threading.Lock()
+
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", re.sub(r"[^a-z0-9. ]", " ", (text or "").lower())).strip()
+
+
+def _load():
+    global _index, _names
+    with _lock:
+        if _index is not None:
+            return
+        index = {}
+        with open(FOODS_CSV, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                food = {
+                    "name": row["name"],
+                    "serving_g": float(row["serving_g"]),
+                    "per_100g": {key: float(row[key]) for key in MACRO_UNITS},
+                    "vitamins": {"Vitamin A": (float(row["vitamin_a_mcg"]), "mcg"),
+                                 "Vitamin C": (float(row["vitamin_c_mg"]), "mg")},
+                    "minerals": {"Calcium": (float(row["calcium_mg"]), "mg"),
+                                 "Iron": (float(row["iron_mg"]), "mg")},
+                    "insight": row["insight"],
+                }
+                for alias in [row["name"]] + [a for a in row["aliases"].split("|") if a]:
+                    index[_normalize(alias)] = food
+        _names = list(index)
+        _index = index
+
+
+def find_food(name):
+    if _index is None:
+        _load()
+    key = _normalize(name)
+    if not key:
+        return None
+    food = _index.get(key)
+    if food is None and key.endswith("s"):
+        food = _index.get(key[:-1])
+    if food is None:
+        match = difflib.get_close_matches(key, _names, n=1, cutoff=0.9)
+        food = _index[match[0]] if match else None
+    return food
+
+
+def parse_quantity(text):
+    # "2 boiled eggs" -> (2, None, "boiled eggs"); "150g rice" -> (150, "g", "rice")
+    text = _normalize(text)
+    match = QUANTITY_RE.match(text)
+    if not match:
+        return 1, None, text
+    amount = match.group("amount")
+    amount = NUMBER_WORDS[amount] if amount in NUMBER_WORDS else float(amount)
+    return amount, match.group("unit"), match.group("name").strip()
+
+
+def lookup_nutrition(food_name, ingredients=None, preparation=None):
+    # Returns a JSON string in the same schema as the model, or None to fall back
+    if _normalize(preparation).strip(". ") not in SIMPLE_PREPARATIONS:
+        return None
+
+    amount, unit, name = parse_quantity(food_name)
+    food = find_food(name)
+    if food is None:
+        return None
+
+    # Anything beyond the food itself in the ingredient list makes it a composite meal
+    for ingredient in filter(None, (_normalize(i) for i in (ingredients or "").split(","))):
+        if find_food(parse_quantity(ingredient)[2]) is not food:
+            return None
+
+    grams_per_unit = UNITS.get(unit) if unit else None
+    grams = amount * (grams_per_unit if grams_per_unit else food["serving_g"])
+    factor = grams / 100
+
+    result = {key: {"value": round(food["per_100g"][key] * factor, 1), "unit": unit_name}
+              for key, unit_name in MACRO_UNITS.items()}
+    result["calories"]["value"] = round(result["calories"]["value"])
+    result["vitamins"] = {k: {"value": round(v * factor, 1), "unit": u} for k, (v, u) in food["vitamins"].items()}
+    result["minerals"] = {k: {"value": round(v * factor, 1), "unit": u} for k, (v, u) in food["minerals"].items()}
+    result["insight"] = food["insight"]
+    result["notes"] = f"Values from the NutriTrack food database for about {round(grams)} g of {food['name']}."
+    return json.dumps(result)
@@ -0,0 +1,198 @@
+import io
+import os
+import re
+import base64
+import hashlib
+import tempfile
+from flask import Request, current_app, url_for
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+ACCEPTED_FORMATS = {"JPEG", "PNG", "WEBP", "GIF"}
+# <user id>-<content hash>-<size>.<ext>; the hash changes with the upload, so the files can be cached forever
+VARIANT_NAME = re.compile(r"^(\d+)-([0-9a-f]{16})-(\d+)\.(webp|png)$")
+
+
+class ImageError(ValueError):
+    pass
+
+
+class DiskUploadRequest(Request):
+    # Uploaded files are written to a temporary file in UPLOAD_TMP_DIR as they arrive, instead of
+    # the first 500 KB of each being held in memory; they are removed when the request ends
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.TemporaryFile(dir=current_app.config['UPLOAD_TMP_DIR'])
+
+
+def avatar_dir():
+    return current_app.config['PROFILE_PIC_DIR']
+
+
+def avatar_sizes():
+    return sorted(current_app.config['PROFILE_PIC_SIZES'])
+
+
+def _decode(source, largest, max_pixels):
+    # `source` is a file object, so uploads spooled to disk are decoded without reading them into memory
+    try:
+        image = Image.open(source)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise ImageError("That file isn't an image we can read. Upload a JPG, PNG, WebP or GIF.")
+    if image.format not in ACCEPTED_FORMATS:
+        raise ImageError("Only JPG, PNG, WebP and GIF pictures are supported.")
+    # Checked from the header, before any pixels are decoded
+    if image.width * image.height > max_pixels:
+        raise ImageError("That picture is too large. Please upload a smaller one.")
+    if image.format == "JPEG":
+        # Lets libjpeg decode at 1/2, 1/4 or 1/8 scale when that is still large enough
+        image.draft("RGB", (largest, largest))
+    try:
+        image.load()
+    except (OSError, Image.DecompressionBombError):
+        raise ImageError("That picture couldn't be decoded. Please try another one.")
+    # Phone photos are stored sideways with an EXIF rotation; apply it before the EXIF is dropped
+    image = ImageOps.exif_transpose(image)
+    return image.convert("RGBA" if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info else "RGB")
+
+
+def _encode(image, ext):
+    # A fresh image carries no EXIF, GPS, ICC or text chunks from the upload
+    out = io.BytesIO()
+    if ext == "webp":
+        image.save(out, "WEBP", quality=current_app.config['PROFILE_PIC_WEBP_QUALITY'], method=4)
+    else:
+        image.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+
+def _write(path, data):
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+def process_profile_picture(user_id, data):
+    # Validates an upload and writes square WebP and PNG variants at every PROFILE_PIC_SIZES size;
+    # returns the URL of the largest WebP, which is what User.profile_pic_url stores
+    if not data:
+        raise ImageError("Please choose a picture to upload.")
+    if len(data) > current_app.config['PROFILE_PIC_MAX_BYTES']:
+        raise ImageError("That picture is too large. Please upload a smaller one.")
+    image = _decode(io.BytesIO(data), avatar_sizes()[-1], current_app.config['PROFILE_PIC_MAX_PIXELS'])
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    sizes = avatar_sizes()
+
+    # Centre-cropped to a square like the avatar is shown, and never scaled up
+    side = min(image.width, image.height, sizes[-1])
+    square = ImageOps.fit(image, (side, side), method=Image.Resampling.LANCZOS)
+    directory = avatar_dir()
+    os.makedirs(directory, exist_ok=True)
+    for size in reversed(sizes):
+        # Each size is reduced from the one above it, which is cheaper than from the original
+        if square.width > size:
+            square = square.resize((size, size), Image.Resampling.LANCZOS)
+        for ext in ("webp", "png"):
+            _write(os.path.join(directory, f"{user_id}-{digest}-{size}.{ext}"), _encode(square, ext))
+    return url_for("auth.avatar", filename=f"{user_id}-{digest}-{sizes[-1]}.webp")
+
+
+def _variant_filename(url):
+    # The stored file name for one of our own uploads, None for anything else (e.g. a Google picture)
+    if not url:
+        return None
+    prefix = url_for("auth.avatar", filename="x")[:-1]
+    if not url.startswith(prefix):
+        return None
+    filename = url[len(prefix):]
+    return filename if VARIANT_NAME.match(filename) else None
+
+
+def avatar_urls(url, size):
+    # {"webp": ..., "png": ..., "webp_2x": ..., "png_2x": ...} for an uploaded picture shown at `size`
+    # CSS pixels, or {"src": url} for a remote one; None when the user has no picture
+    filename = _variant_filename(url)
+    if filename is None:
+        return {"src": url} if url else None
+    user_id, digest, _, _ = VARIANT_NAME.match(filename).groups()
+    sizes = avatar_sizes()
+
+    def fitting(target):
+        return next((s for s in sizes if s >= target), sizes[-1])
+
+    urls = {}
+    for key, target in (("", size), ("_2x", size * 2)):
+        for ext in ("webp", "png"):
+            urls[ext + key] = url_for("auth.avatar", filename=f"{user_id}-{digest}-{fitting(target)}.{ext}")
+    return urls
+
+
+def delete_profile_picture(url):
+    # Removes every variant of an uploaded picture; remote URLs are left alone
+    filename = _variant_filename(url)
+    if filename is None:
+        return 0
+    user_id, digest, _, _ = VARIANT_NAME.match(filename).groups()
+    removed = 0
+    for size in avatar_sizes():
+        for ext in ("webp", "png"):
+            try:
+                os.remove(os.path.join(avatar_dir(), f"{user_id}-{digest}-{size}.{ext}"))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+class MealPhoto:
+    # A meal photo ready for the model: a small re-encoded JPEG (as a data: URL) and its dHash
+    def __init__(self, data_url, phash, size, original_bytes):
+        self.data_url = data_url
+        self.phash = phash
+        self.size = size
+        self.original_bytes = original_bytes
+
+    @property
+    def payload_bytes(self):
+        return len(self.data_url)
+
+    def to_dict(self):
+        return {"data_url": self.data_url, "phash": self.phash, "size": list(self.size),
+                "original_bytes": self.original_bytes}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["data_url"], data["phash"], tuple(data["size"]), data["original_bytes"])
+
+
+def perceptual_hash(image):
+    # 64-bit difference hash: is each pixel of a 9x8 greyscale thumbnail brighter than its right
+    # neighbour. Resizing, re-compression and small edits flip only a few bits
+    small = image.convert("L").resize((9, 8), Image.Resampling.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+def hash_distance(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def prepare_meal_photo(stream):
+    # Downscales an uploaded photo to MEAL_PHOTO_MAX_SIDE and re-encodes it as a metadata-free JPEG,
+    # which bounds the bytes (and image tokens) sent to the model whatever the camera produced
+    stream.seek(0, os.SEEK_END)
+    original_bytes = stream.tell()
+    stream.seek(0)
+    if not original_bytes:
+        raise ImageError("Please choose a photo to upload.")
+    if original_bytes > current_app.config['MEAL_PHOTO_MAX_BYTES']:
+        raise ImageError("That photo is too large. Please upload a smaller one.")
+    max_side = current_app.config['MEAL_PHOTO_MAX_SIDE']
+    image = _decode(stream, max_side, current_app.config['MEAL_PHOTO_MAX_PIXELS']).convert("RGB")
+    image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=current_app.config['MEAL_PHOTO_QUALITY'], optimize=True)
+    data_url = "data:image/jpeg;base64," + base64.b64encode(out.getvalue()).decode("ascii")
+    return MealPhoto(data_url, perceptual_hash(image), image.size, original_bytes)
@@ -0,0 +1,169 @@
+import os
+import json
+import random
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import func
+
+HANDLERS = {}
+
+
+def job_handler(kind):
+    def decorator(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+@job_handler('nutrition')
+def run_nutrition_job(job, payload):
+    from . import db
+    from .models import User
+    from .utils import analyze_nutrition
+    from .records import save_history
+    from .images import MealPhoto
+
+    user = db.session.get(User, job.user_id)
+    photo = MealPhoto.from_dict(payload['photo']) if payload.get('photo') else None
+    raw_result = analyze_nutrition(photo, payload['food_name'], payload['ingredients'],
+                                   payload['preparation'], user_goal=user.goal)
+    if not raw_result:
+        raise RuntimeError("Failed to analyze nutrition. Please try again.")
+    record, _ = save_history(job.user_id, payload['food_name'], payload['ingredients'], raw_result)
+    return record.id
+
+
+@job_handler('meal_plan')
+def run_meal_plan_job(job, payload):
+    from . import db
+    from .models import User
+    from .utils import generate_meal_plan
+    from .records import save_meal_plan
+
+    user = db.session.get(User, job.user_id)
+    raw_result = generate_meal_plan(payload['requirements'], user_goal=user.goal)
+    if not raw_result:
+        raise RuntimeError("Failed to generate meal plan. Please try again.")
+    plan, _ = save_meal_plan(job.user_id, payload['requirements'], raw_result)
+    return plan.id
+
+
+class JobRunner:
+    # Jobs live in the Job table, so any process can enqueue and any process can work:
+    # web workers run JOB_WORKERS threads each, or set it to 0 and run `flask run-worker`.
+    def __init__(self):
+        self.app = None
+        self._threads = []
+        self._pid = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+
+    @property
+    def config(self):
+        return self.app.config
+
+    def enqueue(self, user_id, kind, payload):
+        from . import db
+        from .models import Job
+
+        if kind not in HANDLERS:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        job = Job(user_id=user_id, kind=kind, payload=json.dumps(payload),
+                  max_attempts=self.config['JOB_MAX_ATTEMPTS'], next_run_at=datetime.now())
+        db.session.add(job)
+        db.session.commit()
+        self.ensure_started()
+        self._wake.set()
+        return job
+
+    def ensure_started(self):
+        # Threads are started on first use rather than in create_app so forked Gunicorn
+        # workers each get their own instead of inheriting dead ones from the master
+        if self.config['JOB_WORKERS'] <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+                return
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self.run_forever, name=f"job-worker-{i}", daemon=True)
+                for i in range(self.config['JOB_WORKERS'])
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def run_forever(self, stop=None):
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                with self.app.app_context():
+                    job = self.claim_next()
+                    if job:
+                        self.run(job)
+                        continue
+            except Exception as e:
+                print(f"⚠️ Job worker error: {e}")
+            self._wake.wait(self.config['JOB_POLL_INTERVAL'])
+            self._wake.clear()
+
+    def _requeue_stale(self, now):
+        from . import db
+        from .models import Job
+
+        # Jobs left 'running' by a worker that died are picked up again
+        stale_before = now - timedelta(seconds=self.config['JOB_STALE_AFTER'])
+        Job.query.filter(Job.status == 'running', Job.updated_at < stale_before).update(
+            {'status': 'queued', 'next_run_at': now}, synchronize_session=False)
+        db.session.commit()
+
+    def claim_next(self):
+        from . import db
+        from .models import Job
+
+        now = datetime.now()
+        self._requeue_stale(now)
+
+        running = dict(
+            db.session.query(Job.user_id, func.count(Job.id))
+            .filter(Job.status == 'running').group_by(Job.user_id).all()
+        )
+        candidates = (Job.query.filter(Job.status == 'queued', Job.next_run_at <= now)
+                      .order_by(Job.next_run_at, Job.id).limit(20).all())
+        for job in candidates:
+            if running.get(job.user_id, 0) >= self.config['JOB_USER_CONCURRENCY']:
+                continue
+            # Only one worker wins the status flip, even across processes
+            claimed = Job.query.filter_by(id=job.id, status='queued').update(
+                {'status': 'running', 'attempts': Job.attempts + 1, 'updated_at': now},
+                synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                return db.session.get(Job, job.id)
+        return None
+
+    def run(self, job):
+        from . import db
+        from .models import Job
+
+        job_id = job.id
+        try:
+            result_id = HANDLERS[job.kind](job, json.loads(job.payload))
+            job = db.session.get(Job, job_id)
+            job.result_id = result_id
+            job.status = 'succeeded'
+            job.error = None
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            job.error = str(e)
+            if job.attempts < job.max_attempts:
+                backoff = self.config['JOB_RETRY_BACKOFF'] * 2 ** (job.attempts - 1)
+                job.status = 'queued'
+                job.next_run_at = datetime.now() + timedelta(seconds=backoff + random.uniform(0, backoff / 2))
+            else:
+                job.status = 'failed'
+            print(f"⚠️ Job {job_id} ({job.kind}) attempt {job.attempts} failed: {e}")
+        db.session.commit()
@@ -0,0 +1,326 @@
+import io
+import os
+import sys
+import json
+import glob
+import time
+import random
+import pstats
+import logging
+import cProfile
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from flask import g, request, has_request_context, abort, Response
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Prometheus' default buckets, extended to cover slow model calls
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# timer -> (metric name, help text, label names besides "route")
+TIMERS = {
+    "request": ("nutritrack_request_duration_seconds",
+                "Time to produce a response (up to the first byte for streamed responses).", ("method", "status")),
+    "db": ("nutritrack_db_query_duration_seconds", "Time spent executing one SQL statement.", ()),
+    "template": ("nutritrack_template_render_duration_seconds", "Time to render one page template.", ("template",)),
+    "json": ("nutritrack_json_parse_duration_seconds",
+             "Time to parse, repair and validate one model or stored JSON response.", ("kind",)),
+    "openai": ("nutritrack_openai_call_duration_seconds",
+               "Time a caller waited for one model call, queueing and retries included.", ("template", "outcome")),
+}
+
+log = logging.getLogger("nutritrack.requests")
+
+
+def route_tag(rule):
+    # "/plan-meal/stream" -> "plan-meal", "/history/page" -> "history", "/api/trends" -> "trends"
+    if rule is None:
+        return "unmatched"
+    parts = [p for p in rule.rule.split("/") if p and not p.startswith("<")]
+    if parts and parts[0] == "api":
+        parts = parts[1:]
+    return parts[0] if parts else "index"
+
+
+def current_route():
+    # Jobs and other work outside a request are all tagged "background"
+    if not has_request_context():
+        return "background"
+    route = g.get("metrics_route")
+    if route is None:
+        route = g.metrics_route = route_tag(request.url_rule)
+    return route
+
+
+def _label_text(labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}" if labels else ""
+
+
+class Metrics:
+    # Per-process histograms for the hot paths, tagged by route. /metrics renders them in
+    # the Prometheus text format together with the parse, cache, token and breaker counters.
+    # With METRICS_DIR set every worker also dumps its samples there and /metrics sums all
+    # of them, so one scrape covers every Gunicorn worker.
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.token = None
+        self.directory = None
+        self.flush_interval = 5.0
+        self.log_requests = False
+        self.profiling = False
+        self.profile_dir = None
+        self._series = {}
+        self._lock = threading.Lock()
+        self._profile_lock = threading.Lock()
+        self._flushed_at = 0.0
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        if not self.enabled:
+            return
+        self.sample_rate = float(app.config.get('METRICS_SAMPLE_RATE', 1.0))
+        self.token = app.config.get('METRICS_TOKEN') or None
+        self.directory = app.config.get('METRICS_DIR') or None
+        self.flush_interval = float(app.config.get('METRICS_FLUSH_INTERVAL', 5))
+        self.log_requests = app.config.get('METRICS_LOG', False)
+        self.profiling = app.config.get('METRICS_PROFILING', False)
+        self.profile_dir = app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, "profiles")
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        if self.log_requests and not log.handlers:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            log.addHandler(handler)
+            log.setLevel(logging.INFO)
+            log.propagate = False
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule("/metrics", "metrics", self.view)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+        if not event.contains(Engine, "before_cursor_execute", _query_started):
+            event.listen(Engine, "before_cursor_execute", _query_started)
+            event.listen(Engine, "after_cursor_execute", _query_finished)
+
+    # --- Recording -------------------------------------------------------------------
+
+    def sampled(self):
+        if not self.enabled:
+            return False
+        return g.get("metrics_sampled", True) if has_request_context() else True
+
+    def observe(self, metric, seconds, **labels):
+        if not self.sampled():
+            return
+        _, _, label_names = TIMERS[metric]
+        key = (metric, current_route()) + tuple(str(labels.get(label, "")) for label in label_names)
+        index = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(BUCKETS) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+        if has_request_context() and metric != "request":
+            totals = g.setdefault("metrics_totals", defaultdict(float))
+            totals[f"{metric}_ms"] += seconds * 1000
+            totals[f"{metric}_count"] += 1
+
+    def timer(self, metric, **labels):
+        return _Timer(self, metric, labels)
+
+    # --- Request hooks ---------------------------------------------------------------
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+        if self.profiling and request.args.get("_profile") and self._profile_lock.acquire(blocking=False):
+            # One profiled request at a time; cProfile only sees this request's own thread
+            g.metrics_profiler = cProfile.Profile()
+            g.metrics_profiler.enable()
+
+    def _after_request(self, response):
+        profiler = g.pop("metrics_profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            self._profile_lock.release()
+            response.headers["X-Profile-File"] = self._save_profile(profiler)
+
+        if g.get("metrics_sampled") and request.endpoint != "metrics":
+            seconds = time.perf_counter() - g.metrics_start
+            self.observe("request", seconds, method=request.method, status=response.status_code)
+            if self.log_requests:
+                self._log_request(response, seconds)
+        if self.directory and time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+        return response
+
+    def _log_request(self, response, seconds):
+        user = g.get("_login_user")
+        entry = {
+            "ts": round(time.time(), 3), "pid": os.getpid(), "route": current_route(),
+            "endpoint": request.endpoint, "method": request.method, "path": request.path,
+            "status": response.status_code, "duration_ms": round(seconds * 1000, 1),
+            "user_id": getattr(user, "id", None),
+        }
+        for key, value in g.get("metrics_totals", {}).items():
+            entry[key] = round(value, 1) if key.endswith("_ms") else int(value)
+        log.info(json.dumps(entry))
+
+    def _save_profile(self, profiler):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"{current_route()}-{int(time.time() * 1000)}-{os.getpid()}.prof")
+        profiler.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(25)
+        print(f"--- Profile of {request.method} {request.full_path} saved to {path} ---")
+        print(summary.getvalue())
+        return path
+
+    def _template_started(self, sender, template, context, **extra):
+        g.setdefault("metrics_templates", []).append(time.perf_counter())
+
+    def _template_finished(self, sender, template, context, **extra):
+        starts = g.get("metrics_templates")
+        if starts:
+            self.observe("template", time.perf_counter() - starts.pop(), template=template.name)
+
+    # --- Exposition ------------------------------------------------------------------
+
+    def snapshot(self):
+        # {metric: {"type", "help", "samples": [[sample name, [[label, value], ...], value], ...]}}
+        families = {}
+        with self._lock:
+            series = list(self._series.items())
+        for key, (buckets, total) in series:
+            metric, route, values = key[0], key[1], key[2:]
+            name, help_text, label_names = TIMERS[metric]
+            family = families.setdefault(name, {"type": "histogram", "help": help_text, "samples": []})
+            labels = [["route", route]] + [list(pair) for pair in zip(label_names, values)]
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), buckets):
+                cumulative += count
+                family["samples"].append([f"{name}_bucket", labels + [["le", str(bound)]], cumulative])
+            family["samples"].append([f"{name}_sum", labels, total])
+            family["samples"].append([f"{name}_count", labels, cumulative])
+
+        for name, kind, help_text, samples in _collect_stats():
+            families[name] = {"type": kind, "help": help_text,
+                              "samples": [[name, [list(pair) for pair in labels], value] for labels, value in samples]}
+        return families
+
+    def flush(self):
+        self._flushed_at = time.monotonic()
+        path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    def collect(self):
+        # This process alone, or every worker's last dump summed sample by sample
+        if not self.directory:
+            return self.snapshot()
+        self.flush()
+        merged = {}
+        for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+            try:
+                with open(path) as f:
+                    families = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, family in families.items():
+                target = merged.setdefault(name, {"type": family["type"], "help": family["help"], "samples": {}})
+                for sample, labels, value in family["samples"]:
+                    key = (sample, tuple(tuple(pair) for pair in labels))
+                    target["samples"][key] = target["samples"].get(key, 0) + value
+        return {name: dict(family, samples=[[s, labels, v] for (s, labels), v in family["samples"].items()])
+                for name, family in merged.items()}
+
+    def render(self):
+        lines = []
+        for name, family in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['type']}")
+            for sample, labels, value in family["samples"]:
+                lines.append(f"{sample}{_label_text(labels)} {value!r}")
+        return "\n".join(lines) + "\n"
+
+    def view(self):
+        if self.token and request.headers.get("Authorization") != f"Bearer {self.token}":
+            abort(401)
+        return Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+
+class _Timer:
+    __slots__ = ("metrics", "metric", "labels", "start")
+
+    def __init__(self, metrics, metric, labels):
+        self.metrics = metrics
+        self.metric = metric
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.metric, time.perf_counter() - self.start, **self.labels)
+
+
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("metrics_query_start")
+    if starts:
+        metrics.observe("db", time.perf_counter() - starts.pop())
+
+
+def _collect_stats():
+    # The counters other modules already keep, as (name, type, help, [(labels, value), ...])
+    from . import ai_client, insight_cache, analysis_cache, trends_cache, photo_cache, mail_outbox
+    from .parsing import parse_stats
+    from .prompts import token_usage
+
+    parsed = parse_stats.snapshot()
+    yield ("nutritrack_model_responses_total", "counter", "Model responses by how they were parsed.",
+           [((("kind", kind), ("outcome", outcome)), counts[outcome])
+            for kind, counts in parsed.items() for outcome in parse_stats.OUTCOMES])
+
+    caches = {"insight": insight_cache, "analysis": analysis_cache, "trends": trends_cache, "photo": photo_cache}
+    yield ("nutritrack_cache_hits_total", "counter", "Cache lookups answered from the cache.",
+           [((("cache", name),), cache.hits) for name, cache in caches.items()])
+    yield ("nutritrack_cache_misses_total", "counter", "Cache lookups that missed.",
+           [((("cache", name),), cache.misses) for name, cache in caches.items()])
+
+    usage = token_usage.snapshot()
+    yield ("nutritrack_ai_tokens_total", "counter", "Model tokens by prompt template (API usage, else estimated).",
+           [((("template", name), ("direction", direction)), row[f"{direction}_tokens"])
+            for name, row in usage.items() for direction in ("prompt", "completion")])
+    yield ("nutritrack_ai_truncated_total", "counter", "Completions cut off by their max_tokens budget.",
+           [((("template", name),), row["truncated"]) for name, row in usage.items()])
+
+    status = ai_client.status()
+    yield ("nutritrack_ai_breaker_open", "gauge", "Workers whose OpenAI circuit breaker is open or half-open.",
+           [((), int(status["breaker"] != "closed"))])
+    yield ("nutritrack_ai_consecutive_failures", "gauge", "Consecutive failed model calls.",
+           [((), status["consecutive_failures"])])
+    yield ("nutritrack_ai_in_flight", "gauge", "Distinct model calls currently in flight.",
+           [((), status["in_flight"])])
+
+    mail = mail_outbox.status()
+    yield ("nutritrack_mail_attempts_total", "counter", "Outbox delivery attempts by outcome.",
+           [((("outcome", outcome),), mail[outcome]) for outcome in ("sent", "retried", "failed")])
+    yield ("nutritrack_mail_smtp_connections_total", "counter", "SMTP connections opened by the outbox sender.",
+           [((), mail["connections"])])
+
+
+metrics = Metrics()
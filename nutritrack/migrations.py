@@ -0,0 +1,200 @@
+from datetime import datetime
+from sqlalchemy import text, inspect, select, update
+from . import db
+
+# Ordered schema migrations, applied by `flask db-upgrade`. Each one must be safe to run
+# against a database that db.create_all() already brought up to date, because older
+# installs were set up that way and never recorded a version.
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+def _ensure_version_table():
+    db.session.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, description VARCHAR(200), applied_at TIMESTAMP)"
+    ))
+    db.session.commit()
+
+
+def current_version():
+    _ensure_version_table()
+    return db.session.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+
+def pending_migrations():
+    version = current_version()
+    return [m for m in MIGRATIONS if m[0] > version]
+
+
+def upgrade():
+    applied = []
+    for version, description, fn in pending_migrations():
+        print(f"--- Applying migration {version}: {description} ---")
+        fn()
+        db.session.execute(
+            text("INSERT INTO schema_version (version, description, applied_at) VALUES (:v, :d, :t)"),
+            {"v": version, "d": description, "t": datetime.now()},
+        )
+        db.session.commit()
+        applied.append(version)
+    return applied
+
+
+def _has_column(table, column):
+    return column in {c['name'] for c in inspect(db.engine).get_columns(table)}
+
+
+def _add_missing_columns(model):
+    table = model.__table__
+    for column in table.columns:
+        if not _has_column(table.name, column.name):
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+    db.session.commit()
+
+
+def _create_index(model, name):
+    index = next(i for i in model.__table__.indexes if i.name == name)
+    index.create(bind=db.engine, checkfirst=True)
+
+
+@migration(1, "Create missing tables")
+def create_missing_tables():
+    db.create_all()
+
+
+@migration(2, "Backfill daily nutrition totals")
+def backfill_daily_totals():
+    from .models import DailyNutritionTotals
+    from .rollups import rebuild_daily_totals
+
+    # Rollups are built from the typed macro columns, which migration 4 adds and rebuilds from
+    if not _has_column('history', 'calories'):
+        return
+    if not DailyNutritionTotals.query.first():
+        # user.rollup_version may not exist yet; migration 8 resets every user's
+        rebuild_daily_totals(bump_versions=False)
+
+
+@migration(3, "Add (user_id, timestamp) indexes to history and meal_plan")
+def add_user_timestamp_indexes():
+    from .models import History, MealPlan, Job
+
+    _create_index(History, 'ix_history_user_timestamp')
+    _create_index(MealPlan, 'ix_meal_plan_user_timestamp')
+    _create_index(Job, 'ix_job_status_next_run')
+
+
+@migration(4, "Add typed nutrition columns and JSON results to history and meal_plan")
+def add_nutrition_columns(batch_size=500):
+    from .models import History, MealPlan
+    from .parsing import parse_response
+    from .records import nutrition_columns
+    from .rollups import rebuild_daily_totals
+
+    _add_missing_columns(History)
+    _add_missing_columns(MealPlan)
+
+    # Stored output is normalized with the same parser new rows go through (ParseError is a
+    # ValueError). Rows that fail to parse keep NULL columns and are skipped by the rollups, as before
+    last_id = 0
+    while True:
+        rows = (History.query.filter(History.id > last_id, History.nutrition_data.is_(None))
+                .order_by(History.id).limit(batch_size).all())
+        if not rows:
+            break
+        for record in rows:
+            last_id = record.id
+            try:
+                parsed = parse_response('nutrition', record.nutrition_result)
+            except (TypeError, ValueError):
+                continue
+            record.nutrition_data = parsed
+            for key, value in nutrition_columns(parsed).items():
+                setattr(record, key, value)
+        db.session.commit()
+
+    last_id = 0
+    while True:
+        rows = (MealPlan.query.filter(MealPlan.id > last_id, MealPlan.meal_plan_data.is_(None))
+                .order_by(MealPlan.id).limit(batch_size).all())
+        if not rows:
+            break
+        for plan in rows:
+            last_id = plan.id
+            try:
+                plan.meal_plan_data = parse_response('meal_plan', plan.meal_plan_result)
+            except (TypeError, ValueError):
+                continue
+        db.session.commit()
+
+    rebuild_daily_totals(bump_versions=False)
+
+
+@migration(5, "Create the outbound email outbox")
+def create_outbox_table():
+    from .models import OutboxEmail
+
+    OutboxEmail.__table__.create(bind=db.engine, checkfirst=True)
+    _create_index(OutboxEmail, 'ix_outbox_email_status_next_attempt')
+
+
+@migration(6, "Convert uploaded profile pictures to resized, content-hashed variants")
+def convert_profile_pictures():
+    import os
+    import re
+    from flask import current_app
+    from .models import User
+    from .images import ImageError, process_profile_picture
+
+    # Before this, uploads were saved as static/uploads/<id>_profile.png and found with os.path.exists
+    uploads = os.path.join(current_app.root_path, 'static', 'uploads')
+    if not os.path.isdir(uploads):
+        return
+    # Only user.id and user.profile_pic_url are touched, through the table: the ORM would also
+    # select columns that later migrations add (user.rollup_version, migration 8)
+    users = User.__table__
+    with current_app.test_request_context():
+        for name in os.listdir(uploads):
+            match = re.match(r"^(\d+)_profile\.png$", name)
+            user_id = match and db.session.execute(
+                select(users.c.id).where(users.c.id == int(match.group(1)))).scalar()
+            if not user_id:
+                continue
+            path = os.path.join(uploads, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            try:
+                url = process_profile_picture(user_id, data)
+            except ImageError as e:
+                print(f"⚠️ Skipping {name}: {e}")
+                continue
+            db.session.execute(update(users).where(users.c.id == user_id).values(profile_pic_url=url))
+            db.session.commit()
+            os.remove(path)
+
+
+@migration(7, "Create the meal photo analysis cache")
+def create_photo_analysis_table():
+    from .models import PhotoAnalysis
+
+    PhotoAnalysis.__table__.create(bind=db.engine, checkfirst=True)
+    _create_index(PhotoAnalysis, 'ix_photo_analysis_context_created')
+
+
+@migration(8, "Add a rollup version to users for the trends cache")
+def add_user_rollup_version():
+    from .models import User, new_rollup_version
+
+    _add_missing_columns(User)
+    # Also drops whatever any worker cached under the old keys
+    User.query.update({User.rollup_version: new_rollup_version()}, synchronize_session=False)
+    db.session.commit()
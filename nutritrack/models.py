@@ -1,7 +1,16 @@
+import secrets
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy.dialects.postgresql import JSONB
 from . import db
 
+# JSONB on PostgreSQL, JSON (text with json functions) on SQLite
+JSONType = db.JSON().with_variant(JSONB(), 'postgresql')
+
+
+def new_rollup_version():
+    return secrets.token_hex(8)
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(100), nullable=False)
@@ -18,10 +27,16 @@ class User(UserMixin, db.Model):
     last_health_update = db.Column(db.DateTime, nullable=True)
     recommended_calories = db.Column(db.Integer, nullable=True)
     goal = db.Column(db.String(50), nullable=True, default='Maintain Weight')
+    # Changes whenever a past month's daily totals do; cached trend months are keyed by it,
+    # so every worker stops serving them at once. Random rather than a counter, so a new
+    # account that reuses a deleted one's id never matches its cache entries
+    rollup_version = db.Column(db.String(16), nullable=True, default=new_rollup_version)
 
-    # Relationship to history table
-    history = db.relationship('History', backref='user', lazy=True)
-    meal_plans = db.relationship('MealPlan', backref='user', lazy=True)
+    # Thousands of rows per user: "dynamic" makes user.history a query to filter and page
+    # rather than a list that loads everything, and passive_deletes stops deleting a user
+    # from loading the rows first (delete_account removes them in bulk)
+    history = db.relationship('History', backref='user', lazy='dynamic', passive_deletes=True)
+    meal_plans = db.relationship('MealPlan', backref='user', lazy='dynamic', passive_deletes=True)
 
 
 class History(db.Model):
@@ -31,11 +46,97 @@ class History(db.Model):
     nutrition_result = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, default=datetime.now)
 
+    # Parsed once at insert time from nutrition_result (the raw model output)
+    nutrition_data = db.Column(JSONType, nullable=True)
+    calories = db.Column(db.Float, nullable=True)
+    protein = db.Column(db.Float, nullable=True)
+    carbohydrates = db.Column(db.Float, nullable=True)
+    fats = db.Column(db.Float, nullable=True)
+    sugars = db.Column(db.Float, nullable=True)
+    fibre = db.Column(db.Float, nullable=True)
+
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
+    __table_args__ = (db.Index('ix_history_user_timestamp', 'user_id', 'timestamp'),)
+
 class MealPlan(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     requirements = db.Column(db.Text, nullable=False)
     meal_plan_result = db.Column(db.Text, nullable=False)
+    meal_plan_data = db.Column(JSONType, nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.now)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    __table_args__ = (db.Index('ix_meal_plan_user_timestamp', 'user_id', 'timestamp'),)
+
+
+class DailyNutritionTotals(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+
+    food_count = db.Column(db.Integer, nullable=False, default=0)
+    calories = db.Column(db.Float, nullable=False, default=0)
+    protein = db.Column(db.Float, nullable=False, default=0)
+    carbohydrates = db.Column(db.Float, nullable=False, default=0)
+    fats = db.Column(db.Float, nullable=False, default=0)
+    sugars = db.Column(db.Float, nullable=False, default=0)
+    fibre = db.Column(db.Float, nullable=False, default=0)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'day', name='uq_daily_totals_user_day'),)
+
+
+class CacheEntry(db.Model):
+    key = db.Column(db.String(200), primary_key=True)
+    value = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    last_used = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    next_run_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    result_id = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    __table_args__ = (db.Index('ix_job_status_next_run', 'status', 'next_run_at'),)
+
+
+class OutboxEmail(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    sender = db.Column(db.String(255), nullable=True)
+    recipients = db.Column(db.Text, nullable=False)
+    # Cleared once the message is sent or given up on: reset emails carry live tokens
+    body = db.Column(db.Text, nullable=True)
+    html = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (db.Index('ix_outbox_email_status_next_attempt', 'status', 'next_attempt_at'),)
+
+
+class PhotoAnalysis(db.Model):
+    # Nutrition answers for meal photos, found again by perceptual hash (cache.PhotoCache)
+    id = db.Column(db.Integer, primary_key=True)
+    context_key = db.Column(db.String(64), nullable=False)
+    phash = db.Column(db.String(16), nullable=False)
+    result = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    __table_args__ = (db.Index('ix_photo_analysis_context_created', 'context_key', 'created_at'),)
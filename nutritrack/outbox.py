@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import random
+import smtplib
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import func
+
+
+class MailOutbox:
+    # Outgoing mail is written to the OutboxEmail table and a sender thread in each web process
+    # that has queued mail (or `flask send-mail`) delivers it, so a request never waits on SMTP. The sender keeps one
+    # SMTP connection open across batches and closes it after MAIL_CONNECTION_IDLE quiet seconds.
+    def __init__(self):
+        self.app = None
+        self._thread = None
+        self._pid = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._last_used = 0.0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.connections = 0
+
+    def init_app(self, app):
+        self.app = app
+
+    @property
+    def config(self):
+        return self.app.config
+
+    def ensure_mail(self):
+        # Flask-Mail is set up on the first email rather than at startup, to keep it off the cold-start
+        # path. Call it before building a flask_mail.Message, which reads the default sender from it
+        if 'mail' not in self.app.extensions:
+            from flask_mail import Mail
+            with self._lock:
+                if 'mail' not in self.app.extensions:
+                    Mail(self.app)
+        return self.app.extensions['mail']
+
+    def enqueue(self, message):
+        from . import db
+        from .models import OutboxEmail
+
+        if not self.config['MAIL_OUTBOX']:
+            self.ensure_mail().send(message)
+            return None
+        email = OutboxEmail(subject=message.subject, sender=_address(message.sender),
+                            recipients=json.dumps([_address(r) for r in message.recipients]),
+                            body=message.body, html=message.html,
+                            max_attempts=self.config['MAIL_MAX_ATTEMPTS'], next_attempt_at=datetime.now())
+        db.session.add(email)
+        db.session.commit()
+        self.ensure_started()
+        self._wake.set()
+        return email
+
+    def cancel_queued(self, recipient):
+        # Drops mail still waiting to go out to just this address (e.g. a deleted account's reset
+        # link), in the caller's transaction. Mail a sender has already claimed is left to finish
+        from .models import OutboxEmail
+
+        return OutboxEmail.query.filter(
+            OutboxEmail.status == 'queued', OutboxEmail.recipients == json.dumps([_address(recipient)]),
+        ).delete(synchronize_session=False)
+
+    def ensure_started(self):
+        # Started per process by the first enqueue, like the job workers, so forked Gunicorn workers
+        # don't inherit a dead thread and a process that never sends mail never polls the outbox.
+        # Mail left queued by a restart goes out with the next enqueue, or with `flask send-mail`
+        if not self.config['MAIL_OUTBOX'] or not self.config['MAIL_SENDER_THREAD']:
+            return
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._connection = None
+            self._thread = threading.Thread(target=self.run_forever, name="mail-sender", daemon=True)
+            self._thread.start()
+
+    def run_forever(self, stop=None):
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            wait = self.config['MAIL_POLL_INTERVAL']
+            try:
+                with self.app.app_context():
+                    self.drain(close=False)
+                    wait = self._seconds_until_due(wait)
+            except Exception as e:
+                print(f"⚠️ Mail sender error: {e}")
+            if self._connection and time.monotonic() - self._last_used >= self.config['MAIL_CONNECTION_IDLE']:
+                self._disconnect()
+            self._wake.wait(min(wait, self.config['MAIL_CONNECTION_IDLE']) if self._connection else wait)
+            self._wake.clear()
+
+    def drain(self, close=True):
+        # Sends everything that is due, a batch at a time over one connection; returns the number handled
+        handled = 0
+        try:
+            while True:
+                batch = self.claim_batch()
+                if not batch:
+                    return handled
+                self.send_batch(batch)
+                handled += len(batch)
+        finally:
+            if close:
+                self._disconnect()
+
+    def _requeue_stale(self, now):
+        from . import db
+        from .models import OutboxEmail
+
+        # Mail left 'sending' by a process that died is tried again (it may have gone out already)
+        stale_before = now - timedelta(seconds=self.config['MAIL_STALE_AFTER'])
+        OutboxEmail.query.filter(OutboxEmail.status == 'sending', OutboxEmail.updated_at < stale_before).update(
+            {'status': 'queued', 'next_attempt_at': now}, synchronize_session=False)
+        db.session.commit()
+
+    def claim_batch(self):
+        from . import db
+        from .models import OutboxEmail
+
+        now = datetime.now()
+        self._requeue_stale(now)
+        candidates = (db.session.query(OutboxEmail.id)
+                      .filter(OutboxEmail.status == 'queued', OutboxEmail.next_attempt_at <= now)
+                      .order_by(OutboxEmail.next_attempt_at, OutboxEmail.id)
+                      .limit(self.config['MAIL_BATCH_SIZE']).all())
+        claimed = []
+        for (email_id,) in candidates:
+            # Only one sender wins the status flip, even across processes
+            if OutboxEmail.query.filter_by(id=email_id, status='queued').update(
+                    {'status': 'sending', 'attempts': OutboxEmail.attempts + 1, 'updated_at': now},
+                    synchronize_session=False):
+                claimed.append(email_id)
+        db.session.commit()
+        if not claimed:
+            return []
+        return OutboxEmail.query.filter(OutboxEmail.id.in_(claimed)).order_by(OutboxEmail.id).all()
+
+    def send_batch(self, batch):
+        from flask_mail import Message
+        from . import db
+
+        self.ensure_mail()
+        for email in batch:
+            try:
+                self._deliver(Message(subject=email.subject, sender=email.sender,
+                                      recipients=json.loads(email.recipients), body=email.body, html=email.html))
+            except Exception as e:
+                self._record_failure(email, e)
+            else:
+                email.status = 'sent'
+                email.sent_at = datetime.now()
+                email.body = email.html = email.last_error = None
+                self.sent += 1
+            # Committed one by one so a crash mid-batch doesn't resend what already went out
+            db.session.commit()
+
+    def _record_failure(self, email, error):
+        email.last_error = f"{type(error).__name__}: {error}"
+        if email.attempts < email.max_attempts and not _permanent(error):
+            backoff = self.config['MAIL_RETRY_BACKOFF'] * 2 ** (email.attempts - 1)
+            email.status = 'queued'
+            email.next_attempt_at = datetime.now() + timedelta(seconds=backoff + random.uniform(0, backoff / 2))
+            self.retried += 1
+        else:
+            email.status = 'failed'
+            email.body = email.html = None
+            self.failed += 1
+        print(f"⚠️ Email {email.id} attempt {email.attempts} failed: {email.last_error}")
+
+    def _seconds_until_due(self, default):
+        from . import db
+        from .models import OutboxEmail
+
+        due = db.session.query(func.min(OutboxEmail.next_attempt_at)).filter(OutboxEmail.status == 'queued').scalar()
+        if due is None:
+            return default
+        return min(default, max(0.0, (due - datetime.now()).total_seconds()))
+
+    def _deliver(self, message):
+        from flask_mail import BadHeaderError
+
+        try:
+            self._connect().send(message)
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped the idle connection: retry once on a fresh one before
+            # counting it as a failed attempt
+            self._disconnect()
+            self._connect().send(message)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError, BadHeaderError):
+            # smtplib has already reset the transaction; the connection is still good
+            raise
+        except Exception:
+            self._disconnect()
+            raise
+        finally:
+            self._last_used = time.monotonic()
+
+    def _connect(self):
+        if self._connection is None:
+            from flask_mail import Connection
+
+            connection = Connection(self.ensure_mail())
+            state = connection.mail
+            if not state.suppress:
+                # What Flask-Mail's configure_host does, plus a timeout so a stalled server can't hang the sender
+                smtp = smtplib.SMTP_SSL if state.use_ssl else smtplib.SMTP
+                host = smtp(state.server, state.port, timeout=self.config['MAIL_TIMEOUT'])
+                if state.use_tls:
+                    host.starttls()
+                if state.username and state.password:
+                    host.login(state.username, state.password)
+                connection.host = host
+                self.connections += 1
+            self._connection = connection
+        return self._connection
+
+    def _disconnect(self):
+        connection, self._connection = self._connection, None
+        if connection and connection.host:
+            try:
+                connection.host.quit()
+            except (smtplib.SMTPException, OSError):
+                connection.host.close()
+
+    def status(self):
+        return {"sent": self.sent, "retried": self.retried, "failed": self.failed, "connections": self.connections}
+
+
+def _address(address):
+    # Flask-Mail accepts (name, address) pairs as well as strings
+    return address if isinstance(address, str) or address is None else f"{address[0]} <{address[1]}>"
+
+
+def _permanent(error):
+    # 5xx answers and malformed messages won't succeed on a retry; bad credentials might once fixed
+    from flask_mail import BadHeaderError
+
+    if isinstance(error, (BadHeaderError, AssertionError)):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException) and not isinstance(error, smtplib.SMTPAuthenticationError):
+        return error.smtp_code >= 500
+    return False
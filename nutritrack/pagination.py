@@ -0,0 +1,30 @@
+from datetime import datetime
+from sqlalchemy import or_, and_
+
+
+def encode_cursor(item):
+    return f"{item.timestamp.isoformat()}_{item.id}"
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, item_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(timestamp), int(item_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def keyset_page(query, model, cursor=None, page_size=20):
+    # Newest first, (timestamp, id) as the key so rows sharing a timestamp are never skipped.
+    # Returns the page and the cursor for the next one (None on the last page).
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        timestamp, item_id = position
+        query = query.filter(or_(
+            model.timestamp < timestamp,
+            and_(model.timestamp == timestamp, model.id < item_id),
+        ))
+
+    items = query.order_by(model.timestamp.desc(), model.id.desc()).limit(page_size + 1).all()
+    next_cursor = encode_cursor(items[page_size - 1]) if len(items) > page_size else None
+    return items[:page_size], next_cursor
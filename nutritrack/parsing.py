@@ -0,0 +1,353 @@
+import re
+import json
+import threading
+from collections import Counter, defaultdict
+from .metrics import metrics
+
+
+class ParseError(ValueError):
+    pass
+
+
+def to_number(value):
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    # Tolerate "12 g" / "12.5g" / "~300" style values from the model
+    match = re.search(r"-?\d+(?:\.\d+)?", str(value or "").replace(",", ""))
+    return float(match.group()) if match else 0.0
+
+
+def _clean_number(value):
+    number = to_number(value)
+    return int(number) if number.is_integer() else round(number, 1)
+
+
+# --- Turning a completion into JSON ---------------------------------------------------
+
+FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+LITERALS = {"True": "true", "False": "false", "None": "null", "NaN": "null"}
+CLOSERS = {"{": "}", "[": "]"}
+
+
+def strip_code_fences(text):
+    match = FENCE_RE.search(text)
+    return match.group(1).strip() if match else text.strip()
+
+
+def repair_json(text):
+    # One pass over the text that fixes what completions typically get wrong: prose
+    # around the JSON, single-quoted strings, Python literals, trailing commas, and
+    # output cut off by max_tokens (closed by appending the missing brackets).
+    start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=-1)
+    if start < 0:
+        raise ParseError("No JSON object or array in the response.")
+    text = text[start:].translate(SMART_QUOTES)
+
+    out = []
+    stack = []
+    quote = None
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            if ch == "\\" and i + 1 < len(text):
+                out.append("'" if text[i + 1] == "'" else text[i:i + 2])
+                i += 2
+                continue
+            if ch == quote:
+                out.append('"')
+                quote = None
+            elif ch == '"':
+                out.append('\\"')
+            elif ch == "\n":
+                out.append("\\n")
+            else:
+                out.append(ch)
+        elif ch in "\"'":
+            quote = ch
+            out.append('"')
+        elif ch in CLOSERS:
+            stack.append(CLOSERS[ch])
+            out.append(ch)
+        elif ch in "}]":
+            while out and out[-1] in (",", " ", "\n", "\t", "\r"):
+                out.pop()
+            if stack:
+                stack.pop()
+            out.append(ch)
+            if not stack:
+                break
+        elif ch.isalpha() or ch == "_":
+            word = re.match(r"\w+", text[i:]).group()
+            if re.match(r"\s*:", text[i + len(word):]):
+                out.append(f'"{word}"')
+            else:
+                out.append(LITERALS.get(word, word))
+            i += len(word)
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    if quote:
+        out.append('"')
+    if stack:
+        repaired = "".join(out).rstrip().rstrip(",")
+        if repaired.endswith(":"):
+            repaired += " null"
+        return repaired + "".join(reversed(stack))
+    return "".join(out)
+
+
+def loads_lenient(text):
+    # Returns (value, repaired)
+    if not isinstance(text, str) or not text.strip():
+        raise ParseError("Empty response.")
+    try:
+        return json.loads(text), False
+    except ValueError:
+        pass
+    body = strip_code_fences(text)
+    try:
+        return json.loads(body), True
+    except ValueError:
+        pass
+    try:
+        return json.loads(repair_json(body), strict=False), True
+    except ValueError as e:
+        raise ParseError(f"Invalid JSON: {e}") from None
+
+
+# --- Per-endpoint schemas ---------------------------------------------------------------
+
+MACRO_UNITS = {
+    "calories": "kcal", "protein": "g", "carbohydrates": "g",
+    "fats": "g", "sugars": "g", "fibre": "g",
+}
+MACRO_ALIASES = {
+    "calorie": "calories", "kcal": "calories", "energy": "calories",
+    "carbs": "carbohydrates", "carbohydrate": "carbohydrates", "fat": "fats",
+    "sugar": "sugars", "fiber": "fibre", "fibres": "fibre", "fibers": "fibre",
+    "total_fat": "fats", "total_carbohydrates": "carbohydrates", "dietary_fiber": "fibre",
+}
+
+
+def _single_object(data):
+    if isinstance(data, list) and len(data) == 1:
+        data = data[0]
+    if not isinstance(data, dict):
+        raise ParseError("Expected a JSON object.")
+    return data
+
+
+def _canonical_keys(data, aliases, known):
+    # "Carbs" / "fiber" / "Total Fat" style keys are renamed; unknown keys are kept as they are
+    result = {}
+    for key, value in data.items():
+        name = str(key).strip().lower().replace(" ", "_")
+        name = aliases.get(name, name)
+        result[name if name in known else key] = value
+    return result
+
+
+def _amount(value, default_unit):
+    if isinstance(value, dict):
+        return {"value": _clean_number(value.get("value", value.get("amount"))),
+                "unit": value.get("unit") or default_unit}
+    unit = re.sub(r"[-\d.,~\s]", "", value) if isinstance(value, str) else ""
+    return {"value": _clean_number(value), "unit": unit or default_unit}
+
+
+def _named_amounts(value):
+    # {"Vitamin A": {...}} stays; [{"name", "value", "unit"}] lists and bare numbers are converted
+    if isinstance(value, list):
+        value = {str(item["name"]): item for item in value if isinstance(item, dict) and "name" in item}
+    if not isinstance(value, dict):
+        return {}
+    return {str(name): _amount(amount, "") for name, amount in value.items()}
+
+
+def validate_nutrition(data):
+    data = _canonical_keys(_single_object(data), MACRO_ALIASES, MACRO_UNITS)
+    if "calories" not in data:
+        raise ParseError("Nutrition result has no calories.")
+    for key, unit in MACRO_UNITS.items():
+        data[key] = _amount(data.get(key, 0), unit)
+    data["vitamins"] = _named_amounts(data.get("vitamins"))
+    data["minerals"] = _named_amounts(data.get("minerals"))
+    data["insight"] = str(data.get("insight") or "")
+    data["notes"] = str(data.get("notes") or "")
+    return data
+
+
+def validate_nutrition_batch(data):
+    # Invalid elements come back as None so the caller can retry just those
+    if isinstance(data, dict):
+        data = next((v for v in data.values() if isinstance(v, list)), None)
+    if not isinstance(data, list):
+        raise ParseError("Expected a JSON array of nutrition results.")
+    results = []
+    for entry in data:
+        try:
+            results.append(_validate(validate_nutrition, entry))
+        except ParseError:
+            results.append(None)
+    return results
+
+
+MEAL_NUTRITION_KEYS = ("calories", "protein", "carbs", "fats", "sugars", "fibre")
+MEAL_NUTRITION_ALIASES = dict(MACRO_ALIASES, carbs="carbs", carbohydrates="carbs", carbohydrate="carbs")
+
+
+def validate_meal_plan(data):
+    data = _single_object(data)
+    if not data.get("meal_name"):
+        raise ParseError("Meal plan has no meal_name.")
+    nutrition = data.get("nutrition")
+    if not isinstance(nutrition, dict):
+        raise ParseError("Meal plan has no nutrition object.")
+    nutrition = _canonical_keys(nutrition, MEAL_NUTRITION_ALIASES, MEAL_NUTRITION_KEYS)
+    if "calories" not in nutrition:
+        raise ParseError("Meal plan nutrition has no calories.")
+
+    ingredients = data.get("ingredients") or []
+    if isinstance(ingredients, str):
+        ingredients = [i.strip() for i in ingredients.split(",") if i.strip()]
+    preparation = data.get("preparation") or ""
+    if isinstance(preparation, list):
+        preparation = " ".join(str(step) for step in preparation)
+
+    data["meal_name"] = str(data["meal_name"])
+    data["ingredients"] = [str(i) for i in ingredients]
+    data["preparation"] = str(preparation)
+    data["nutrition"] = {key: _clean_number(nutrition.get(key, 0)) for key in MEAL_NUTRITION_KEYS}
+    data["vitamins"] = {name: amount["value"] for name, amount in _named_amounts(data.get("vitamins")).items()}
+    data["minerals"] = {name: amount["value"] for name, amount in _named_amounts(data.get("minerals")).items()}
+    data["insights"] = str(data.get("insights") or data.pop("insight", "") or "")
+    return data
+
+
+INSIGHT_KEYS = ("food_insight", "calorie_insight", "tip")
+
+
+def validate_insight(data):
+    data = _single_object(data)
+    insight = {key: str(data[key]).strip() for key in INSIGHT_KEYS if data.get(key)}
+    if not insight:
+        raise ParseError(f"Insight has none of {list(INSIGHT_KEYS)}.")
+    return insight
+
+
+def validate_calorie_explanation(data):
+    data = _single_object(data)
+    explanation = str(data.get("explanation") or "").strip()
+    if not explanation:
+        raise ParseError("Response has no explanation.")
+    return {"explanation": explanation}
+
+
+SCHEMAS = {
+    "nutrition": validate_nutrition,
+    "nutrition_batch": validate_nutrition_batch,
+    "meal_plan": validate_meal_plan,
+    "insight": validate_insight,
+    "calorie_explanation": validate_calorie_explanation,
+}
+
+
+# What a validator raises when a value has the wrong shape (a list where an object belongs,
+# an object as a name); reported as ParseError like any other unusable response
+SHAPE_ERRORS = (TypeError, AttributeError, KeyError, IndexError)
+
+
+def _validate(validator, value):
+    try:
+        return validator(value)
+    except SHAPE_ERRORS as e:
+        raise ParseError(f"Unexpected JSON structure ({type(e).__name__}: {e}).") from None
+
+
+def parse_response(kind, text):
+    # Parses and normalizes one stored or fresh completion; raises ParseError
+    value, _ = _parse(kind, text)
+    return value
+
+
+def _parse(kind, text):
+    with metrics.timer("json", kind=kind):
+        value, repaired = loads_lenient(text)
+        return _validate(SCHEMAS[kind], value), repaired
+
+
+# --- Parsing completions, with counters -------------------------------------------------
+
+class ParseStats:
+    # Per-process outcome counts for every completion that went through parse_model_response
+    OUTCOMES = ("clean", "repaired", "reasked", "failed")
+
+    def __init__(self):
+        self._counts = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def record(self, kind, outcome):
+        with self._lock:
+            self._counts[kind][outcome] += 1
+
+    def failure_rate(self, kind):
+        with self._lock:
+            counts = self._counts[kind]
+            total = sum(counts.values())
+            return counts["failed"] / total if total else 0.0
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for kind, counts in self._counts.items():
+                total = sum(counts.values())
+                result[kind] = {outcome: counts[outcome] for outcome in self.OUTCOMES}
+                result[kind]["total"] = total
+                result[kind]["failure_rate"] = round(counts["failed"] / total, 3) if total else 0.0
+            return result
+
+
+parse_stats = ParseStats()
+
+
+def corrective_prompt(error, text, schema_hint=None):
+    prompt = (
+        f"Your previous reply could not be used: {error} "
+        "Reply again with only the corrected JSON, no explanations or code fences."
+    )
+    if schema_hint:
+        prompt += f"\nIt must follow this structure:\n{schema_hint}"
+    return prompt + f"\n\nPrevious reply:\n{(text or '')[:2000]}"
+
+
+def parse_model_response(kind, text, reask=None, schema_hint=None):
+    # Returns the normalized value, or None once repairing and (if given) one corrective
+    # re-ask via reask(prompt) -> text have both failed
+    if text is None:
+        return None
+    try:
+        value, repaired = _parse(kind, text)
+        parse_stats.record(kind, "repaired" if repaired else "clean")
+        return value
+    except ParseError as e:
+        error = e
+
+    if reask is not None:
+        try:
+            value, _ = _parse(kind, reask(corrective_prompt(error, text, schema_hint)))
+            parse_stats.record(kind, "reasked")
+            print(f"--- {kind} response fixed by a corrective re-ask ---")
+            return value
+        except Exception as e:
+            error = e
+
+    parse_stats.record(kind, "failed")
+    print(f"⚠️ {kind} response could not be parsed ({error}); "
+          f"failure rate {parse_stats.failure_rate(kind):.1%}")
+    return None
@@ -0,0 +1,180 @@
+import re
+import threading
+from string import Template
+from collections import defaultdict
+from flask import current_app
+
+
+# --- Token estimates --------------------------------------------------------------------
+
+# Roughly the pre-tokenizer of OpenAI's cl100k encoding: contractions, words with their
+# leading space, numbers in groups of up to three digits, punctuation runs, whitespace
+PIECE_RE = re.compile(r"'(?:s|t|re|ve|m|ll|d)| ?[A-Za-z]+| ?\d{1,3}| ?[^\sA-Za-z\d]+|\s+")
+
+
+def estimate_tokens(text):
+    # Local approximation of the model's token count, within ~10-15% for English prose
+    # and JSON; good enough for budgeting and trends without shipping a tokenizer
+    count = 0
+    for piece in PIECE_RE.findall(text or ""):
+        body = piece.strip()
+        if not body:
+            count += 1
+        elif body[0].isalpha():
+            count += -(-len(body) // 7)
+        elif body[0].isdigit():
+            count += 1
+        else:
+            count += -(-len(body) // 2)
+    return count
+
+
+class TokenUsage:
+    # Per-process token counts and upstream latency for every model call, by prompt template.
+    # Estimates are always recorded; `reported_*` holds the API's own usage where it sent one.
+    FIELDS = ("calls", "estimated_prompt_tokens", "estimated_completion_tokens",
+              "reported_prompt_tokens", "reported_completion_tokens", "truncated", "seconds")
+
+    def __init__(self):
+        self._totals = defaultdict(lambda: dict.fromkeys(self.FIELDS, 0))
+        self._lock = threading.Lock()
+
+    def record(self, name, prompt, completion, seconds, usage=None, truncated=False):
+        with self._lock:
+            totals = self._totals[name or "other"]
+            totals["calls"] += 1
+            totals["estimated_prompt_tokens"] += estimate_tokens(prompt)
+            totals["estimated_completion_tokens"] += estimate_tokens(completion)
+            if usage is not None:
+                totals["reported_prompt_tokens"] += usage.prompt_tokens or 0
+                totals["reported_completion_tokens"] += usage.completion_tokens or 0
+            totals["truncated"] += int(truncated)
+            totals["seconds"] += seconds
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for name, totals in self._totals.items():
+                calls = totals["calls"] or 1
+                # Prefer what the API billed; fall back to the local estimate
+                prompt_tokens = totals["reported_prompt_tokens"] or totals["estimated_prompt_tokens"]
+                completion_tokens = totals["reported_completion_tokens"] or totals["estimated_completion_tokens"]
+                result[name] = {
+                    "calls": totals["calls"],
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "estimated_prompt_tokens": totals["estimated_prompt_tokens"],
+                    "estimated_completion_tokens": totals["estimated_completion_tokens"],
+                    "mean_prompt_tokens": round(prompt_tokens / calls, 1),
+                    "mean_completion_tokens": round(completion_tokens / calls, 1),
+                    "mean_latency_ms": round(totals["seconds"] / calls * 1000, 1),
+                    "truncated": totals["truncated"],
+                }
+            return result
+
+
+token_usage = TokenUsage()
+
+
+# --- Templates --------------------------------------------------------------------------
+
+class PromptTemplate:
+    # `text` uses $placeholders (string.Template), so the JSON shapes need no brace escaping.
+    # `max_tokens` is the default output budget; AI_MAX_TOKENS_<NAME> overrides it.
+    def __init__(self, name, kind, text, schema, max_tokens):
+        self.name = name
+        self.kind = kind
+        self.template = Template(text)
+        self.schema = schema
+        self.max_tokens = max_tokens
+
+    def render(self, **fields):
+        text = self.template.substitute(fields, schema=self.schema)
+        # Empty optional fields (no goal, ...) must not leave stray spaces or blank lines behind
+        text = re.sub(r"[ \t]+(?=\n|$)", "", text)
+        return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+    @property
+    def budget(self):
+        return int(current_app.config.get(f"AI_MAX_TOKENS_{self.name.upper()}", self.max_tokens))
+
+
+# Compact shapes: type names instead of worked examples, macros as bare numbers and other
+# amounts as "<number> <unit>" strings. nutritrack.parsing expands them back into the
+# {"value", "unit"} objects stored in the history, so the model writes (and we pay for)
+# far fewer tokens on both sides of the call.
+NUTRITION_SCHEMA = (
+    '{"calories":n,"protein":n,"carbohydrates":n,"fats":n,"sugars":n,"fibre":n,'
+    '"vitamins":{name:"n unit"},"minerals":{name:"n unit"},"insight":str,"notes":str}'
+)
+MEAL_PLAN_SCHEMA = (
+    '{"meal_name":str,"ingredients":[str],"preparation":str,'
+    '"nutrition":{"calories":n,"protein":n,"carbs":n,"fats":n,"sugars":n,"fibre":n},'
+    '"vitamins":{name:n},"minerals":{name:n},"insights":str}'
+)
+INSIGHT_SCHEMA = '{"food_insight":str,"calorie_insight":str,"tip":str}'
+CALORIE_EXPLANATION_SCHEMA = '{"explanation":str}'
+
+PROMPTS = {}
+
+
+def register(name, kind, text, schema, max_tokens):
+    PROMPTS[name] = PromptTemplate(name, kind, text, schema, max_tokens)
+    return PROMPTS[name]
+
+
+def get_prompt(name):
+    return PROMPTS[name]
+
+
+register("nutrition", "nutrition", """\
+You are a certified nutritionist. Give this food's nutrition as JSON. $goal_context
+Shape: $schema
+Calories in kcal, other macros in g, vitamins and minerals with their unit. insight: a short health tip about this food. notes: assumptions. JSON only.
+
+Food Name: $food_name
+Ingredients: $ingredients
+Preparation: $preparation""", NUTRITION_SCHEMA, 400)
+
+# Sent with a downscaled photo of the meal to the vision model (OPENAI_VISION_MODEL)
+register("nutrition_photo", "nutrition", """\
+You are a certified nutritionist. The photo shows the food described below; use it to judge the portion size and anything the description leaves out. Give its nutrition as JSON. $goal_context
+Shape: $schema
+Calories in kcal, other macros in g, vitamins and minerals with their unit. insight: a short health tip about this food. notes: assumptions. JSON only.
+
+Food Name: $food_name
+Ingredients: $ingredients
+Preparation: $preparation""", NUTRITION_SCHEMA, 400)
+
+# Budget per food; the batch call gets this times the number of foods
+register("nutrition_batch", "nutrition_batch", """\
+You are a certified nutritionist. Give the nutrition of each of the $count foods below. $goal_context
+Reply with a JSON array of exactly $count objects in the same order, each shaped: $schema
+Calories in kcal, other macros in g, vitamins and minerals with their unit. insight: a short health tip about that food. notes: assumptions. JSON only.
+
+Foods:
+$foods""", NUTRITION_SCHEMA, 300)
+
+register("meal_plan", "meal_plan", """\
+You are a dietitian. Create a meal plan as JSON. $goal_context
+Shape: $schema
+Calories in kcal, other nutrition in g. insights: a health recommendation. JSON only.
+
+User Requirements: $requirements""", MEAL_PLAN_SCHEMA, 500)
+
+register("insight", "insight", """\
+You are a friendly nutrition coach talking to me; say "you" and "your". From my data and goal below, give a short JSON insight shaped $schema. The tip should fit my goal. JSON only.
+
+My Data for Today:
+$details""", INSIGHT_SCHEMA, 150)
+
+register("calorie_explanation", "calorie_explanation", """\
+You are an expert nutritionist. In 3-4 friendly sentences, explain to the user how their daily calorie target was worked out and what it means for their goal. Do not change any numbers. Reply with JSON only: $schema
+
+User: $age y, $gender, $height_cm cm, $weight_kg kg, BMI $bmi, $activity_level, goal: $goal
+Calculation ($formula): BMR $bmr kcal x $activity_multiplier activity = TDEE $tdee kcal, goal adjustment $goal_adjustment kcal, recommended $recommended_calories kcal/day""",
+         CALORIE_EXPLANATION_SCHEMA, 200)
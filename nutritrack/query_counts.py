@@ -0,0 +1,76 @@
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event
+from . import db
+
+
+class QueryCounter:
+    # Records every statement the entering thread sends to the database while active;
+    # background threads (job workers, the mail sender) sharing the engine aren't counted
+    def __init__(self, engine=None):
+        self.engine = engine
+        self.statements = []
+        self._thread = None
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self._thread:
+            self.statements.append(statement)
+
+    def __enter__(self):
+        self._thread = threading.get_ident()
+        self.engine = self.engine or db.engine
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+
+@contextmanager
+def assert_max_queries(limit, engine=None):
+    # For tests: fails when the block needs more than `limit` round trips, listing them
+    with QueryCounter(engine) as counter:
+        yield counter
+    if counter.count > limit:
+        listing = "\n".join(f"  {n}. {sql}" for n, sql in enumerate(counter.statements, 1))
+        raise AssertionError(f"Expected at most {limit} queries, got {counter.count}:\n{listing}")
+
+
+# Round trips each page may take, the user lookup included, however much data the user has
+PAGE_QUERY_BUDGETS = {
+    "/dashboard": 3,
+    "/history": 2,
+    "/your-meals": 2,
+    "/profile": 4,
+    "/nutrition": 1,
+    "/plan-meal": 1,
+    "/health-details": 1,
+}
+
+
+def check_page_query_counts(app, user_id):
+    # Renders every page in PAGE_QUERY_BUDGETS as `user_id`; returns (path, status, count, budget, statements)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user_id)
+        session["_fresh"] = True
+    engine = db.engine
+
+    def get(path):
+        with QueryCounter(engine) as counter:
+            response = client.get(path)
+        return response.status_code, counter
+
+    results = []
+    # Each page is requested from a fresh thread: inside the caller's app context the requests
+    # would share its session and g, and the user would come from the identity map for free
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        for path, budget in PAGE_QUERY_BUDGETS.items():
+            status, counter = pool.submit(get, path).result()
+            results.append((path, status, counter.count, budget, counter.statements))
+    return results
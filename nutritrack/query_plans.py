@@ -0,0 +1,51 @@
+import click
+from datetime import datetime
+from sqlalchemy import select
+from . import db
+from .models import History, MealPlan
+from .rollups import today_overview_query
+
+
+def hot_queries(user_id=1):
+    # The per-user queries behind /dashboard, /history and /your-meals, and the index each must use
+    today = datetime.now().date()
+    return [
+        ("dashboard: today's entries", 'ix_history_user_timestamp', today_overview_query(user_id, today)),
+        ("dashboard: latest meal plan", 'ix_meal_plan_user_timestamp', today_overview_query(user_id, today)),
+        ("history: first page", 'ix_history_user_timestamp',
+         select(History).where(History.user_id == user_id)
+         .order_by(History.timestamp.desc(), History.id.desc()).limit(21)),
+        ("your-meals: next page", 'ix_meal_plan_user_timestamp',
+         select(MealPlan).where(MealPlan.user_id == user_id, MealPlan.timestamp < datetime.now())
+         .order_by(MealPlan.timestamp.desc(), MealPlan.id.desc()).limit(21)),
+    ]
+
+
+def explain(statement):
+    dialect = db.engine.dialect
+    compiled = statement.compile(dialect=dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+
+    with db.engine.connect() as conn:
+        if dialect.name == 'sqlite':
+            rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), params).fetchall()
+            return "\n".join(str(row[-1]) for row in rows)
+        if dialect.name == 'postgresql':
+            # Tiny tables make a sequential scan cheapest; we want to know the index is usable.
+            # SET LOCAL ends with the transaction, so the pooled connection isn't left without seqscans
+            conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            rows = conn.exec_driver_sql("EXPLAIN " + str(compiled), params).fetchall()
+            return "\n".join(row[0] for row in rows)
+    raise click.ClickException(f"check-query-plans supports SQLite and PostgreSQL, not {dialect.name}")
+
+
+def check_query_plans():
+    # Returns (name, index, uses_index, plan) for every hot query
+    results = []
+    for name, index, statement in hot_queries():
+        plan = explain(statement)
+        results.append((name, index, index in plan, plan))
+    return results
@@ -0,0 +1,63 @@
+from . import db
+from .models import History, MealPlan
+from .rollups import MACROS, add_to_daily_totals, extract_macros
+from .cache import invalidate_user_caches
+from .parsing import parse_response
+
+
+def nutrition_columns(parsed):
+    macros = extract_macros(parsed) or {}
+    return {key: macros.get(key) for key in MACROS}
+
+
+def _history_record(user_id, food_name, ingredients, raw_result):
+    parsed_result = parse_response('nutrition', raw_result)
+    record = History(
+        food_name=food_name,
+        ingredients=ingredients,
+        nutrition_result=raw_result,
+        nutrition_data=parsed_result,
+        user_id=user_id,
+        **nutrition_columns(parsed_result)
+    )
+    db.session.add(record)
+    add_to_daily_totals(record)
+    return record, parsed_result
+
+
+def save_history(user_id, food_name, ingredients, raw_result):
+    new_record, parsed_result = _history_record(user_id, food_name, ingredients, raw_result)
+    db.session.commit()
+    invalidate_user_caches(user_id, new_record.timestamp.date())
+    return new_record, parsed_result
+
+
+def save_history_batch(user_id, entries):
+    # entries: [(food_name, ingredients, raw_result), ...], all committed in one transaction.
+    # Returns (record, parsed) per entry, or None for results that aren't valid JSON.
+    saved = []
+    for food_name, ingredients, raw_result in entries:
+        try:
+            # Parsing happens before anything is added to the session
+            saved.append(_history_record(user_id, food_name, ingredients, raw_result))
+        except ValueError as e:
+            print(f"⚠️ Skipping unparsable nutrition result for '{food_name}': {e}")
+            saved.append(None)
+    db.session.commit()
+    if any(saved):
+        invalidate_user_caches(user_id, next(r for r, _ in filter(None, saved)).timestamp.date())
+    return saved
+
+
+def save_meal_plan(user_id, requirements, raw_result):
+    parsed_result = parse_response('meal_plan', raw_result)
+
+    new_plan = MealPlan(
+        requirements=requirements,
+        meal_plan_result=raw_result,
+        meal_plan_data=parsed_result,
+        user_id=user_id
+    )
+    db.session.add(new_plan)
+    db.session.commit()
+    return new_plan, parsed_result
@@ -0,0 +1,201 @@
+from datetime import datetime, date, time, timedelta
+from sqlalchemy import func, cast, Date, Float, select, literal, null, union_all
+from . import db
+from .models import User, History, MealPlan, DailyNutritionTotals, new_rollup_version
+from .parsing import to_number
+
+MACROS = ("calories", "protein", "carbohydrates", "fats", "sugars", "fibre")
+
+
+def extract_macros(data):
+    # Returns None for results that never counted towards the daily totals
+    if not isinstance(data, dict) or "calories" not in data:
+        return None
+    macros = {}
+    for key in MACROS:
+        entry = data.get(key, {})
+        macros[key] = to_number(entry.get("value", 0) if isinstance(entry, dict) else entry)
+    return macros
+
+
+def _record_macros(record):
+    if record.calories is None:
+        return None
+    return {key: getattr(record, key) or 0 for key in MACROS}
+
+
+def sql_day(column):
+    # Calendar day of a DateTime column, evaluated in the database
+    if db.engine.dialect.name == 'sqlite':
+        return func.date(column)
+    return cast(column, Date)
+
+
+def _add_to_day(user_id, day, changes):
+    # One atomic upsert, so two saves for the same user and day (a double submit, or a request
+    # racing a worker job) both count rather than one overwriting the other or failing on
+    # uq_daily_totals_user_day. SQLite supports ON CONFLICT from 3.24.
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    table = DailyNutritionTotals.__table__
+    statement = insert(table).values(user_id=user_id, day=day, **changes)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.day],
+        set_={key: table.c[key] + statement.excluded[key] for key in changes}))
+
+
+def bump_rollup_version(user_id=None):
+    # For one user, or everyone; part of the caller's transaction
+    query = User.query if user_id is None else User.query.filter_by(id=user_id)
+    query.update({User.rollup_version: new_rollup_version()}, synchronize_session=False)
+
+
+def _apply(record, macros, sign):
+    if macros is None:
+        return
+    if record.timestamp is None:
+        # Column defaults only fire on flush, and the rollup needs the day now
+        record.timestamp = datetime.now()
+    day = record.timestamp.date()
+    _add_to_day(record.user_id, day, {"food_count": sign, **{key: sign * macros[key] for key in MACROS}})
+    if (day.year, day.month) < (date.today().year, date.today().month):
+        # Only closed months are cached, so entries for the current one change nothing
+        bump_rollup_version(record.user_id)
+
+
+def add_to_daily_totals(record):
+    # Call before committing the History insert so both land in one transaction
+    _apply(record, _record_macros(record), 1)
+
+
+def remove_from_daily_totals(record):
+    _apply(record, _record_macros(record), -1)
+
+
+def get_daily_totals(user_id, day):
+    totals = DailyNutritionTotals.query.filter_by(user_id=user_id, day=day).first()
+    food_count = totals.food_count if totals else 0
+    rounded = {key: round(getattr(totals, key)) if totals else 0 for key in MACROS}
+    return rounded, food_count
+
+
+def lifetime_stats(user_id):
+    # One round trip: the counts are answered from the (user_id, timestamp) indexes and the
+    # calories from the per-day rollups, so the cost grows with active days, not entries
+    def scalar(query):
+        return query.filter_by(user_id=user_id).scalar_subquery()
+
+    history_count, meals_count, total_calories = db.session.query(
+        scalar(db.session.query(func.count(History.id))),
+        scalar(db.session.query(func.count(MealPlan.id))),
+        scalar(db.session.query(func.coalesce(func.sum(DailyNutritionTotals.calories), 0))),
+    ).one()
+    return {
+        "history_count": history_count,
+        "meals_count": meals_count,
+        "total_calories": round(total_calories or 0),
+    }
+
+
+def today_overview_query(user_id, day, limit=3):
+    # Today's latest entries and the latest meal plan as one UNION ALL, each half served by
+    # its (user_id, timestamp) index; rows are (kind, id, name, timestamp, calories)
+    start_of_day, end_of_day = datetime.combine(day, time.min), datetime.combine(day, time.max)
+    entries = select(
+        literal("entry").label("kind"), History.id, History.food_name.label("name"),
+        History.timestamp, History.calories,
+    ).where(
+        History.user_id == user_id,
+        History.timestamp.between(start_of_day, end_of_day),
+        History.calories.isnot(None),
+    ).order_by(History.timestamp.desc()).limit(limit).subquery()
+    meal_plan = select(
+        literal("meal_plan").label("kind"), MealPlan.id, MealPlan.requirements.label("name"),
+        MealPlan.timestamp, cast(null(), Float).label("calories"),
+    ).where(MealPlan.user_id == user_id).order_by(MealPlan.timestamp.desc()).limit(1).subquery()
+    return union_all(select(entries), select(meal_plan))
+
+
+def today_overview(user_id, day, limit=3):
+    # Returns (recent entries, latest meal plan or None) for the dashboard in one round trip
+    recent_entries, recent_meal = [], None
+    for kind, row_id, name, timestamp, calories in db.session.execute(today_overview_query(user_id, day, limit)):
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        if kind == "entry":
+            recent_entries.append({"food_name": name, "timestamp": timestamp, "calories": round(calories)})
+        else:
+            recent_meal = {"id": row_id, "requirements": name, "timestamp": timestamp}
+    recent_entries.sort(key=lambda entry: entry["timestamp"], reverse=True)
+    for entry in recent_entries:
+        entry["timestamp"] = entry["timestamp"].strftime("%Y-%m-%d %H:%M")
+    return recent_entries, recent_meal
+
+
+def _period_start(day, period):
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def _previous_period(start, period):
+    if period == "week":
+        return start - timedelta(days=7)
+    return (start - timedelta(days=1)).replace(day=1)
+
+
+def period_totals(user_id, period="week", count=4, today=None):
+    # Calendar weeks (Monday first) or months ending with the current one, newest first
+    if period not in ("week", "month"):
+        raise ValueError(f"Unknown period '{period}', expected 'week' or 'month'.")
+    starts = [_period_start(today or date.today(), period)]
+    for _ in range(count - 1):
+        starts.append(_previous_period(starts[-1], period))
+
+    buckets = {start: {"start": start, "food_count": 0, **{key: 0 for key in MACROS}} for start in starts}
+    days = DailyNutritionTotals.query.filter(
+        DailyNutritionTotals.user_id == user_id,
+        DailyNutritionTotals.day >= starts[-1],
+    ).all()
+    for totals in days:
+        bucket = buckets.get(_period_start(totals.day, period))
+        if bucket is None:
+            continue
+        bucket["food_count"] += totals.food_count
+        for key in MACROS:
+            bucket[key] += getattr(totals, key)
+
+    result = []
+    for start in starts:
+        bucket = buckets[start]
+        result.append({**bucket, **{key: round(bucket[key]) for key in MACROS}})
+    return result
+
+
+def rebuild_daily_totals(user_id=None, bump_versions=True):
+    rollup_query = DailyNutritionTotals.query
+    day = sql_day(History.timestamp)
+    totals_query = db.session.query(
+        History.user_id, day, func.count(History.id),
+        *[func.coalesce(func.sum(getattr(History, key)), 0) for key in MACROS]
+    ).filter(History.calories.isnot(None))
+    if user_id is not None:
+        rollup_query = rollup_query.filter_by(user_id=user_id)
+        totals_query = totals_query.filter(History.user_id == user_id)
+
+    rollup_query.delete(synchronize_session=False)
+
+    rollups = []
+    for row_user_id, row_day, food_count, *sums in totals_query.group_by(History.user_id, day).all():
+        if isinstance(row_day, str):
+            row_day = date.fromisoformat(row_day)
+        rollups.append(DailyNutritionTotals(user_id=row_user_id, day=row_day, food_count=food_count,
+                                            **dict(zip(MACROS, sums))))
+
+    db.session.add_all(rollups)
+    if bump_versions:
+        bump_rollup_version(user_id)
+    db.session.commit()
+    return len(rollups)
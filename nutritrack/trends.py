@@ -0,0 +1,152 @@
+from datetime import date, timedelta
+import numpy as np
+from . import db, trends_cache
+from .models import DailyNutritionTotals
+from .rollups import MACROS
+
+# Column 0 of every day row is the food count, followed by the macros in MACROS order
+COLUMNS = ("food_count",) + MACROS
+PERIODS = ("day", "week", "month")
+
+
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _months(start, end):
+    month = _month_start(start)
+    while month <= end:
+        yield month
+        month = _next_month(month)
+
+
+def _fetch_days(user_id, start, end):
+    # One bulk read of the per-day rollups, scattered into a (days, columns) array
+    values = np.zeros(((end - start).days + 1, len(COLUMNS)))
+    rows = db.session.query(
+        DailyNutritionTotals.day, *[getattr(DailyNutritionTotals, c) for c in COLUMNS]
+    ).filter(
+        DailyNutritionTotals.user_id == user_id,
+        DailyNutritionTotals.day.between(start, end),
+    ).all()
+    if rows:
+        offsets = np.fromiter(((row[0] - start).days for row in rows), dtype=np.int64, count=len(rows))
+        values[offsets] = np.array([row[1:] for row in rows], dtype=float)
+    return values
+
+
+def daily_values(user_id, start, end, today=None, version=None):
+    # Closed months are cached per user as they are computed, so widening or sliding a
+    # range only reads the months that haven't been seen yet; the current month is always
+    # read fresh because it changes with every entry. `version` is the user's rollup_version,
+    # which changes with any edit to a closed month.
+    today = today or date.today()
+    months = list(_months(start, end))
+    blocks = {}
+    missing = []
+    for month in months:
+        cached = trends_cache.get(f"{user_id}:{version}:{month:%Y-%m}") if _next_month(month) <= today else None
+        if cached is None:
+            missing.append(month)
+        else:
+            blocks[month] = np.array(cached, dtype=float)
+
+    if missing:
+        fetched = _fetch_days(user_id, missing[0], _next_month(missing[-1]) - timedelta(days=1))
+        for month in missing:
+            offset = (month - missing[0]).days
+            block = fetched[offset:offset + (_next_month(month) - month).days]
+            blocks[month] = block
+            if _next_month(month) <= today:
+                trends_cache.set(f"{user_id}:{version}:{month:%Y-%m}", block.tolist())
+
+    values = np.concatenate([blocks[month] for month in months])
+    offset = (start - months[0]).days
+    return values[offset:offset + (end - start).days + 1]
+
+
+def _bucket_starts(days, period):
+    # Index of the first day of every period in a contiguous run of days
+    if period == "day":
+        return np.arange(len(days))
+    if period == "week":
+        keys = [d.isocalendar()[:2] for d in days]
+    else:
+        keys = [(d.year, d.month) for d in days]
+    return np.array([0] + [i for i in range(1, len(keys)) if keys[i] != keys[i - 1]])
+
+
+def _rolling_mean(totals, logged, window):
+    # Average over the logged days inside each trailing window; days with no entries
+    # don't drag the average towards zero
+    totals_sum = np.cumsum(np.concatenate([[0.0], totals]))
+    logged_sum = np.cumsum(np.concatenate([[0.0], logged]))
+    lower = np.maximum(np.arange(1, len(totals) + 1) - window, 0)
+    upper = np.arange(1, len(totals) + 1)
+    count = logged_sum[upper] - logged_sum[lower]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, (totals_sum[upper] - totals_sum[lower]) / count, np.nan)
+
+
+def _json_series(values, digits=1):
+    return [None if np.isnan(v) else round(float(v), digits) for v in values]
+
+
+def compute_trends(user_id, start, end, period="day", window=7, target=None, tolerance=0.1, today=None,
+                   version=None):
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period '{period}', expected one of {list(PERIODS)}.")
+    if end < start:
+        raise ValueError("The end date must not be before the start date.")
+
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    values = daily_values(user_id, start, end, today=today, version=version)
+    logged = values[:, 0] > 0
+    calories = values[:, COLUMNS.index("calories")]
+
+    starts = _bucket_starts(days, period)
+    totals = np.add.reduceat(values, starts, axis=0)
+    logged_days = np.add.reduceat(logged.astype(float), starts)
+
+    if period == "day":
+        labels = [d.isoformat() for d in days]
+    elif period == "week":
+        labels = [days[i].isoformat() for i in starts]
+    else:
+        labels = [days[i].strftime("%Y-%m") for i in starts]
+
+    result = {
+        "period": period,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "labels": labels,
+        "datasets": [{"key": key, "label": key.capitalize(), "data": _json_series(totals[:, i])}
+                     for i, key in enumerate(COLUMNS) if key != "food_count"],
+        "food_count": [int(v) for v in totals[:, 0]],
+        "rolling_average": {
+            "window": window,
+            "labels": [d.isoformat() for d in days],
+            "calories": _json_series(_rolling_mean(calories, logged, window)),
+        },
+        "adherence": None,
+    }
+
+    if target:
+        within = logged & (np.abs(calories - target) <= target * tolerance)
+        within_days = np.add.reduceat(within.astype(float), starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rate = np.where(logged_days > 0, within_days / logged_days, np.nan)
+        total_logged = int(logged.sum())
+        result["adherence"] = {
+            "target": target,
+            "tolerance": tolerance,
+            "days_logged": total_logged,
+            "days_within": int(within.sum()),
+            "rate": round(float(within.sum()) / total_logged, 3) if total_logged else None,
+            "per_period": _json_series(rate, 3),
+        }
+    return result
@@ -1,123 +1,267 @@
-import os
+import re
 import json
-import openai
 from datetime import date
+from flask import current_app
+from . import analysis_cache, photo_cache, ai_client
+from .food_db import lookup_nutrition
+from .parsing import parse_model_response
+from .prompts import get_prompt
+
+
+def _normalize_text(value):
+    return re.sub(r"\s+", " ", (value or "").strip().lower())
+
+
+def analysis_cache_key(food_name, ingredients, preparation, user_goal=None):
+    # "2 Boiled Eggs" / "2 boiled  eggs" and reordered ingredient lists share one entry
+    ingredient_list = sorted(filter(None, (_normalize_text(i) for i in (ingredients or "").split(","))))
+    return analysis_cache.digest(
+        _normalize_text(food_name), ingredient_list, _normalize_text(preparation), _normalize_text(user_goal)
+    )
+
+
+def _complete(prompt, images=None, **fields):
+    # Renders a registered template and sends it with that template's output budget
+    return ai_client.chat_completion(prompt.render(**fields), max_tokens=prompt.budget, label=prompt.name,
+                                     images=images)
+
+
+def _model_json(prompt, raw):
+    # Parses a completion through the shared parsing layer; a corrective re-ask (another,
+    # much shorter completion) is only spent when repairing the first answer failed
+    reask = None
+    if current_app.config.get('AI_REASK', True):
+        def reask(text):
+            return ai_client.chat_completion(text, max_tokens=prompt.budget, label=f"{prompt.name}_reask")
+    return parse_model_response(prompt.kind, raw, reask=reask, schema_hint=prompt.schema)
+
+
+def _model_json_text(prompt, raw):
+    # Same, re-serialized so callers store and cache the normalized JSON
+    parsed = _model_json(prompt, raw)
+    return json.dumps(parsed) if parsed is not None else None
+
+
+def _goal_context(user_goal, text):
+    return text.format(user_goal) if user_goal else ""
+
+
+def _known_nutrition(food_name, ingredients, preparation, user_goal=None):
+    # Local food database, then the shared cache; returns (result, cache_key, cached)
+    if current_app.config.get('LOCAL_FOOD_DB', True):
+        local_result = lookup_nutrition(food_name, ingredients, preparation)
+        if local_result:
+            print("--- analyze_nutrition served from the local food database ---")
+            return local_result, None, None
+
+    cache_key = analysis_cache_key(food_name, ingredients, preparation, user_goal)
+    cached = analysis_cache.get(cache_key)
+    if cached is not None and current_app.config.get('ANALYSIS_CACHE_SERVE', True):
+        print("--- analyze_nutrition served from cache ---")
+        return cached, cache_key, cached
+    return None, cache_key, cached
+
+
+def _remember_nutrition(cache_key, cached, result):
+    if result and cached is None:
+        try:
+            if "calories" in json.loads(result):
+                analysis_cache.set(cache_key, result)
+        except ValueError:
+            pass
+
 
 def analyze_nutrition(photo, food_name, ingredients, preparation, user_goal=None):
+    # `photo` is an images.MealPhoto or None
     print("--- Entering analyze_nutrition function ---")
-    goal_context = f"Keep in mind that my primary goal is {user_goal}." if user_goal else ""
-
-    prompt = (
-        "You are a certified nutritionist AI. Provide a detailed nutrition breakdown as JSON. "
-        "The 'insight' should be a short health recommendation about this specific food. "
-        f"{goal_context} Your response must follow this exact JSON structure:\n"
-        "{ \"calories\": {\"value\": number, \"unit\": \"kcal\"}, \"protein\": {\"value\": number, \"unit\": \"g\"}, "
-        "\"carbohydrates\": {\"value\": number, \"unit\": \"g\"}, \"fats\": {\"value\": number, \"unit\": \"g\"}, "
-        "\"sugars\": {\"value\": number, \"unit\": \"g\"}, \"fibre\": {\"value\": number, \"unit\": \"g\"}, "
-        "\"vitamins\": {\"Vitamin A\": {\"value\": number, \"unit\": \"mcg\"}, \"Vitamin C\": {\"value\": number, \"unit\": \"mg\"}}, "
-        "\"minerals\": {\"Calcium\": {\"value\": number, \"unit\": \"mg\"}, \"Iron\": {\"value\": number, \"unit\": \"mg\"}}, "
-        "\"insight\": \"Short health recommendation\", \"notes\": \"Any assumptions\"}\n"
-        "Respond with valid JSON only.\n\n"
-        f"Food Name: {food_name}\nIngredients: {ingredients}\nPreparation: {preparation}"
-    )
+    if photo is not None:
+        result = _analyze_nutrition_photo(photo, food_name, ingredients, preparation, user_goal)
+        if result:
+            return result
+        print("--- Photo analysis failed; analyzing the description alone ---")
+    known, cache_key, cached = _known_nutrition(food_name, ingredients, preparation, user_goal)
+    if known:
+        return known
+
+    result = _analyze_nutrition_with_model(food_name, ingredients, preparation, user_goal)
+    if result is None and cached is not None:
+        # The model is unavailable, but an earlier answer for the same food is better than none
+        print("--- analyze_nutrition fell back to the cache ---")
+        return cached
+    _remember_nutrition(cache_key, cached, result)
+    return result
+
+
+def _analyze_nutrition_with_model(food_name, ingredients, preparation, user_goal=None):
+    prompt = get_prompt("nutrition")
     try:
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=500
-        )
-        return response.choices[0].message.content.strip()
+        raw = _complete(prompt, food_name=food_name, ingredients=ingredients, preparation=preparation,
+                        goal_context=_goal_context(user_goal, "My primary goal is {}."))
+        return _model_json_text(prompt, raw)
     except Exception as e:
         print(f"OpenAI Nutrition Error: {e}")
         return None
 
 
-def generate_meal_plan(requirements, user_goal=None):
-    print("--- Entering plan_meal function ---")
-    goal_context = f"The entire meal plan should be tailored to help me achieve my goal of {user_goal}." if user_goal else ""
-
-    prompt = (
-        "You are a dietitian AI. Provide a meal plan JSON. The 'insights' should be a health recommendation. "
-        f"{goal_context} Your response must follow this exact JSON structure:\n"
-        "{ \"meal_name\": \"string\", \"ingredients\": [\"list\"], \"preparation\": \"string\", "
-        "\"nutrition\": {\"calories\": number, \"protein\": number, \"carbs\": number, \"fats\": number, \"sugars\": number, \"fibre\": number}, "
-        "\"vitamins\": {\"Vitamin A\": number, \"Vitamin C\": number}, \"minerals\": {\"Calcium\": number, \"Iron\": number}, "
-        "\"insights\": \"Health recommendation\"}\n"
-        "Respond only with JSON.\n\n"
-        f"User Requirements: {requirements}"
+def _analyze_nutrition_photo(photo, food_name, ingredients, preparation, user_goal=None):
+    # Near-identical photos of the same described meal share one answer
+    context_key = analysis_cache_key(food_name, ingredients, preparation, user_goal)
+    cached = photo_cache.get(context_key, photo.phash)
+    if cached is not None:
+        print("--- analyze_nutrition served from the photo cache ---")
+        return cached
+
+    prompt = get_prompt("nutrition_photo")
+    try:
+        raw = _complete(prompt, images=[(photo.data_url, current_app.config['MEAL_PHOTO_DETAIL'])],
+                        food_name=food_name, ingredients=ingredients, preparation=preparation,
+                        goal_context=_goal_context(user_goal, "My primary goal is {}."))
+        result = _model_json_text(prompt, raw)
+    except Exception as e:
+        print(f"OpenAI Photo Nutrition Error: {e}")
+        return None
+    if result and "calories" in json.loads(result):
+        photo_cache.set(context_key, photo.phash, result)
+    return result
+
+
+def analyze_nutrition_batch(items, user_goal=None):
+    # items: [{"food_name", "ingredients", "preparation"}, ...]. Returns one raw JSON string
+    # (or None) per item, in order. Foods the database or cache can't answer share a single
+    # completion; anything missing or malformed in its answer is retried on its own.
+    print(f"--- Entering analyze_nutrition_batch function ({len(items)} items) ---")
+    results = [None] * len(items)
+    pending = []
+    for i, item in enumerate(items):
+        known, cache_key, cached = _known_nutrition(item['food_name'], item['ingredients'],
+                                                    item['preparation'], user_goal)
+        if known:
+            results[i] = known
+        else:
+            pending.append((i, cache_key, cached))
+
+    if len(pending) > 1:
+        answers = _analyze_nutrition_batch_with_model([items[i] for i, _, _ in pending], user_goal)
+        for (i, cache_key, cached), answer in zip(pending, answers):
+            if answer is not None:
+                results[i] = json.dumps(answer)
+                _remember_nutrition(cache_key, cached, results[i])
+
+    for i, cache_key, cached in pending:
+        if results[i] is None:
+            item = items[i]
+            results[i] = _analyze_nutrition_with_model(item['food_name'], item['ingredients'],
+                                                       item['preparation'], user_goal)
+            _remember_nutrition(cache_key, cached, results[i])
+    return results
+
+
+def _analyze_nutrition_batch_with_model(items, user_goal=None):
+    # Returns a list aligned with items holding the parsed result, or None where it was unusable
+    prompt = get_prompt("nutrition_batch")
+    foods = "\n".join(
+        f"{n}. {item['food_name']}; Ingredients: {item['ingredients']}; Preparation: {item['preparation']}"
+        for n, item in enumerate(items, 1)
     )
     try:
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=500
+        # The template's budget is per food
+        raw = ai_client.chat_completion(
+            prompt.render(count=len(items), foods=foods, goal_context=_goal_context(user_goal, "My primary goal is {}.")),
+            max_tokens=prompt.budget * len(items), label=prompt.name,
         )
-        return response.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"OpenAI Batch Nutrition Error: {e}")
+        return [None] * len(items)
+
+    # No re-ask here: the per-item fallback is the retry for anything unusable
+    answer = parse_model_response("nutrition_batch", raw) or []
+    return answer[:len(items)] + [None] * (len(items) - len(answer))
+
+
+def _meal_plan_fields(requirements, user_goal=None):
+    return {"requirements": requirements,
+            "goal_context": _goal_context(user_goal, "Tailor it to my goal of {}.")}
+
+
+def generate_meal_plan(requirements, user_goal=None):
+    print("--- Entering plan_meal function ---")
+    prompt = get_prompt("meal_plan")
+    try:
+        raw = _complete(prompt, **_meal_plan_fields(requirements, user_goal))
+        return _model_json_text(prompt, raw)
     except Exception as e:
         print(f"OpenAI Meal Plan Error: {e}")
         return None
 
 
+def stream_meal_plan(requirements, user_goal=None):
+    # Yields the completion piece by piece; errors propagate to the caller
+    print("--- Entering stream_meal_plan function ---")
+    prompt = get_prompt("meal_plan")
+    yield from ai_client.stream_chat_completion(prompt.render(**_meal_plan_fields(requirements, user_goal)),
+                                                max_tokens=prompt.budget, label=prompt.name)
+
+
+def finish_streamed_meal_plan(raw):
+    # The streamed text gets the same repair / re-ask treatment as a regular completion
+    return _model_json_text(get_prompt("meal_plan"), raw)
+
+
 def get_daily_insight(totals, food_count, calorie_target=None, user_goal=None):
     print("--- Entering get_daily_insight function ---")
-    prompt_details = (
-        f"Your totals today: Calories: {totals['calories']} kcal, Protein: {totals['protein']} g, "
-        f"Fats: {totals['fats']} g.\nTotal foods logged: {food_count}."
+    details = (
+        f"Calories: {totals['calories']} kcal, Protein: {totals['protein']} g, Fats: {totals['fats']} g. "
+        f"Foods logged: {food_count}."
     )
     if calorie_target:
-        prompt_details += f"\nYour recommended calorie target is {calorie_target} kcal."
+        details += f"\nCalorie target: {calorie_target} kcal."
     if user_goal:
-        prompt_details += f"\nYour current goal is: {user_goal}."
-
-    prompt = (
-        "You are a helpful and friendly nutrition coach speaking directly to me, the user. "
-        "Use a supportive tone and the words 'You' and 'Your'. "
-        "Based on my data and my primary goal below, provide a short JSON insight with three keys: "
-        "'food_insight', 'calorie_insight', and 'tip'. The tip should be relevant to my goal.\n\n"
-        f"My Data for Today:\n{prompt_details}\n\nRespond with valid JSON only."
-    )
+        details += f"\nGoal: {user_goal}."
+
+    prompt = get_prompt("insight")
     try:
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=200
-        )
-        return response.choices[0].message.content.strip()
+        return _model_json(prompt, _complete(prompt, details=details))
     except Exception as e:
         print(f"OpenAI Insight Error: {e}")
         return None
 
 
-def get_calorie_recommendation_from_openai(user):
-    if not all([user.weight_kg, user.height_cm, user.dob, user.activity_level, user.gender, user.goal]):
-        return None
+def fallback_daily_insight(totals, food_count, calorie_target=None):
+    # Shown (and not cached) when the model can't be reached
+    insight = {"food_insight": f"You've logged {food_count} food{'s' if food_count != 1 else ''} today, "
+                               f"with {totals['protein']} g of protein."}
+    if calorie_target:
+        remaining = calorie_target - totals['calories']
+        insight["calorie_insight"] = (f"You have {remaining} kcal left of your {calorie_target} kcal target."
+                                      if remaining >= 0 else
+                                      f"You are {-remaining} kcal over your {calorie_target} kcal target.")
+    return insight
 
-    age = calculate_age(user.dob)
-    bmi = calculate_bmi(user)
-
-    prompt = (
-        "You are an expert nutritionist. Based on the following user data, calculate the recommended daily calorie intake. "
-        "First, calculate the user's Total Daily Energy Expenditure (TDEE). Then, adjust this value based on their goal: "
-        "for 'Weight Loss', create a sensible deficit (around 300-500 kcal); "
-        "for 'Weight Gain', create a sensible surplus (around 300-500 kcal); "
-        "for 'Maintain Weight', stick to the TDEE. "
-        "Also consider their BMI in your final recommendation. "
-        "Respond ONLY with a valid JSON object in the format {\"recommended_calories\": number}.\n\n"
-        f"User Data:\n- Age: {age}\n- Gender: {user.gender}\n- Height: {user.height_cm} cm\n"
-        f"- Weight: {user.weight_kg} kg\n- BMI: {bmi}\n- Activity Level: {user.activity_level}\n"
-        f"- Primary Goal: {user.goal}"
-    )
+
+def _local_calorie_explanation(breakdown):
+    return (f"Your body burns about {breakdown['bmr']} kcal a day at rest ({breakdown['formula']} equation). "
+            f"Multiplied by {breakdown['activity_multiplier']} for your activity level, that is about "
+            f"{breakdown['tdee']} kcal a day. Adjusting by {breakdown['goal_adjustment']:+d} kcal for your goal "
+            f"gives your target of {breakdown['recommended_calories']} kcal.")
+
+
+def explain_calorie_target(user, breakdown):
+    # The target itself comes from nutritrack.calories; the model only puts it into words
+    prompt = get_prompt("calorie_explanation")
     try:
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=50
-        )
-        data = json.loads(response.choices[0].message.content.strip())
-        return int(data.get("recommended_calories"))
+        raw = _complete(prompt, age=breakdown['age'], gender=user.gender, height_cm=user.height_cm,
+                        weight_kg=user.weight_kg, bmi=calculate_bmi(user), activity_level=user.activity_level,
+                        goal=user.goal, formula=breakdown['formula'], bmr=breakdown['bmr'],
+                        activity_multiplier=breakdown['activity_multiplier'], tdee=breakdown['tdee'],
+                        goal_adjustment=f"{breakdown['goal_adjustment']:+d}",
+                        recommended_calories=breakdown['recommended_calories'])
+        data = _model_json(prompt, raw)
+        if data:
+            return data["explanation"]
     except Exception as e:
-        print(f"OpenAI Calorie Recommendation Error: {e}")
-        return None
+        print(f"OpenAI Calorie Explanation Error: {e}")
+    return _local_calorie_explanation(breakdown)
+
 
 def calculate_age(dob):
     if not dob: